@@ -11,6 +11,7 @@ echo "Building Lambda bundle."
 echo "Copying files to lambda-build ..."
 mkdir lambda-build
 cp -R ./src/lambda_function lambda-build/.
+cp -R ./src/shared lambda-build/.
 cd lambda-build
 
 echo "Running pip install ..."
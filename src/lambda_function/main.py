@@ -1,8 +1,8 @@
 import os
 import logging
-import requests
-import boto3
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 import ask_sdk_core.utils as ask_utils
 
 from ask_sdk_core.skill_builder import SkillBuilder
@@ -10,20 +10,41 @@ from ask_sdk_core.dispatch_components import AbstractRequestHandler
 from ask_sdk_core.dispatch_components import AbstractExceptionHandler
 from ask_sdk_core.handler_input import HandlerInput
 
-from ask_sdk_s3.adapter import S3Adapter
 from ask_sdk_core.skill_builder import CustomSkillBuilder
 
 from ask_sdk_model import Response
 from ask_sdk_model import ui
 import lambda_function.utils as utils
+import lambda_function.persistence as persistence
+from lambda_function.relay import RelayPublisher, RelayDeliveryUnknown
+from lambda_function.resolve import Resolver
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 AWS_SNS_ARN = os.getenv('AWS_SNS_ARN')
 AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET')
+AWS_DYNAMODB_TABLE = os.getenv('AWS_DYNAMODB_TABLE')
+PERSISTENCE_BACKEND = os.getenv('PERSISTENCE_BACKEND', persistence.PERSISTENCE_BACKEND_S3)
+ATTRIBUTES_CACHE_TTL = float(os.getenv('ATTRIBUTES_CACHE_TTL', persistence.DEFAULT_CACHE_TTL))
 CARD_TITLE = 'Alexa Chromecast Controller'
 
+PUBLISH_MODE_SYNC = 'sync'
+PUBLISH_MODE_ASYNC = 'async'
+# async: publish to SNS while the reply is built, then wait at most PUBLISH_TIMEOUT seconds for it
+PUBLISH_MODE = os.getenv('PUBLISH_MODE', PUBLISH_MODE_ASYNC)
+PUBLISH_TIMEOUT = float(os.getenv('PUBLISH_TIMEOUT', '3'))
+PUBLISH_PENDING_RESPONSE = 'Sending that to the Chromecast'
+# Optional relay the local listener keeps a connection open to; SNS is used when it can't deliver
+RELAY_URL = os.getenv('RELAY_URL')
+RELAY_TOKEN = os.getenv('RELAY_TOKEN')
+# Look up YouTube videos and trailers here, so the listener needn't search. Started when the intent arrives and
+# waited for, up to RESOLVE_TIMEOUT from then, just before publishing
+RESOLVE_IN_CLOUD = os.getenv('RESOLVE_IN_CLOUD', 'false').lower() == 'true'
+RESOLVE_TIMEOUT = float(os.getenv('RESOLVE_TIMEOUT', '1'))
+
+publish_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='publish')
+
 HELP_TEXT = ''.join([
     "Welcome to the Alexa Chromecast controller. This skill allows you to control your Chromecasts in different rooms. ",
     "An Alexa Device can be configured to control a Chromecast in a particular room. ",
@@ -31,6 +52,14 @@ HELP_TEXT = ''.join([
     "Or you can control a specific room, by saying something like: Alexa, ask Chromecast to play in the media room."
 ])
 
+def get_sns_client():
+    # The region is taken from the topic ARN, so the client can be created before the first request
+    region = AWS_SNS_ARN.split(':')[3] if AWS_SNS_ARN and AWS_SNS_ARN.count(':') >= 5 else None
+    return utils.get_client('sns', region_name=region)
+
+relay_publisher = RelayPublisher(RELAY_URL, RELAY_TOKEN, timeout=utils.AWS_READ_TIMEOUT) if RELAY_URL else None
+resolver = Resolver(RESOLVE_TIMEOUT) if RESOLVE_IN_CLOUD else None
+
 class SNSPublishError(Exception):
     """ If something goes wrong with publishing to SNS """
     pass
@@ -77,7 +106,14 @@ class BaseIntentHandler(AbstractRequestHandler):
     def get_response(self, data):
         return 'Ok'
 
+    def start_lookups(self, data):
+        """ Start looking up anything to add to the data sent, as {key: PendingLookup}, see RESOLVE_IN_CLOUD """
+        return {}
+
     def handle(self, handler_input):
+        data = self.get_data(handler_input)
+        # Runs while the room is looked up, and is only waited for when publishing
+        lookups = self.start_lookups(data) if resolver else {}
         room = utils.get_slot_value(handler_input, 'room', False)
         device_id = handler_input.request_envelope.context.system.device.device_id
 
@@ -94,15 +130,24 @@ class BaseIntentHandler(AbstractRequestHandler):
                 )
 
         try:
-            data = self.get_data(handler_input)
-            self.publish_command_to_sns(room, self.get_action(), data)
+            publish = self.start_publish(room, self.get_action(), data, lookups)
             speak_output = self.get_response(data)
-            return (
+            response = (
                 handler_input.response_builder
                     .speak(speak_output)
                     .set_card(ui.SimpleCard(CARD_TITLE, speak_output))
                     .response
             )
+            if not self.wait_for_publish(publish):
+                # It may still get through, so neither 'playing' nor an error
+                speak_output = PUBLISH_PENDING_RESPONSE
+                response = (
+                    handler_input.response_builder
+                        .speak(speak_output)
+                        .set_card(ui.SimpleCard(CARD_TITLE, speak_output))
+                        .response
+                )
+            return response
         except SNSPublishError as error:
             logger.error('Sending command to the Chromecast failed', exc_info=error)
             speak_output = 'There was an error sending the command to the Chromecast'
@@ -113,26 +158,106 @@ class BaseIntentHandler(AbstractRequestHandler):
                     .response
             )
 
+    def start_publish(self, room, command, data, lookups=None):
+        """ Start sending the command, returns a Future for the publish """
+        if PUBLISH_MODE == PUBLISH_MODE_SYNC:
+            future = Future()
+            try:
+                future.set_result(self.timed_publish(room, command, data, lookups))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return publish_executor.submit(self.timed_publish, room, command, data, lookups)
+
+    def wait_for_publish(self, future):
+        """ True once the publish is done, False if it is still running after PUBLISH_TIMEOUT """
+        started = time.perf_counter()
+        try:
+            future.result(timeout=PUBLISH_TIMEOUT)
+            return True
+        except FutureTimeoutError:
+            # SNS retries can outlast PUBLISH_TIMEOUT and still succeed, or the Lambda container can be
+            # frozen as soon as it replies and never finish, so it isn't known whether the command was sent
+            logger.warning('SNS publish did not finish within %.1fs' % PUBLISH_TIMEOUT)
+            return False
+        except SNSPublishError:
+            raise
+        except Exception as e:
+            raise SNSPublishError('SNS Publish failed: %s' % e) from e
+        finally:
+            logger.info('Waited %.1fms for SNS publish (%s mode)' % ((time.perf_counter() - started) * 1000, PUBLISH_MODE))
+
+    def timed_publish(self, room, command, data, lookups=None):
+        if lookups:
+            # Started when the intent arrived, so usually done by now
+            resolve_started = time.perf_counter()
+            for key, lookup in lookups.items():
+                value = lookup.result()
+                if value:
+                    data[key] = value
+            logger.info('Waited %.1fms for lookups for %s' % ((time.perf_counter() - resolve_started) * 1000, command))
+        started = time.perf_counter()
+        try:
+            return self.publish_command_to_sns(room, command, data)
+        finally:
+            logger.info('SNS publish of %s took %.1fms' % (command, (time.perf_counter() - started) * 1000))
+
     def publish_command_to_sns(self, room, command, data):
-        message = {
-            "handler_name": "chromecast",
-            "room": room,
-            "command": command,
-            "data": data
-        }
-        sns_client = boto3.client("sns")
-        response = sns_client.publish(
-            TargetArn=AWS_SNS_ARN,
-            Message=json.dumps({"default": json.dumps(message)}),
-            MessageStructure="json"
-        )
+        publish_message(command_message(room, command, data))
 
-        print(response["ResponseMetadata"])
+    def publish_batch_to_sns(self, rooms, commands, stop_on_error=True):
+        publish_message(batch_message(rooms, commands, stop_on_error))
 
-        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            message = "SNS Publish returned {} response instead of 200.".format(
-                response["ResponseMetadata"]["HTTPStatusCode"])
-            raise SNSPublishError(message)
+def command_message(room, command, data):
+    return {
+        "handler_name": "chromecast",
+        "room": room,
+        "command": command,
+        "data": data
+    }
+
+def batch_message(rooms, commands, stop_on_error=True):
+    """
+    Several commands sent in one message, and run in order in each room.
+    commands is a list of (command, data) tuples.
+    """
+    return {
+        "handler_name": "chromecast",
+        "rooms": rooms,
+        "commands": [{"command": command, "data": data} for command, data in commands],
+        "stop_on_error": stop_on_error
+    }
+
+def publish_message(message):
+    """ Send a message over the relay if a listener is connected to it, otherwise to SNS """
+    if relay_publisher:
+        try:
+            if relay_publisher.publish(message):
+                return
+            logger.warning('No listener connected to the relay, publishing to SNS')
+        except RelayDeliveryUnknown as e:
+            # Sending it to SNS as well could run the command twice
+            logger.warning('Relay delivery unknown, not publishing to SNS: %s' % e)
+            return
+        except Exception as e:
+            logger.warning('Relay publish failed, publishing to SNS: %s' % e)
+        if not AWS_SNS_ARN:
+            raise SNSPublishError('Relay publish failed and no SNS topic is set')
+    publish_message_to_sns(message)
+
+def publish_message_to_sns(message):
+    response = get_sns_client().publish(
+        TargetArn=AWS_SNS_ARN,
+        Message=json.dumps({"default": json.dumps(message)}),
+        MessageStructure="json"
+    )
+
+    logger.debug(response["ResponseMetadata"])
+
+    if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+        message = "SNS Publish returned {} response instead of 200.".format(
+            response["ResponseMetadata"]["HTTPStatusCode"])
+        raise SNSPublishError(message)
 
 class SetRoomIntentHandler(BaseIntentHandler):
 
@@ -194,6 +319,16 @@ class PreviousIntentHandler(BaseIntentHandler):
     def get_action(self):
         return 'play-previous'
 
+class PlayItemIntentHandler(BaseIntentHandler):
+    def get_action(self):
+        return 'play-item'
+
+    def get_data(self, handler_input):
+        return {"position": int(utils.get_slot_value(handler_input, 'position'))}
+
+    def get_response(self, data):
+        return 'Playing number %i' % data['position']
+
 class RestartIntentHandler(BaseIntentHandler):
     def get_action(self):
         return 'restart'
@@ -208,6 +343,10 @@ class PlayTrailerIntentHandler(BaseIntentHandler):
     def get_response(self, data):
         return 'Playing trailer for %s' % data['title']
 
+    def start_lookups(self, data):
+        trailer = resolver.trailer(data['title'])
+        return {'youtube_id': trailer} if trailer else {}
+
 class PlayOnAppIntentHandler(BaseIntentHandler):
     def get_action(self):
         return 'play-video'
@@ -222,6 +361,9 @@ class PlayOnAppIntentHandler(BaseIntentHandler):
     def get_response(self, data):
         return 'Playing %s on YouTube' % data['title']
 
+    def start_lookups(self, data):
+        return {'videos': resolver.videos(data['title'])}
+
 class HelpIntentHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
         return ask_utils.is_intent_name("AMAZON.HelpIntent")(handler_input)
@@ -307,9 +449,13 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
 # payloads to the handlers above. Make sure any new handlers or interceptors you've
 # defined are included below. The order matters - they're processed top to bottom.
 try:
-    s3_adapter = S3Adapter(bucket_name=AWS_S3_BUCKET)
+    # Clients are created while the Lambda container starts, and reused by every invocation
+    persistence_adapter = persistence.create_adapter(
+        PERSISTENCE_BACKEND, bucket_name=AWS_S3_BUCKET, table_name=AWS_DYNAMODB_TABLE, ttl=ATTRIBUTES_CACHE_TTL)
+    if AWS_SNS_ARN:
+        get_sns_client()
 
-    sb = CustomSkillBuilder(persistence_adapter=s3_adapter)
+    sb = CustomSkillBuilder(persistence_adapter=persistence_adapter)
 
     sb.add_request_handler(LaunchRequestHandler())
 
@@ -320,6 +466,7 @@ try:
     sb.add_request_handler(SetVolumeIntentHandler())
     sb.add_request_handler(PreviousIntentHandler())
     sb.add_request_handler(NextIntentHandler())
+    sb.add_request_handler(PlayItemIntentHandler())
 
     sb.add_request_handler(RestartIntentHandler())
     sb.add_request_handler(PlayTrailerIntentHandler())
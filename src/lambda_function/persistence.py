@@ -0,0 +1,135 @@
+import copy
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from ask_sdk_core.attributes_manager import AbstractPersistenceAdapter
+from ask_sdk_core.exceptions import PersistenceException
+from ask_sdk_s3.object_keygen import user_id_keygen
+import lambda_function.utils as utils
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_BACKEND_S3 = 's3'
+PERSISTENCE_BACKEND_DYNAMODB = 'dynamodb'
+PERSISTENCE_BACKENDS = [PERSISTENCE_BACKEND_S3, PERSISTENCE_BACKEND_DYNAMODB]
+
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_SIZE = 1024
+
+class CachingAdapter(AbstractPersistenceAdapter):
+    """
+    Keeps persistent attributes in the warm Lambda container, so most
+    invocations don't read from the backing store. Saves and deletes go
+    straight through to the store and update the cached copy.
+
+    Other Lambda containers only see a change once their copy expires, so
+    keep the TTL short if more than one container is likely to be running.
+    """
+
+    def __init__(self, adapter, ttl=DEFAULT_CACHE_TTL, size=DEFAULT_CACHE_SIZE, object_keygen=user_id_keygen):
+        self.adapter = adapter
+        self.ttl = ttl
+        self.size = size
+        self.object_keygen = object_keygen
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __put(self, key, attributes):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(attributes))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get_attributes(self, request_envelope):
+        key = self.object_keygen(request_envelope)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                # The attributes manager changes the dict it is given before saving it
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        logger.debug('Reading persistent attributes from %s' % type(self.adapter).__name__)
+        attributes = self.adapter.get_attributes(request_envelope)
+        self.__put(key, attributes)
+        return attributes
+
+    def save_attributes(self, request_envelope, attributes):
+        key = self.object_keygen(request_envelope)
+        try:
+            self.adapter.save_attributes(request_envelope, attributes)
+        except Exception:
+            # The store may or may not have the new value, so read it again next time
+            self.invalidate(key)
+            raise
+        self.__put(key, attributes)
+
+    def delete_attributes(self, request_envelope):
+        key = self.object_keygen(request_envelope)
+        try:
+            self.adapter.delete_attributes(request_envelope)
+        finally:
+            self.invalidate(key)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class DynamoDbAdapter(AbstractPersistenceAdapter):
+    """
+    Keeps the attributes as a JSON string in a DynamoDB table, which usually
+    answers faster than S3. The table needs a string partition key called id.
+    """
+
+    def __init__(self, table_name, dynamodb_client=None, object_keygen=user_id_keygen):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or utils.get_client('dynamodb')
+        self.object_keygen = object_keygen
+
+    def get_attributes(self, request_envelope):
+        try:
+            item = self.dynamodb_client.get_item(
+                TableName=self.table_name,
+                Key={'id': {'S': self.object_keygen(request_envelope)}}
+            ).get('Item')
+            if not item or 'attributes' not in item:
+                return {}
+            return json.loads(item['attributes']['S'])
+        except Exception as e:
+            raise PersistenceException('Failed to get attributes from DynamoDB table %s: %s' % (self.table_name, e))
+
+    def save_attributes(self, request_envelope, attributes):
+        try:
+            self.dynamodb_client.put_item(TableName=self.table_name, Item={
+                'id': {'S': self.object_keygen(request_envelope)},
+                'attributes': {'S': json.dumps(attributes)}
+            })
+        except Exception as e:
+            raise PersistenceException('Failed to save attributes to DynamoDB table %s: %s' % (self.table_name, e))
+
+    def delete_attributes(self, request_envelope):
+        try:
+            self.dynamodb_client.delete_item(
+                TableName=self.table_name,
+                Key={'id': {'S': self.object_keygen(request_envelope)}}
+            )
+        except Exception as e:
+            raise PersistenceException('Failed to delete attributes from DynamoDB table %s: %s' % (self.table_name, e))
+
+def create_adapter(backend, bucket_name=None, table_name=None, ttl=DEFAULT_CACHE_TTL):
+    """ The persistence adapter for the skill. A TTL of 0 turns caching off. """
+    if backend == PERSISTENCE_BACKEND_DYNAMODB:
+        adapter = DynamoDbAdapter(table_name)
+    elif backend == PERSISTENCE_BACKEND_S3:
+        from ask_sdk_s3.adapter import S3Adapter
+        adapter = S3Adapter(bucket_name=bucket_name, s3_client=utils.get_client('s3'))
+    else:
+        raise ValueError('Unknown persistence backend %s, expected one of %s' % (backend, PERSISTENCE_BACKENDS))
+    if ttl > 0:
+        return CachingAdapter(adapter, ttl)
+    return adapter
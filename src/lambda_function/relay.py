@@ -0,0 +1,93 @@
+import ssl
+import json
+import uuid
+import socket
+import logging
+import threading
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+"""
+Publishes commands to a relay the local listener keeps a connection open
+to (see local/relay.py for the protocol). The connection is kept open while
+the Lambda container is warm, so most commands need a single round trip.
+"""
+
+class RelayError(Exception):
+    """ If the relay can't be reached or rejects a message """
+    pass
+
+class RelayDeliveryUnknown(RelayError):
+    """
+    If the message was sent but no reply came back. The relay may well have
+    passed it on, so it shouldn't be sent again by any other route.
+    """
+    pass
+
+class RelayPublisher:
+
+    def __init__(self, url, token=None, timeout=2):
+        parsed = urlparse(url if '://' in url else 'tcp://' + url)
+        if parsed.scheme not in ('tcp', 'tls') or not parsed.hostname or not parsed.port:
+            raise ValueError('Relay URL should look like tcp://host:port or tls://host:port, not %s' % url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.tls = parsed.scheme == 'tls'
+        self.token = token
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def __connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def close(self):
+        if self.sock:
+            try:
+                self.reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def __receive(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Relay closed the connection')
+        return json.loads(line)
+
+    def publish(self, message):
+        """ Returns the number of listeners the message was sent to """
+        frame = {'type': 'publish', 'token': self.token, 'id': str(uuid.uuid4()), 'message': message}
+        data = (json.dumps(frame) + '\n').encode('utf-8')
+        with self.lock:
+            for attempt in range(2):
+                reused = self.sock is not None
+                try:
+                    if not self.sock:
+                        self.__connect()
+                    self.sock.sendall(data)
+                    break
+                except OSError as e:
+                    self.close()
+                    # A connection kept from an earlier invocation may have been closed by the relay
+                    if not reused or attempt:
+                        raise RelayError('Relay publish failed: %s' % e) from e
+            try:
+                response = self.__receive()
+            except (OSError, ValueError) as e:
+                # Once the frame is out it is never sent again, the listener could end up running it twice
+                self.close()
+                raise RelayDeliveryUnknown('No reply from the relay after sending: %s' % e) from e
+        if response.get('type') != 'published':
+            self.close()
+            raise RelayError('Relay rejected message: %s' % response.get('error'))
+        return response.get('delivered', 0)
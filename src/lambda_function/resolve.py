@@ -0,0 +1,86 @@
+import os
+import time
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from shared.lookups import (moviedb_movie, moviedb_trailer_key, split_video_id, playable_results, MOVIEDB_API_URI,
+                            MOVIEDB_LANGUAGE)
+
+logger = logging.getLogger(__name__)
+
+"""
+Optional lookups done in the Lambda function, started as soon as an intent
+arrives so they run alongside finding the room, so the local listener can
+cast straight away instead of searching first. Whatever isn't found within
+the timeout is left out of the message, and the listener searches for it
+as before.
+"""
+
+YOUTUBE_MAX_RESULTS = 20
+
+def youtube_videos(title, timeout):
+    """ YouTube search results as [{'id': ..., 'playlist_id': ...}], in the same shape local.youtube returns """
+    from youtube_search import YoutubeSearch
+    results = []
+    for video in YoutubeSearch(title, max_results=YOUTUBE_MAX_RESULTS, retries=0, timeout=timeout).videos:
+        video_id, playlist_id = split_video_id(video['id'])
+        results.append({'id': video_id, 'playlist_id': playlist_id})
+    return playable_results(title, results)
+
+def moviedb_trailer(title, api_key, timeout):
+    """ {'youtube_id': ..., 'title': ...} for the first movie matching title, or None """
+    session = requests.Session()
+
+    def get(path, **params):
+        response = session.get(MOVIEDB_API_URI + path, timeout=timeout,
+                               params=dict(params, api_key=api_key, language=MOVIEDB_LANGUAGE))
+        response.raise_for_status()
+        return response.json()
+    movie = moviedb_movie(get, title)
+    key = moviedb_trailer_key(get, movie['id']) if movie else None
+    return {'youtube_id': key, 'title': movie['title']} if key else None
+
+class PendingLookup:
+    """ A lookup running in the background, which result() waits for until its deadline """
+
+    def __init__(self, name, future, deadline, convert=None):
+        self.name = name
+        self.future = future
+        self.deadline = deadline
+        self.convert = convert
+
+    def result(self):
+        """ The lookup's result, or None if it failed or didn't finish in time """
+        try:
+            value = self.future.result(timeout=max(0, self.deadline - time.monotonic()))
+            return self.convert(value) if self.convert and value else value
+        except FutureTimeoutError:
+            logger.info('%s lookup took too long, leaving it to the listener' % self.name)
+        except Exception as e:
+            logger.warning('%s lookup failed, leaving it to the listener: %s' % (self.name, e))
+        return None
+
+class Resolver:
+    """
+    Starts lookups on their own threads. Each has `timeout` seconds from when
+    it started; one that takes longer carries on, but its result isn't used.
+    """
+
+    def __init__(self, timeout=1, moviedb_api_key=os.getenv('MOVIEDB_API_KEY'), workers=4):
+        self.timeout = timeout
+        self.moviedb_api_key = moviedb_api_key
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='resolve')
+
+    def start(self, name, lookup, *args, convert=None):
+        return PendingLookup(name, self.executor.submit(lookup, *args), time.monotonic() + self.timeout, convert)
+
+    def videos(self, title):
+        """ The YouTube search results for title, pending """
+        return self.start('YouTube', youtube_videos, title, self.timeout)
+
+    def trailer(self, title):
+        """ The YouTube id of the movie's trailer, pending, or None without a MovieDb key """
+        if not self.moviedb_api_key:
+            return None
+        return self.start('MovieDb', moviedb_trailer, title, self.moviedb_api_key, self.timeout,
+                          convert=lambda x: x['youtube_id'])
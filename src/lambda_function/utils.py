@@ -1,9 +1,35 @@
 import logging
 import os
-import boto3
-from botocore.exceptions import ClientError
+import threading
 from ask_sdk_model.slu.entityresolution import StatusCode
 
+# Alexa gives up on a skill after 8 seconds, so fail fast rather than use botocore's 60 second defaults
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '1'))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '2'))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '2'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(service_name, region_name=None, **config):
+    """
+    A boto3 client that is kept for the life of the Lambda container, so warm
+    invocations don't build a new client and reuse its keep-alive connections.
+    Extra keyword arguments are passed to botocore's Config.
+    """
+    key = (service_name, region_name, repr(sorted(config.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            config.setdefault('connect_timeout', AWS_CONNECT_TIMEOUT)
+            config.setdefault('read_timeout', AWS_READ_TIMEOUT)
+            config.setdefault('retries', {'max_attempts': AWS_MAX_ATTEMPTS, 'mode': 'standard'})
+            client = boto3.client(service_name, region_name=region_name, config=Config(**config))
+            _clients[key] = client
+        return client
+
 def get_slot_value(handler_input, name, default=None):
     #If it matched a canonical value return this
     slots = handler_input.request_envelope.request.intent.slots
@@ -47,7 +73,8 @@ def create_presigned_url(object_name):
     :param object_name: string
     :return: Presigned URL as string. If error, returns None.
     """
-    s3_client = boto3.client('s3', config=boto3.session.Config(signature_version='s3v4',s3={'addressing_style': 'path'}))
+    from botocore.exceptions import ClientError
+    s3_client = get_client('s3', signature_version='s3v4', s3={'addressing_style': 'path'})
     try:
         bucket_name = os.environ.get('S3_PERSISTENCE_BUCKET')
         response = s3_client.generate_presigned_url('get_object',
@@ -2,6 +2,7 @@ import os
 import sys
 import threading
 import time
+from concurrent import futures
 import logging
 import logging.handlers
 from datetime import datetime, timedelta
@@ -9,50 +10,160 @@ import pychromecast
 from pychromecast import Chromecast
 from pychromecast.controllers.youtube import YouTubeController
 from pychromecast.controllers.plex import PlexController
+from casttube import YouTubeSession
 import subprocess
 import requests
 from enum import Enum
 import local.youtube as youtube_search
 import local.moviedb_search as moviedb_search
+from local.command_queue import CommandQueue
+from local.room_index import RoomIndex
+from local.batch import Batch, collect
+from local.groups import RoomGroups, DEFAULT_GROUP_DEADLINE
+from local.device_status import StatusStore
+from local.queue_loader import QueueLoader, DEFAULT_BATCH_SIZE as DEFAULT_QUEUE_BATCH_SIZE, CANCEL_TIMEOUT
+from local.youtube_queue import QueueModel, queue_navigation_total
+from local.warm_apps import (AppWarmer, WARM_OFF, WARM_POLICIES, WARM_COMMAND, SESSION_MAX_AGE,
+                             youtube_starts_total, youtube_start_seconds)
+from pychromecast.socket_client import CONNECTION_STATUS_CONNECTED
+from pychromecast.config import APP_YOUTUBE
+from local.metrics import stage_seconds, command_seconds, commands_total
+from local.logs import correlated
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# Every Cast message YouTube sends, sampled by default, see local.logs
+cast_logger = logging.getLogger(__name__ + '.cast')
 
 class MyYouTubeController(YouTubeController):
     
     def __init__(self):
-        self.play_list = {}
+        # What is queued on the device, kept in step by the wrapper's media status updates
+        self.queue = QueueModel()
+        # One request at a time on the YouTube session, shared with the background queue loader
+        self.session_lock = threading.RLock()
+        # When the lounge session was last started, see session_ready
+        self.session_refreshed = None
         super().__init__()
 
     def receive_message(self, msg, data):
-        logger.debug('Received: %s %s' % (msg, data))
+        # Formatted only if the record is kept
+        cast_logger.debug('Received: %s %s', msg, data)
         return YouTubeController.receive_message(self, msg, data)
 
-    def init_playlist(self):
-        self.playlist = {}
-
-    def play_previous(self, current_id):
-        #This is not pretty.... it rebuilds the playlist on a previous command to make it work
-        #There should be a way to play from a position in the queue, but I couldn't find it
-        select_from_here = False
-        if len(self.playlist) == 0:
-            self.playlist = self._session.get_queue_videos()
-
-        previous_id = False
-        self.clear_playlist()
-        for video in self.playlist:
-
-            if video['data-video-id'] == current_id:
-                if previous_id:
-                    self.play_video(previous_id)
-                    select_from_here = True
-                else:
-                    return
-
-            if select_from_here:
-                self.add_to_queue(video['data-video-id'])
-
-            previous_id = video['data-video-id']
+    def refresh_session(self):
+        """ Start a new lounge session ahead of time, so playing a video only has to bind to it """
+        if not self._screen_id:
+            # Waits for the device to reply, so not while holding the lock
+            self.update_screen_id()
+        with self.session_lock:
+            if not self._session:
+                self._session = YouTubeSession(screen_id=self._screen_id)
+            self._session._start_session()
+            self.session_refreshed = time.monotonic()
+
+    def session_ready(self):
+        """ True if YouTube is running and its lounge session was started recently """
+        session = self._session
+        return bool(self.is_active and self._screen_id and session and session.in_session and
+                    self.session_refreshed and time.monotonic() - self.session_refreshed < SESSION_MAX_AGE)
+
+    def play_video(self, video_id, playlist_id=None):
+        with self.session_lock:
+            if self.session_ready():
+                # The lounge token is still good, so skip fetching another one
+                self._session._bind()
+                self._session._initialize_queue(video_id, playlist_id)
+            else:
+                super().play_video(video_id, playlist_id)
+            self.session_refreshed = time.monotonic()
+            # A new session has a new queue, made from the playlist if there is one
+            self.queue.reset([video_id], list_id=playlist_id)
+
+    def add_to_queue(self, video_id):
+        with self.session_lock:
+            super().add_to_queue(video_id)
+            self.queue.extend([video_id])
+
+    def clear_playlist(self):
+        with self.session_lock:
+            super().clear_playlist()
+            self.queue.reset()
+
+    def __send_actions(self, actions):
+        """
+        Send several lounge actions in one request. The lounge API takes any
+        number of actions per request, numbered req0, req1... casttube only
+        ever sends one, so the request is built here the same way.
+        """
+        self.start_session_if_none()
+        session = self._session
+        if session.in_session:
+            # casttube binds again before each action, as the session goes stale after a while
+            session._bind()
+        else:
+            session._start_session()
+        data = {'count': len(actions)}
+        for i, action in enumerate(actions):
+            prefix = 'req%i' % (session._req_count + i)
+            for key, value in action.items():
+                data[prefix + key] = value
+        params = {'SID': session._sid, 'gsessionid': session._gsession_id, 'RID': session._rid, 'VER': 8, 'CVER': 1}
+        session._do_post('https://www.youtube.com/api/lounge/bc/bind', data=data,
+                         headers={'X-YouTube-LoungeId-Token': session._lounge_token},
+                         session_request=True, params=params)
+        # _do_post counts one request, the rest are counted here
+        session._req_count += len(actions) - 1
+
+    def add_videos_to_queue(self, video_ids):
+        """ Add several videos to the end of the queue in one request """
+        if not video_ids:
+            return
+        with self.session_lock:
+            self.__send_actions([{'__sc': 'addVideo', '_videoId': x} for x in video_ids])
+            self.queue.extend(video_ids)
+
+    def play_index(self, index):
+        """
+        Play the video at index in the queue, keeping the queue as it is.
+        This is one request once the queue's list id is known.
+        """
+        with self.session_lock:
+            video_id = self.queue.video_ids[index]
+            if not self.queue.list_id:
+                self.start_session_if_none()
+                self.queue.list_id = self._session.get_queue_playlist_id()
+            self.__send_actions([{'__sc': 'setPlaylist', '_videoId': video_id, '_listId': self.queue.list_id or '',
+                                  '_currentIndex': index, '_currentTime': 0, '_audioOnly': 'false'}])
+            self.queue.position = index
+
+    def resync_queue(self):
+        """ Read the queue back from the device, when the local one is out of sync """
+        with self.session_lock:
+            self.start_session_if_none()
+            videos = self._session.get_queue_videos()
+            self.queue.reset([x['data-video-id'] for x in videos], None, self._session.get_queue_playlist_id())
+
+    def play_from_queue(self, current_id, offset=0, index=None):
+        """
+        Play the video offset places from current_id in the queue (e.g. -1
+        for the previous one), or the one at index. The queue is only read
+        from the device if current_id isn't where the local queue expects.
+        Returns False if there is no such video.
+        """
+        with self.session_lock:
+            result = 'direct'
+            if not self.queue.sync(current_id):
+                logger.info('Local queue is out of sync at %s, reading it from the device' % current_id)
+                result = 'resynced'
+                self.resync_queue()
+                self.queue.sync(current_id)
+            target = self.queue.target(offset, index)
+            if target is None:
+                queue_navigation_total.inc(result='missing')
+                return False
+            self.play_index(target)
+            queue_navigation_total.inc(result=result)
+            return True
 
 class ChromecastWrapper:
     @property
@@ -67,18 +178,97 @@ class ChromecastWrapper:
     def name(self):
         return self.__cc.device.friendly_name
 
-    def __init__(self, cc):
+    @property
+    def snapshot(self):
+        """ The last status pushed by the device, without waiting for it """
+        return self.status.get(self.name)
+
+    def __init__(self, cc, command_handler=None, coalesce_rules=None, coalesce_window=0, ready_timeout=None,
+                 status_store=None, warm_policy=None):
         self.__cc = cc
+        self.status = StatusStore() if status_store is None else status_store
         cc.media_controller.register_status_listener(self)
         cc.register_status_listener(self)
+        cc.socket_client.register_connection_listener(self)
         self.youtube_controller = MyYouTubeController()
         cc.register_handler(self.youtube_controller)
+        self.command_handler = command_handler
+        self.ready_timeout = ready_timeout
+        self.queue_loader = None
+        self.commands = CommandQueue(self.name, self.__run_command, coalesce_rules, coalesce_window)
+        self.warmer = None
+        if warm_policy and warm_policy.mode != WARM_OFF:
+            self.warmer = AppWarmer(self, warm_policy).start()
+
+    def stop(self):
+        """ Stop the device's background threads, once it has gone """
+        self.commands.stop()
+        if self.warmer:
+            self.warmer.stop()
+
+    def wait_ready(self, timeout=None):
+        self.cast.wait(timeout)
+        return self.cast.status is not None
+
+    def is_connected(self):
+        snapshot = self.snapshot
+        return bool(snapshot and snapshot.connected)
+
+    def __run_command(self, command, data):
+        if command == WARM_COMMAND:
+            # Queued by the AppWarmer, so it takes its turn with real commands
+            self.warmer.run_queued()
+            return
+        # Commands wait in the queue until the device has connected
+        if not self.is_connected() and not self.wait_ready(self.ready_timeout):
+            logger.warning('%s is not ready, dropping %s command' % (self.name, command))
+            return
+        self.command_handler(command, data, self.name)
 
     def new_media_status(self, status:pychromecast.controllers.media.MediaStatus):
-        pass
+        queue = self.youtube_controller.queue
+        queue.sync(status.content_id)
+        self.status.update(self.name, content_id=status.content_id, player_state=status.player_state,
+                           queue_position=queue.position)
 
     def new_cast_status(self, status):
-        pass
+        # Receiving a status means the connection is up
+        self.status.update(self.name, connected=True, app_id=status.app_id, app=status.display_name,
+                           volume=status.volume_level, muted=status.volume_muted)
+
+    def new_connection_status(self, status):
+        self.status.update(self.name, connected=status.status == CONNECTION_STATUS_CONNECTED)
+
+    def set_queue(self, video_ids, loaded=None):
+        self.status.update(self.name, queue=tuple(video_ids), queue_loaded=len(video_ids) if loaded is None else loaded)
+
+    def load_queue(self, video_ids, batch_size=DEFAULT_QUEUE_BATCH_SIZE):
+        """ Add videos to the YouTube queue in the background, after the one playing """
+        self.stop_queue_load()
+        self.queue_loader = QueueLoader(self.name, self.youtube_controller, video_ids, batch_size,
+                                        lambda loader: self.status.update(self.name, queue_loaded=1 + loader.loaded))
+        return self.queue_loader.start()
+
+    def start_youtube(self, video_id, playlist_id=None):
+        """ Play a video on YouTube, counted as a warm start if the app and its session were ready """
+        start = 'warm' if self.youtube_controller.session_ready() else 'cold'
+        with youtube_start_seconds.time(start=start):
+            self.youtube_controller.play_video(video_id, playlist_id)
+        youtube_starts_total.inc(start=start)
+
+    def stop_queue_load(self):
+        """ Stop adding to the queue, e.g. before something else is played """
+        loader, self.queue_loader = self.queue_loader, None
+        if loader and not loader.cancel(CANCEL_TIMEOUT):
+            # The batch carries on in the background, the next command goes ahead anyway
+            logger.warning('Queue loader on %s did not stop within %is' % (self.name, CANCEL_TIMEOUT))
+
+DISCOVERY_MODE_RESCAN = 'rescan'
+DISCOVERY_MODE_INCREMENTAL = 'incremental'
+DISCOVERY_MODES = [DISCOVERY_MODE_RESCAN, DISCOVERY_MODE_INCREMENTAL]
+DEFAULT_CONNECT_WORKERS = 8
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_READY_TIMEOUT = 30
 
 class ChromecastState:
 
@@ -86,51 +276,249 @@ class ChromecastState:
     def count(self):
         return len(self.__chromecasts)
 
+    @property
+    def names(self):
+        with self.lock:
+            return list(self.__chromecasts.keys())
+
     def stop(self):
         self.running = False
-        self.thread.join(10)
+        if self.browser:
+            pychromecast.stop_discovery(self.browser)
+        if self.thread:
+            self.thread.join(10)
+        self.connect_pool.shutdown(wait=False)
+        # Connects still finishing on the pool can add to the dict while it is walked
+        with self.lock:
+            chromecasts = list(self.__chromecasts.values())
+        for chromecast in chromecasts:
+            chromecast.stop()
+
+    def __connect(self, host, service_name=None):
+        # Runs on the connect pool, never while holding the lookup lock
+        logger.info("Found %s" % host[4])
+        try:
+            if service_name:
+                # Resolve through mDNS so the connection follows address changes
+                cc = pychromecast.get_chromecast_from_service(({service_name}, self.browser.zc) + tuple(host[2:]))
+            else:
+                cc = pychromecast.get_chromecast_from_host(host)
+        except pychromecast.ChromecastConnectionError:
+            logger.warning('Failed to connect to %s' % host[4])
+            return None
+        wrapper = ChromecastWrapper(cc, self.command_handler, self.coalesce_rules, self.coalesce_window,
+                                    self.ready_timeout, self.status, self.warm_policy)
+        if service_name:
+            with self.lock:
+                if self.__services.get(service_name) != cc.uuid:
+                    # Removed while connecting
+                    wrapper.stop()
+                    cc.disconnect(blocking=False)
+                    return None
+                self.__chromecasts[wrapper.name] = wrapper
+                self.__reindex()
+        else:
+            with self.lock:
+                self.__chromecasts[wrapper.name] = wrapper
+                self.__reindex()
+        # Registered before it is ready, commands queue until it responds
+        if not wrapper.wait_ready(self.connect_timeout):
+            logger.warning('%s did not respond within %is' % (wrapper.name, self.connect_timeout))
+        return wrapper
 
     def __set_chromecasts(self):
+        started = time.monotonic()
+        hosts = pychromecast.discover_chromecasts()
+        logger.info('Discovered %i Chromecasts in %.2fs' % (len(hosts), time.monotonic() - started))
+        found = set(x[2] for x in hosts)
         with self.lock:
-            self.__chromecasts = {}
-            for cc in pychromecast.get_chromecasts():
-                logger.info("Found %s" % cc.device.friendly_name)
-                cc.wait()
-                self.__chromecasts[cc.device.friendly_name] = ChromecastWrapper(cc)
+            # Known devices keep their connection and registered controllers
+            known = set(x.cast.uuid for x in self.__chromecasts.values())
+        list(self.connect_pool.map(self.__connect, [x for x in hosts if x[2] not in known]))
+        logger.info('Connected to Chromecasts in %.2fs' % (time.monotonic() - started))
+        with self.lock:
+            removed = [x for x in self.__chromecasts.values() if x.cast.uuid not in found]
+            for chromecast in removed:
+                del self.__chromecasts[chromecast.name]
+            if removed:
+                self.__reindex()
             self.expiry = datetime.now()
+        for chromecast in removed:
+            logger.info("Lost %s" % chromecast.name)
+            self.status.remove(chromecast.name)
+            chromecast.stop()
+            chromecast.cast.disconnect(blocking=False)
 
     def expire_chromecasts(self):
+        if not self.discovered.is_set():
+            self.__set_chromecasts()
+            self.discovered.set()
         while self.running:
             time.sleep(1)
             refresh_period = timedelta(minutes=120)
             if (self.expiry + refresh_period) < datetime.now():
                 self.__set_chromecasts()
 
-    def __init__(self):
+    def __start_discovery(self):
+        self.listener = pychromecast.CastListener(self.__service_added, self.__service_removed, self.__service_updated)
+        self.browser = pychromecast.start_discovery(self.listener)
+
+    def __service_added(self, service_name):
+        host = self.listener.services.get(service_name)
+        if not host:
+            return
+        uuid = host[2]
+        with self.lock:
+            known = uuid in self.__services.values()
+            self.__services[service_name] = uuid
+            if known:
+                return
+            future = self.connect_pool.submit(self.__connect_service, service_name, host)
+            self.__pending.add(future)
+        future.add_done_callback(self.__connect_done)
+
+    def __connect_done(self, future):
+        with self.lock:
+            self.__pending.discard(future)
+
+    def __connect_service(self, service_name, host):
+        if not self.__connect(host, service_name):
+            with self.lock:
+                if self.__services.get(service_name) == host[2]:
+                    self.__services.pop(service_name)
+
+    def __service_updated(self, service_name):
+        host = self.listener.services.get(service_name)
+        if not host:
+            return
+        friendly_name = host[4]
+        with self.lock:
+            wrapper = next((x for x in self.__chromecasts.values() if x.cast.uuid == host[2]), None)
+            if not wrapper:
+                new_device = service_name not in self.__services
+            elif friendly_name and wrapper.name != friendly_name:
+                # Renamed, update in place so controllers and queued commands are kept
+                logger.info("%s renamed to %s" % (wrapper.name, friendly_name))
+                del self.__chromecasts[wrapper.name]
+                self.status.rename(wrapper.name, friendly_name)
+                wrapper.cast.device = wrapper.cast.device._replace(friendly_name=friendly_name)
+                self.__chromecasts[friendly_name] = wrapper
+                self.__reindex()
+                new_device = False
+            else:
+                new_device = False
+        if new_device:
+            self.__service_added(service_name)
+
+    def __service_removed(self, service_name, host):
+        with self.lock:
+            uuid = self.__services.pop(service_name, None)
+            if uuid in self.__services.values():
+                # Still advertised under another service name
+                return
+            wrapper = next((x for x in self.__chromecasts.values() if x.cast.uuid == uuid), None)
+            if wrapper:
+                del self.__chromecasts[wrapper.name]
+                self.__reindex()
+        if wrapper:
+            logger.info("Lost %s" % wrapper.name)
+            self.status.remove(wrapper.name)
+            wrapper.stop()
+            wrapper.cast.disconnect(blocking=False)
+
+    def wait_for_discovery(self, timeout):
+        # Give mDNS a chance to find devices, then wait for their connections
+        started = time.monotonic()
+        time.sleep(timeout)
+        with self.lock:
+            pending = list(self.__pending)
+        futures.wait(pending, self.connect_timeout)
+        logger.info('Connected to %i Chromecasts in %.2fs' % (self.count, time.monotonic() - started))
+        self.discovered.set()
+
+    def wait_for_chromecasts(self, timeout=None):
+        return self.discovered.wait(timeout)
+
+    def __init__(self, command_handler=None, coalesce_rules=None, coalesce_window=0,
+                 discovery_mode=DISCOVERY_MODE_RESCAN, connect_workers=DEFAULT_CONNECT_WORKERS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, ready_timeout=None, fast_start=False, aliases=None,
+                 warm_policy=None):
+        if discovery_mode not in DISCOVERY_MODES:
+            raise ValueError('Unknown discovery mode: %s' % discovery_mode)
+        if warm_policy and warm_policy.mode not in WARM_POLICIES:
+            raise ValueError('Unknown warm app policy: %s' % warm_policy.mode)
         self.running = True
         self.expiry = datetime.now()
         self.lock = threading.Lock()
-        self.__set_chromecasts()
-        self.thread = threading.Thread(target=self.expire_chromecasts)
-        self.thread.start()
+        self.command_handler = command_handler
+        self.coalesce_rules = coalesce_rules
+        self.coalesce_window = coalesce_window
+        self.discovery_mode = discovery_mode
+        self.connect_timeout = connect_timeout
+        self.ready_timeout = ready_timeout
+        self.discovered = threading.Event()
+        self.status = StatusStore()
+        self.connect_pool = futures.ThreadPoolExecutor(max_workers=connect_workers, thread_name_prefix='connect')
+        self.aliases = aliases
+        self.warm_policy = warm_policy
+        self.__chromecasts = {}
+        self.__index = RoomIndex([], aliases)
+        self.__services = {}
+        self.__pending = set()
+        self.browser = None
+        self.thread = None
+        if discovery_mode == DISCOVERY_MODE_INCREMENTAL:
+            self.__start_discovery()
+            if fast_start:
+                threading.Thread(target=self.wait_for_discovery, args=(pychromecast.DISCOVER_TIMEOUT,), daemon=True).start()
+            else:
+                self.wait_for_discovery(pychromecast.DISCOVER_TIMEOUT)
+        else:
+            if not fast_start:
+                self.__set_chromecasts()
+                self.discovered.set()
+            self.thread = threading.Thread(target=self.expire_chromecasts)
+            self.thread.start()
+
+    def __reindex(self):
+        # Called with the lock held whenever the set of Chromecasts changes
+        self.__index = RoomIndex(self.__chromecasts.keys(), self.aliases)
 
     def match_chromecast(self, room) -> ChromecastWrapper:
         with self.lock:
-            result = next((x for x in self.__chromecasts.values() if str.lower(room.strip()) in str.lower(x.name).replace(' the ', '')), False)
-            if result:
-                result.cast.wait()
-            return result
+            name = self.__index.match(room)
+            # Readiness is waited for by the device's command queue
+            return self.__chromecasts.get(name, False)
 
     def get_chromecast(self, name):
-        result = self.__chromecasts[name]
-        result.cast.wait()
+        with self.lock:
+            result = self.__chromecasts[name]
+        # Only wait when the device has reported that it isn't connected, or hasn't reported yet
+        if not result.is_connected():
+            with stage_seconds.time(stage='cast_wait'):
+                result.cast.wait()
         return result
 
 class Skill():
 
-    def __init__(self):
+    def __init__(self, coalesce_rules=None, coalesce_window=0, discovery_mode=DISCOVERY_MODE_RESCAN,
+                 fast_start=False, connect_timeout=DEFAULT_CONNECT_TIMEOUT, ready_timeout=DEFAULT_READY_TIMEOUT,
+                 aliases=None, groups=None, group_deadline=DEFAULT_GROUP_DEADLINE,
+                 queue_batch_size=DEFAULT_QUEUE_BATCH_SIZE, warm_policy=None):
         logger.info("Finding Chromecasts...")
-        self.chromecast_controller = ChromecastState()
+        self.queue_batch_size = queue_batch_size
+        self.fast_start = fast_start
+        self.ready_timeout = ready_timeout
+        self.groups = RoomGroups(groups)
+        self.group_deadline = group_deadline
+        self.chromecast_controller = ChromecastState(self.run_command, coalesce_rules, coalesce_window, discovery_mode,
+                                                     connect_timeout=connect_timeout,
+                                                     ready_timeout=ready_timeout if fast_start else None,
+                                                     fast_start=fast_start, aliases=aliases,
+                                                     warm_policy=warm_policy)
+        if fast_start:
+            # Devices connect in the background, the listener can start straight away
+            return
         if self.chromecast_controller.count == 0:
             logger.info("No Chromecasts found")
             exit(1)
@@ -139,19 +527,108 @@ class Skill():
     def get_chromecast(self, name) -> ChromecastWrapper:
         return self.chromecast_controller.get_chromecast(name)
 
+    def status(self):
+        """ The latest status of every Chromecast, as plain data """
+        return self.chromecast_controller.status.as_dict()
+
+    def __match(self, room, command):
+        with stage_seconds.time(stage='match'):
+            chromecast = self.chromecast_controller.match_chromecast(room)
+        if not chromecast and self.fast_start and not self.chromecast_controller.discovered.is_set():
+            logger.info('Waiting for Chromecasts to be discovered...')
+            self.chromecast_controller.wait_for_chromecasts(self.ready_timeout)
+            chromecast = self.chromecast_controller.match_chromecast(room)
+        if not chromecast:
+            logger.warn('No Chromecast found matching: %s' % room)
+            commands_total.inc(command=command, result='no_device')
+        return chromecast
+
+    def __is_command(self, func):
+        return callable(getattr(self, func, None))
+
+    def __group_rooms(self, room):
+        """ The rooms in a group, or None if the room isn't a group """
+        if self.groups.is_all(room) and self.fast_start and not self.chromecast_controller.discovered.is_set():
+            logger.info('Waiting for Chromecasts to be discovered...')
+            self.chromecast_controller.wait_for_chromecasts(self.ready_timeout)
+        return self.groups.resolve(room, self.chromecast_controller.names)
+
     def handle_command(self, room, command, data):
         try:
-            chromecast = self.chromecast_controller.match_chromecast(room)
+            if self.__group_rooms(room) is not None:
+                self.handle_batch([room], [(command, data)])
+                return
+            chromecast = self.__match(room, command)
             if not chromecast:
-                logger.warn('No Chromecast found matching: %s' % room)
                 return
             func = command.replace('-','_')
-            logger.info('Sending %s command to Chromecast: %s' % (func, chromecast.name))
-
-            getattr(self, func)(data, chromecast.name)
+            if not self.__is_command(func):
+                logger.warn('Unknown command: %s' % command)
+                commands_total.inc(command=command, device=chromecast.name, result='unknown')
+                return
+            logger.info('Queueing %s command for Chromecast: %s' % (func, chromecast.name))
+            chromecast.commands.submit(func, data)
         except Exception:
             logger.exception('Unexpected error')
 
+    def handle_batch(self, rooms, commands, stop_on_error=True):
+        """
+        Queue an ordered list of (command, data) steps for each room.
+        Returns a Batch per Chromecast, which holds the results of each step.
+        """
+        steps = [(command.replace('-','_'), data) for command, data in commands]
+        expanded = []
+        grouped = False
+        for room in rooms:
+            group = self.__group_rooms(room)
+            if group is None:
+                expanded.append(room)
+            else:
+                grouped = True
+                logger.info('Sending to %s: %s' % (room, ', '.join(group)))
+                expanded.extend(group)
+        # A group command is given up on, device by device, once its deadline has passed
+        deadline = time.monotonic() + self.group_deadline if grouped else None
+        batches = {}
+        for room in expanded:
+            try:
+                chromecast = self.__match(room, 'batch')
+                if not chromecast or chromecast.name in batches:
+                    continue
+                batch = Batch(chromecast.name, steps, stop_on_error, known=self.__is_command, deadline=deadline)
+                logger.info('Queueing %i commands for Chromecast: %s' % (len(steps), chromecast.name))
+                chromecast.commands.submit('batch', batch)
+                batches[chromecast.name] = batch
+            except Exception:
+                logger.exception('Unexpected error')
+        if grouped:
+            threading.Thread(target=self.__report_group, args=(rooms, list(batches.values()), deadline),
+                             daemon=True).start()
+        return list(batches.values())
+
+    def __report_group(self, rooms, batches, deadline):
+        started = time.monotonic()
+        results = collect(batches, deadline)
+        stage_seconds.observe(time.monotonic() - started, stage='group')
+        logger.info('Command for %s finished: %s' % (
+            ', '.join(rooms), ', '.join('%s %s' % (name, x['result']) for name, x in sorted(results.items()))))
+
+    def run_command(self, func, data, name):
+        if isinstance(data, Batch):
+            # Steps are recorded one by one, as if they had been sent separately
+            data.run(lambda step, step_data: self.run_command(step, step_data, name))
+            return
+        # Commands that didn't come from a message get an id of their own
+        with correlated():
+            logger.info('Sending %s command to Chromecast: %s' % (func, name))
+            result = 'error'
+            try:
+                with command_seconds.time(command=func, device=name):
+                    getattr(self, func)(data, name)
+                result = 'ok'
+            finally:
+                commands_total.inc(command=func, device=name, result=result)
+
     def resume(self, data, name):
         self.play(data, name)
 
@@ -163,21 +640,39 @@ class Skill():
         cc.media_controller.pause()
 
     def stop(self, data, name):
-        self.get_chromecast(name).cast.quit_app()
+        cc = self.get_chromecast(name)
+        cc.stop_queue_load()
+        cc.cast.quit_app()
 
     def set_volume(self, data, name):
         volume = data['volume'] # volume as 0-10
         volume_normalized = float(volume) / 10.0 # volume as 0-1
         self.get_chromecast(name).cast.set_volume(volume_normalized)
 
+    def __play_from_queue(self, cc, offset=0, index=None):
+        """ Move around the YouTube queue, returns False if there's no such video or YouTube isn't running """
+        snapshot = cc.snapshot
+        if snapshot and snapshot.app_id and snapshot.app_id != APP_YOUTUBE:
+            return False
+        current_id = snapshot.content_id if snapshot and snapshot.content_id else cc.media_controller.status.content_id
+        return cc.youtube_controller.play_from_queue(current_id, offset, index)
+
     def play_next(self, data, name):
-        #mc.queue_next() didn't work
-        self.get_chromecast(name).media_controller.skip()
+        cc = self.get_chromecast(name)
+        if not self.__play_from_queue(cc, 1):
+            #mc.queue_next() didn't work
+            cc.media_controller.skip()
 
     def play_previous(self, data, name):
         cc = self.get_chromecast(name)
-        current_id = cc.media_controller.status.content_id
-        cc.youtube_controller.play_previous(current_id)
+        if not self.__play_from_queue(cc, -1):
+            logger.info('Nothing to go back to on %s' % name)
+
+    def play_item(self, data, name):
+        # Positions are spoken from 1
+        position = int(data['position'])
+        if not self.__play_from_queue(self.get_chromecast(name), index=position - 1):
+            logger.info('There is no video %i in the queue on %s' % (position, name))
 
     def play_video(self, data, name):
         cc = self.get_chromecast(name)
@@ -185,22 +680,24 @@ class Skill():
         video_title = data['title']
         streaming_app = data['app']
         if streaming_app == 'youtube':
-            video_playlist = youtube_search.search(video_title)
+            # Videos found by the Lambda function are played without searching again
+            video_playlist = data.get('videos') or youtube_search.search(video_title)
             if len(video_playlist) == 0:
                 logger.info('Unable to find youtube video for: %s' % video_title)
                 return
-            playing = False
-            yt.init_playlist()
-            for video in video_playlist:
-                if not playing:
-                    if not video['playlist_id']:
-                        #Youtube controller will clear for a playlist
-                        yt.clear_playlist()
-                    yt.play_video(video['id'], video['playlist_id'])
-                    logger.debug('Currently playing: %s' % video['id'])
-                    playing = True
-                else:
-                    yt.add_to_queue(video['id'])
+            # Whatever was still being queued from the last search is replaced
+            cc.stop_queue_load()
+            first = video_playlist[0]
+            with stage_seconds.time(stage='queue_first'):
+                if not first['playlist_id']:
+                    #Youtube controller will clear for a playlist
+                    yt.clear_playlist()
+                cc.start_youtube(first['id'], first['playlist_id'])
+            logger.debug('Currently playing: %s' % first['id'])
+            # The rest are queued in the background, so the first video isn't held up
+            cc.set_queue([x['id'] for x in video_playlist], loaded=1)
+            if len(video_playlist) > 1:
+                cc.load_queue([x['id'] for x in video_playlist[1:]], self.queue_batch_size)
             logger.info('Asked chromecast to play %i titles matching: %s on YouTube' % (len(video_playlist), video_title))
 
         elif streaming_app == 'plex':
@@ -211,10 +708,9 @@ class Skill():
 
     def play_trailer(self, data, name):
         cc = self.get_chromecast(name)
-        yt = cc.youtube_controller
-        moviedb_result = moviedb_search.get_movie_trailer_youtube_id(data['title'])
-        video_id = moviedb_result["youtube_id"]
-        yt.play_video(video_id)
+        video_id = data.get('youtube_id') or moviedb_search.get_movie_trailer_youtube_id(data['title'])["youtube_id"]
+        cc.stop_queue_load()
+        cc.start_youtube(video_id)
         logger.info('video sent to chromecast, id: %s' % video_id)
 
     def restart(self, data, name):
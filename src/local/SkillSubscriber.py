@@ -2,14 +2,48 @@ import os
 import sys
 import signal
 import json
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import time
+import threading
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 from requests import get
 import miniupnpc
 import boto3
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from local.dispatcher import RoomDispatcher, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from local.logs import correlated
+from local.metrics import registry, stage_seconds, notifications_total, notifications_dropped_total
+from local.batch import is_batch, parse_message
+from local.dedup import MessageDeduplicator
+from local.sns_verify import SignatureError
+from local.sqs_consumer import SqsConsumer, DEFAULT_BATCH_SIZE, DEFAULT_WAIT_TIME
+from local.relay import RelayClient, DEFAULT_HEARTBEAT
+from local.network import NetworkState, find_igd_location
+
+SERVER_MODE_SIMPLE = 'simple'
+SERVER_MODE_THREADED = 'threaded'
+SERVER_MODES = [SERVER_MODE_SIMPLE, SERVER_MODE_THREADED]
+
+# 'http' has SNS push to the listener, 'sqs' pulls from a queue subscribed to the topic,
+# 'relay' keeps a connection open to a relay the Lambda function publishes to
+TRANSPORT_HTTP = 'http'
+TRANSPORT_SQS = 'sqs'
+TRANSPORT_RELAY = 'relay'
+TRANSPORTS = [TRANSPORT_HTTP, TRANSPORT_SQS, TRANSPORT_RELAY]
+# /status and /metrics are served on their own listener, never on the port forwarded to the internet for SNS
+DEFAULT_STATUS_ADDRESS = '127.0.0.1:9102'
+# After a start from the network cache, seconds between tries of the first network check, doubling up to the max
+FIRST_CHECK_RETRY = 1
+FIRST_CHECK_MAX_RETRY = 60
+
+def parse_address(text):
+    """ 'host:port' as (host, port), or None if text is empty """
+    if not text:
+        return None
+    host, _, port = text.rpartition(':')
+    return (host or '127.0.0.1', int(port))
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 """
 Generic Skill Subscription class to handle commands from an
@@ -17,80 +51,239 @@ Lambda Fucntion via SNS notifications.
 """
 class Subscriber(BaseHTTPRequestHandler):
 
-    def __init__(self, skills, ip, port, topic_arn=os.getenv('AWS_SNS_TOPIC_ARN')):
+    def __init__(self, skills, ip, port, topic_arn=os.getenv('AWS_SNS_TOPIC_ARN'),
+                 server_mode=SERVER_MODE_SIMPLE, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 sns_client=None, serve=True, dedup=None, verifier=None, transport=TRANSPORT_HTTP,
+                 queue_url=None, sqs_client=None, sqs_batch_size=DEFAULT_BATCH_SIZE, sqs_wait_time=DEFAULT_WAIT_TIME,
+                 relay_url=None, relay_token=None, relay_heartbeat=DEFAULT_HEARTBEAT,
+                 network_cache=None, network_check_interval=0, status_address=None):
         self.token = ""
-        if port:
-            self.manual_port_forward = True
+        if transport not in TRANSPORTS:
+            raise ValueError('Unknown transport: %s' % transport)
+        if transport == TRANSPORT_SQS and not queue_url:
+            raise ValueError('The sqs transport needs a queue URL')
+        if transport == TRANSPORT_RELAY and not relay_url:
+            raise ValueError('The relay transport needs a relay URL')
+        self.transport = transport
+        self.consumer = None
+        self.network_cache = network_cache
+        self.network_check_interval = network_check_interval
+        self.network_thread = None
+        self.status_server = None
+        self.stopped = threading.Event()
+        self.upnp = None
+        self.igd_url = None
+        self.fixed_ip = ip
+        self.external_ip = ip
+        self.verifier = verifier
+        # Signatures are checked on one thread, in the order messages arrive, so requests aren't held up
+        self.verify_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='verify') if verifier else None
+        # SNS delivers at least once, so the same message can arrive more than once
+        self.dedup = dedup or MessageDeduplicator()
+        started = self.started = time.monotonic()
+        if server_mode not in SERVER_MODES:
+            raise ValueError('Unknown server mode: %s' % server_mode)
+        self.server_mode = server_mode
+        if server_mode == SERVER_MODE_THREADED:
+            self.dispatcher = RoomDispatcher(workers, queue_size)
         else:
-            self.manual_port_forward = False
-            try:
-                self.initialize_upnp()
-            except Exception:
-                logger.exception('Failed to configure UPnP. Please map port manually and pass PORT environment variable.')
-                sys.exit(1)
+            self.dispatcher = None
+        self.manual_port_forward = bool(port) or transport != TRANSPORT_HTTP
 
-        self.sns_client = boto3.client('sns')
+        self.sns_client = sns_client or boto3.client('sns')
         self.skills = skills
         self.topic_arn = topic_arn
         instance = self
 
         class SNSRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # Status and metrics are on the status listener only
+                self.send_error(404)
+
             def do_POST(self):
+                with stage_seconds.time(stage='sns_receive'):
+                    self.handle_sns()
+
+            def handle_sns(self):
                 self.send_response(200)
                 self.send_header('content-type', 'text/html')
                 self.end_headers()
                 raw_data = self.rfile.read(
                     int(self.headers['Content-Length']))
                 data = json.loads(raw_data)
-                topic_arn = self.headers.get('X-Amz-Sns-Topic-Arn')
                 type = data['Type']
- 
-                if type == 'SubscriptionConfirmation':
-                    logger.info('Received subscription confirmation...')
-                    token = data['Token']
-                    instance.confirm_subscription(topic_arn, token)
-                    
-                elif type == 'Notification':
-                    logger.info('Received message...')
-                    if data['Message']:
-                        instance.dispatch_notification(json.loads(data['Message']))
+                notifications_total.inc(type=type)
+                instance.receive(data)
 
             def log_message(self, format, *args):
                 pass
 
-        self.server = HTTPServer(('', int(port) if port else 0), SNSRequestHandler)
+        server_class = ThreadingHTTPServer if self.dispatcher else HTTPServer
+        if status_address:
+            self.start_status_server(status_address)
+
+        if transport != TRANSPORT_HTTP:
+            # Nothing connects to us, so there's no UPnP, external IP lookup or HTTP subscription
+            self.server = None
+            self.endpoint_url = None
+            if transport == TRANSPORT_SQS:
+                self.consumer = SqsConsumer(queue_url, self.receive_sqs, sqs_client, sqs_batch_size, sqs_wait_time)
+                source = queue_url
+            else:
+                self.consumer = RelayClient(relay_url, self.receive_relay, relay_token, relay_heartbeat)
+                source = relay_url
+            signal.signal(signal.SIGINT,
+                          lambda signal, frame: self.unsubscribe())
+            logger.info('Receiving from {} ({} mode)'.format(source, self.server_mode))
+            logger.info('Listener ready in %.2fs' % (time.monotonic() - started))
+            if serve:
+                self.consumer.run()
+            return
+
+        cached = self.load_network(ip, port)
+        if cached and not port:
+            try:
+                self.server = server_class(('', cached.port), SNSRequestHandler)
+            except OSError:
+                logger.warning('Port %i from the network cache is in use' % cached.port)
+                cached = None
+        if not cached:
+            self.server = server_class(('', int(port) if port else 0), SNSRequestHandler)
 
         port = self.server.server_port
-        if not ip:
-          ip = self.get_external_ip() 
-        self.endpoint_url = 'http://{}:{}'.format(ip, port)
-        logger.info('Listening on {}'.format(self.endpoint_url))
         signal.signal(signal.SIGINT,
                       lambda signal, frame: self.unsubscribe())
-        self.subscribe()
-        self.server.serve_forever()
+        if cached:
+            # Start with what worked last time. The port forward and subscription were removed when we
+            # last stopped, so the check straight away in the background puts them back
+            self.igd_url = cached.igd_url
+            self.external_ip = ip or cached.external_ip
+            self.endpoint_url = 'http://{}:{}'.format(self.external_ip, port)
+            logger.info('Listening on {} ({} mode, from the network cache)'.format(self.endpoint_url, self.server_mode))
+        else:
+            if not self.manual_port_forward:
+                try:
+                    self.initialize_upnp()
+                except Exception:
+                    logger.exception('Failed to configure UPnP. Please map port manually and pass PORT environment variable.')
+                    sys.exit(1)
+                logger.info('UPnP initialized in %.2fs' % (time.monotonic() - started))
+            if not ip:
+                lookup_started = time.monotonic()
+                self.external_ip = self.get_external_ip()
+                logger.info('External IP found in %.2fs' % (time.monotonic() - lookup_started))
+            self.endpoint_url = 'http://{}:{}'.format(self.external_ip, port)
+            logger.info('Listening on {} ({} mode)'.format(self.endpoint_url, self.server_mode))
+            self.subscribe()
+            self.save_network()
+        if cached or self.network_check_interval:
+            self.network_thread = threading.Thread(target=self.watch_network, args=(bool(cached),), daemon=True)
+            self.network_thread.start()
+        if cached:
+            # Nothing reaches us until the port is mapped and we are subscribed, see watch_network
+            logger.info('Listener started in %.2fs, waiting for the port mapping and subscription'
+                        % (time.monotonic() - started))
+        else:
+            logger.info('Listener ready in %.2fs' % (time.monotonic() - started))
+        if serve:
+            self.server.serve_forever()
+
+    def start_status_server(self, address):
+        """ Serve /status and /metrics on address, which should only be reachable from the local network """
+        instance = self
 
-    def initialize_upnp(self):
+        class StatusRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = registry.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/status':
+                    # Device status from every skill that keeps one
+                    body = json.dumps({name: skill.status() for name, skill in instance.skills.items()
+                                       if callable(getattr(skill, 'status', None))}).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('content-type', content_type)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.status_server = ThreadingHTTPServer(address, StatusRequestHandler)
+        threading.Thread(target=self.status_server.serve_forever, daemon=True).start()
+        logger.info('Serving status on http://%s:%i' % self.status_server.server_address[:2])
+
+    def initialize_upnp(self, igd_url=None):
         upnp = miniupnpc.UPnP()
-        upnp.discoverdelay = 10
-        upnp.discover()
-        upnp.selectigd()
+        if igd_url and not self.__select_igd(upnp, igd_url):
+            logger.info('Gateway %s from the network cache not found, searching again' % igd_url)
+            igd_url = None
+        if not igd_url:
+            igd_url = find_igd_location()
+            if not igd_url or not self.__select_igd(upnp, igd_url):
+                # miniupnpc's own discovery is slower, and doesn't tell us the gateway's URL to cache
+                igd_url = None
+                upnp.discoverdelay = 10
+                upnp.discover()
+                upnp.selectigd()
         self.upnp = upnp
+        self.igd_url = igd_url
+
+    @staticmethod
+    def __select_igd(upnp, igd_url):
+        try:
+            upnp.selectigd(igd_url)
+            return True
+        except Exception:
+            return False
 
     def get_external_ip(self):
-        return get('https://api.ipify.org').text
+        return get('https://api.ipify.org', timeout=5).text
+
+    def load_network(self, ip, port):
+        """ The cached NetworkState, if it can be used for this ip and port """
+        if not self.network_cache or self.transport != TRANSPORT_HTTP:
+            return None
+        cached = self.network_cache.load()
+        if not cached or not cached.port or not (ip or cached.external_ip):
+            return None
+        if port and int(port) != cached.port:
+            return None
+        return cached
+
+    def save_network(self):
+        if not self.network_cache:
+            return
+        try:
+            self.network_cache.save(NetworkState(self.igd_url, self.upnp.lanaddr if self.upnp else None,
+                                                 self.external_ip, self.server.server_port))
+        except Exception:
+            logger.exception('Failed to save the network cache')
+
+    def add_port_mapping(self):
+        port = self.server.server_port
+        try:
+            self.upnp.addportmapping(port, 'TCP', self.upnp.lanaddr, port, '', '')
+        except Exception:
+            # e.g. still mapped to our old LAN address
+            self.upnp.deleteportmapping(port, 'TCP')
+            self.upnp.addportmapping(port, 'TCP', self.upnp.lanaddr, port, '', '')
+
+    def is_port_mapped(self):
+        port = self.server.server_port
+        # (internal client, internal port, description, enabled, lease duration) or None
+        mapping = self.upnp.getspecificportmapping(port, 'TCP')
+        return bool(mapping) and mapping[0] == self.upnp.lanaddr and int(mapping[1]) == port
 
     def subscribe(self):
         if not self.manual_port_forward:
             try:
-                self.upnp.addportmapping(
-                    self.server.server_port,
-                    'TCP',
-                    self.upnp.lanaddr,
-                    self.server.server_port,
-                    '',
-                    ''
-                )
+                self.add_port_mapping()
             except:
                 logger.error('Failed to automatically forward port.')
                 logger.error('Please set port as an environment variable and forward manually.')
@@ -98,16 +291,91 @@ class Subscriber(BaseHTTPRequestHandler):
 
         try:
             logger.info("Subscribing for Alexa commands...")
-            self.sns_client.subscribe(
-                TopicArn=self.topic_arn,
-                Protocol='http',
-                Endpoint=self.endpoint_url
-            )
+            self.subscribe_endpoint()
 
         except Exception:
             logger.exception('SNS Topic ({}) is invalid. Please check in AWS.'.format(self.topic_arn))
             sys.exit(1)
 
+    def subscribe_endpoint(self):
+        self.sns_client.subscribe(
+            TopicArn=self.topic_arn,
+            Protocol='http',
+            Endpoint=self.endpoint_url
+        )
+
+    def find_subscription(self, endpoint):
+        """ The confirmed subscription ARN for an endpoint, or None """
+        kwargs = {'TopicArn': self.topic_arn}
+        while True:
+            response = self.sns_client.list_subscriptions_by_topic(**kwargs)
+            for sub in response['Subscriptions']:
+                if (sub['TopicArn'] == self.topic_arn and sub['Endpoint'] == endpoint and
+                        sub['SubscriptionArn'][:12] == 'arn:aws:sns:'):
+                    return sub['SubscriptionArn']
+            if not response.get('NextToken'):
+                return None
+            kwargs['NextToken'] = response['NextToken']
+
+    def watch_network(self, check_now):
+        """
+        Check the network now and/or every network_check_interval seconds.
+        The check now is what maps the port and subscribes after a start from
+        the network cache, so it is tried until it works.
+        """
+        if check_now:
+            retry = FIRST_CHECK_RETRY
+            while not self.check_network():
+                logger.warning('Listener not reachable yet, checking the network again in %is' % retry)
+                if self.stopped.wait(retry):
+                    return
+                retry = min(retry * 2, FIRST_CHECK_MAX_RETRY)
+            logger.info('Listener ready in %.2fs' % (time.monotonic() - self.started))
+        while self.network_check_interval and not self.stopped.wait(self.network_check_interval):
+            self.check_network()
+
+    def check_network(self):
+        """
+        Make sure the port is still mapped, the external address hasn't changed
+        and we are still subscribed. If the gateway or the IP lookup can't be
+        reached nothing is changed; we only subscribe again when the address
+        has really changed or the subscription has gone. Returns True if the
+        check completed.
+        """
+        started = time.monotonic()
+        try:
+            mapped = True
+            if not self.manual_port_forward:
+                if not self.upnp:
+                    self.initialize_upnp(self.igd_url)
+                mapped = self.is_port_mapped()
+            ip = self.fixed_ip or self.get_external_ip()
+        except Exception as e:
+            logger.warning('Network check failed, carrying on with %s: %s' % (self.endpoint_url, e))
+            return False
+        endpoint = 'http://{}:{}'.format(ip, self.server.server_port)
+        try:
+            if not mapped:
+                logger.info('Port %i is no longer mapped to us, mapping it again' % self.server.server_port)
+                self.add_port_mapping()
+            if endpoint != self.endpoint_url:
+                logger.info('External address changed from %s to %s' % (self.endpoint_url, endpoint))
+                old_subscription = self.find_subscription(self.endpoint_url)
+                self.endpoint_url = endpoint
+                self.external_ip = ip
+                self.subscribe_endpoint()
+                if old_subscription:
+                    self.sns_client.unsubscribe(SubscriptionArn=old_subscription)
+            elif not self.find_subscription(endpoint):
+                logger.info('No subscription for %s, subscribing again' % endpoint)
+                self.subscribe_endpoint()
+            self.save_network()
+            logger.info('Network checked in %.2fs' % (time.monotonic() - started))
+            return True
+        except Exception:
+            logger.exception('Failed to update the subscription for %s' % endpoint)
+            return False
+
     def confirm_subscription(self, topic_arn, token):
         
         try:
@@ -123,7 +391,11 @@ class Subscriber(BaseHTTPRequestHandler):
 
     def unsubscribe(self):
 
-        if not self.manual_port_forward:
+        if self.consumer:
+            self.stop()
+            sys.exit(0)
+
+        if not self.manual_port_forward and self.upnp:
             result = self.upnp.deleteportmapping(self.server.server_port, 'TCP')
 
             if result:
@@ -132,25 +404,102 @@ class Subscriber(BaseHTTPRequestHandler):
                 raise RuntimeError(
                     'Failed to remove port forward for {}.'.format(self.server.server_port))
 
-        subscription_arn = None
-        response = self.sns_client.list_subscriptions_by_topic(TopicArn=self.topic_arn)
-        for sub in response['Subscriptions']:
-            if sub['TopicArn'] == self.topic_arn and sub['Endpoint'] == self.endpoint_url:
-                subscription_arn = sub['SubscriptionArn']
-                break
-
-        if (subscription_arn is not None and
-                subscription_arn[:12] == 'arn:aws:sns:'):
+        subscription_arn = self.find_subscription(self.endpoint_url)
+        if subscription_arn is not None:
             self.sns_client.unsubscribe(
                 SubscriptionArn=subscription_arn
             )
 
+        self.stop()
         sys.exit(0)
 
+    def stop(self):
+        self.stopped.set()
+        if self.consumer:
+            self.consumer.stop()
+        if self.dispatcher:
+            self.dispatcher.shutdown(wait=False)
+        status_server, self.status_server = self.status_server, None
+        if status_server:
+            status_server.shutdown()
+            status_server.server_close()
+        self.dedup.close()
+
+    def receive_sqs(self, message):
+        body = json.loads(message['Body'])
+        if 'Type' in body and 'TopicArn' in body:
+            # The SNS message as it would have been posted to us, signature and all
+            notifications_total.inc(type=body['Type'])
+            self.receive(body)
+            return
+        # Raw message delivery, or a message sent straight to the queue
+        notifications_total.inc(type='Notification')
+        if self.dedup.accept(message.get('MessageId')):
+            self.queue_notification(body, message.get('MessageId'))
+
+    def receive_relay(self, frame):
+        notifications_total.inc(type='Notification')
+        if self.dedup.accept(frame.get('id')):
+            self.queue_notification(frame['message'], frame.get('id'))
+
+    def receive(self, data):
+        if self.verify_executor:
+            self.verify_executor.submit(self.process_message, data)
+        else:
+            self.process_message(data)
+
+    def process_message(self, data):
+        # Everything logged for the message carries its id, see local.logs
+        with correlated(data.get('MessageId')):
+            self.__process_message(data)
+
+    def __process_message(self, data):
+        try:
+            if self.topic_arn and data.get('TopicArn') != self.topic_arn:
+                logger.warning('Ignoring message for topic %s' % data.get('TopicArn'))
+                notifications_dropped_total.inc(reason='wrong_topic')
+                return
+            if self.verifier:
+                try:
+                    with stage_seconds.time(stage='verify'):
+                        self.verifier.verify(data)
+                except SignatureError as e:
+                    logger.warning('Ignoring message: %s' % e)
+                    notifications_dropped_total.inc(reason='invalid_signature')
+                    return
+
+            type = data['Type']
+            if type == 'SubscriptionConfirmation':
+                logger.info('Received subscription confirmation...')
+                self.confirm_subscription(data['TopicArn'], data['Token'])
+
+            elif type == 'Notification':
+                logger.info('Received message...')
+                if not self.dedup.accept(data.get('MessageId'), data.get('Timestamp')):
+                    return
+                if data['Message']:
+                    self.queue_notification(json.loads(data['Message']))
+        except Exception:
+            logger.exception('Unexpected error handling message')
+
+    def queue_notification(self, notification, message_id=None):
+        with correlated(message_id):
+            if not self.dispatcher:
+                self.dispatch_notification(notification)
+                return
+            # A batch for several rooms stays in order with other batches for the same rooms
+            room = notification.get('room') or ','.join(sorted(notification.get('rooms') or []))
+            self.dispatcher.submit(room, self.dispatch_notification, notification)
+
     def dispatch_notification(self, notification):
         try:
             skill = self.skills.get(notification['handler_name'])
-            skill.handle_command(notification['room'], notification['command'], notification['data'])
+            with stage_seconds.time(stage='dispatch'):
+                if is_batch(notification):
+                    rooms, steps, stop_on_error = parse_message(notification)
+                    skill.handle_batch(rooms, steps, stop_on_error)
+                else:
+                    skill.handle_command(notification['room'], notification['command'], notification['data'])
         except Exception:
             logger.exception('Unexpected error handling message')
 
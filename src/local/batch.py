@@ -0,0 +1,107 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+A message can carry a single command:
+
+  {"handler_name": "chromecast", "room": "media room", "command": "play", "data": {}}
+
+or an ordered batch of commands, for one or more rooms:
+
+  {"handler_name": "chromecast", "rooms": ["media room", "kitchen"],
+   "commands": [{"command": "set-volume", "data": {"volume": 3}},
+                {"command": "play-video", "data": {"title": "...", "app": "youtube"}}],
+   "stop_on_error": true}
+
+Each room runs the batch in order as one unit, so the steps aren't coalesced
+with other queued commands, and each step's result is recorded.
+"""
+
+STEP_OK = 'ok'
+STEP_ERROR = 'error'
+STEP_UNKNOWN = 'unknown'
+STEP_SKIPPED = 'skipped'
+STEP_EXPIRED = 'expired'
+DEVICE_TIMEOUT = 'timeout'
+
+def is_batch(message):
+    return 'commands' in message or 'rooms' in message
+
+def parse_message(message):
+    """ Returns (rooms, [(command, data)], stop_on_error) for single command and batch messages """
+    rooms = message.get('rooms') or [message.get('room')]
+    if 'commands' in message:
+        steps = [(x['command'], x.get('data') or {}) for x in message['commands']]
+    else:
+        steps = [(message['command'], message.get('data') or {})]
+    return rooms, steps, message.get('stop_on_error', True)
+
+class Batch:
+    """
+    The steps sent to one Chromecast. Unknown steps are reported and passed
+    over; after a failed step the rest are skipped if stop_on_error is set.
+    """
+
+    def __init__(self, name, steps, stop_on_error=True, known=None, deadline=None):
+        self.name = name
+        self.steps = steps
+        self.stop_on_error = stop_on_error
+        # time.monotonic() after which steps that haven't started are given up
+        self.deadline = deadline
+        self.known = known or (lambda command: True)
+        self.results = []
+        self.done = threading.Event()
+
+    def run(self, execute):
+        failed = False
+        try:
+            for command, data in self.steps:
+                result = {'command': command}
+                if failed:
+                    result['result'] = STEP_SKIPPED
+                elif not self.known(command):
+                    result['result'] = STEP_UNKNOWN
+                elif self.deadline is not None and time.monotonic() > self.deadline:
+                    result['result'] = STEP_EXPIRED
+                else:
+                    started = time.perf_counter()
+                    try:
+                        execute(command, data)
+                        result['result'] = STEP_OK
+                    except Exception as e:
+                        logger.exception('Step %s of batch for %s failed' % (command, self.name))
+                        result['result'] = STEP_ERROR
+                        result['error'] = str(e)
+                        failed = self.stop_on_error
+                    result['seconds'] = time.perf_counter() - started
+                self.results.append(result)
+        finally:
+            logger.info('Batch for %s finished: %s' % (self.name, ', '.join('%s %s' % (x['command'], x['result']) for x in self.results)))
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """ Wait for the batch to finish, returns the step results """
+        self.done.wait(timeout)
+        return list(self.results)
+
+def collect(batches, deadline):
+    """
+    Wait until every batch has finished, or until the deadline (a time.monotonic()
+    value), and return {device name: {'result': ..., 'steps': [...]}}.
+    A device that hasn't finished by the deadline doesn't hold up the others.
+    """
+    results = {}
+    for batch in batches:
+        finished = batch.done.wait(max(0, deadline - time.monotonic()))
+        steps = list(batch.results)
+        if not finished:
+            result = DEVICE_TIMEOUT
+        elif all(x['result'] == STEP_OK for x in steps):
+            result = STEP_OK
+        else:
+            result = STEP_ERROR
+        results[batch.name] = {'result': result, 'steps': steps}
+    return results
@@ -0,0 +1,187 @@
+import json
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+DEFAULT_MAX_ROWS = 10000
+# Writes between removing old rows from a SqliteStore
+PRUNE_EVERY = 100
+
+def normalize_key(text):
+    return ' '.join(str(text).lower().split())
+
+class SqliteStore:
+    """
+    Small on-disk key/value store so cached results survive a restart.
+    Values must be JSON serializable. Rows older than max_age seconds are
+    removed, and only the newest max_rows are kept, when the store is opened
+    and every PRUNE_EVERY writes after that.
+    """
+
+    def __init__(self, filename, table, max_age=None, max_rows=DEFAULT_MAX_ROWS):
+        self.table = table
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value TEXT, updated REAL)' % table)
+            self.connection.execute('CREATE INDEX IF NOT EXISTS %s_updated ON %s (updated)' % (table, table))
+        self.prune()
+
+    def prune(self):
+        """ Remove expired rows and the oldest beyond max_rows, returns the number removed """
+        with self.lock, self.connection:
+            removed = 0
+            if self.max_age is not None:
+                removed += self.connection.execute(
+                    'DELETE FROM %s WHERE updated < ?' % self.table, (time.time() - self.max_age,)).rowcount
+            if self.max_rows is not None:
+                removed += self.connection.execute(
+                    'DELETE FROM %s WHERE key NOT IN (SELECT key FROM %s ORDER BY updated DESC LIMIT ?)' % (
+                        self.table, self.table), (self.max_rows,)).rowcount
+        if removed:
+            logger.debug('Removed %i rows from %s' % (removed, self.table))
+        return removed
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value, updated FROM %s WHERE key = ?' % self.table, (key,)).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, updated):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO %s (key, value, updated) VALUES (?, ?, ?)' % self.table,
+                (key, json.dumps(value), updated))
+            self.writes += 1
+            prune = self.writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM %s WHERE key = ?' % self.table, (key,))
+
+class ResultCache:
+    """
+    Thread-safe LRU cache where entries are fresh for ttl seconds.
+    Entries older than that, but younger than max_age, are returned straight
+    away while a background thread loads a fresh value.
+    """
+
+    def __init__(self, name, ttl, max_age=None, size=256, store=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_age = max_age if max_age is not None else ttl
+        self.size = size
+        self.store = store
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'refreshes': self.refreshes,
+                'size': len(self.entries)
+            }
+
+    def __lookup(self, key):
+        # Called with the lock held
+        entry = self.entries.get(key)
+        if entry:
+            self.entries.move_to_end(key)
+            return entry
+        if self.store:
+            entry = self.store.get(key)
+            if entry:
+                self.__put(key, entry[0], entry[1])
+        return entry
+
+    def __put(self, key, value, updated):
+        # Called with the lock held
+        self.entries[key] = (value, updated)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.__lookup(key)
+        if not entry or time.time() - entry[1] > self.ttl:
+            return default
+        return entry[0]
+
+    def set(self, key, value):
+        updated = time.time()
+        with self.lock:
+            self.__put(key, value, updated)
+        if self.store:
+            self.store.set(key, value, updated)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.store:
+            self.store.delete(key)
+
+    def get_or_load(self, key, loader, cache_if=bool):
+        """
+        Return the cached value for key, calling loader() to fill the cache.
+        Values are only cached if cache_if(value) is true.
+        """
+        with self.lock:
+            entry = self.__lookup(key)
+            age = time.time() - entry[1] if entry else None
+            if entry and age <= self.ttl:
+                self.hits += 1
+                return entry[0]
+            if entry and age <= self.max_age:
+                self.stale += 1
+                refresh = key not in self.refreshing
+                if refresh:
+                    self.refreshing.add(key)
+            else:
+                self.misses += 1
+                entry = None
+
+        if entry:
+            if refresh:
+                threading.Thread(target=self.__refresh, args=(key, loader, cache_if), daemon=True).start()
+            return entry[0]
+
+        value = loader()
+        if cache_if(value):
+            self.set(key, value)
+        return value
+
+    def __refresh(self, key, loader, cache_if):
+        try:
+            value = loader()
+            if cache_if(value):
+                self.set(key, value)
+            with self.lock:
+                self.refreshes += 1
+        except Exception:
+            logger.exception('Failed to refresh %s cache entry: %s' % (self.name, key))
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
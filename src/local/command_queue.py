@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+import contextvars
+import logging
+from local.metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+"""
+Coalescing rules, keyed by command name (as used by the Skill, e.g. set_volume).
+
+latest  - Only the most recent pending command of this kind is sent
+cancels - A pending command listed here, directly before this one, is
+          cancelled out and neither command is sent
+"""
+DEFAULT_RULES = {
+    'set_volume': {'latest': True},
+    'pause': {'cancels': ['play', 'resume']},
+    'play': {'cancels': ['pause']},
+    'resume': {'cancels': ['pause']},
+}
+
+def load_rules(filename):
+    """
+    Load coalescing rules from a JSON file, on top of the defaults.
+    A command mapped to null has its default rule removed.
+    """
+    rules = dict(DEFAULT_RULES)
+    with open(filename) as f:
+        overrides = json.load(f)
+    for command, rule in overrides.items():
+        if rule is None:
+            rules.pop(command, None)
+        else:
+            rules[command] = rule
+    return rules
+
+def coalesce(commands, rules):
+    """
+    Collapse a list of pending (command, data) tuples using the rules.
+    Returns the commands that still need to be sent, in order. Anything
+    after the data in a tuple is kept with its command.
+    """
+    result = []
+    for item in commands:
+        command = item[0]
+        rule = rules.get(command, {})
+        if result and result[-1][0] in rule.get('cancels', []):
+            result.pop()
+            continue
+        if rule.get('latest'):
+            result = [x for x in result if x[0] != command]
+        result.append(item)
+    return result
+
+class CommandQueue:
+    """
+    Serializes the commands sent to one Chromecast. Commands that arrive while
+    an earlier one is being sent are collapsed before they go to the device.
+    """
+
+    def __init__(self, name, execute, rules=None, window=0):
+        self.name = name
+        self.execute = execute
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.window = window
+        self.pending = []
+        self.queued = []
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def submit(self, command, data):
+        with self.condition:
+            # Sent in the submitter's context, so logs keep its correlation id
+            self.pending.append((command, data, contextvars.copy_context()))
+            self.queued.append(time.perf_counter())
+            self.submitted += 1
+            if not self.thread:
+                self.thread = threading.Thread(target=self.__run, name='commands-%s' % self.name, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            if self.window:
+                # Give a burst of commands a chance to arrive before sending
+                time.sleep(self.window)
+            with self.condition:
+                pending = self.pending
+                queued = self.queued
+                self.pending = []
+                self.queued = []
+            now = time.perf_counter()
+            for started in queued:
+                stage_seconds.observe(now - started, stage='device_queue_wait')
+            batch = coalesce(pending, self.rules)
+            if len(batch) < len(pending):
+                self.coalesced += len(pending) - len(batch)
+                logger.debug('Coalesced %i commands for %s into %s' % (len(pending), self.name, [x[0] for x in batch]))
+            for command, data, context in batch:
+                self.sent += 1
+                try:
+                    context.run(self.execute, command, data)
+                except Exception:
+                    logger.exception('Unexpected error sending %s to %s' % (command, self.name))
@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from local.metrics import notifications_dropped_total, notifications_late_total
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 600
+DEFAULT_SIZE = 4096
+
+def parse_timestamp(value):
+    """ SNS timestamps look like 2020-01-01T12:00:00.123Z, returns seconds since the epoch or None """
+    if not value:
+        return None
+    for pattern in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return datetime.strptime(value, pattern).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    return None
+
+class MessageDeduplicator:
+    """
+    Remembers the MessageIds seen in the last `window` seconds, at most `size`
+    of them, so a message SNS delivers again is only handled once. Messages
+    SNS says were sent longer ago than the window can't be checked, but the
+    SNS timestamp and the local clock needn't agree, so they are counted
+    and handled anyway rather than dropped.
+
+    With a log file, the ids survive a restart of the listener.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, size=DEFAULT_SIZE, log_file=None):
+        self.window = window
+        self.size = size
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        # MessageId -> time received, oldest first
+        self.seen = OrderedDict()
+        self.log = None
+        self.logged = 0
+        if log_file:
+            self.__load()
+
+    def accept(self, message_id, timestamp=None):
+        """ True if the message should be handled, False for a duplicate """
+        if not message_id:
+            return True
+        now = time.time()
+        sent = parse_timestamp(timestamp)
+        with self.lock:
+            self.__expire(now)
+            if message_id in self.seen:
+                notifications_dropped_total.inc(reason='duplicate')
+                logger.info('Dropping duplicate message %s' % message_id)
+                return False
+            if sent is not None and now - sent > self.window:
+                notifications_late_total.inc()
+                logger.warning('Message %s was sent %is ago, an earlier copy may not be remembered' % (
+                    message_id, now - sent))
+            self.seen[message_id] = now
+            while len(self.seen) > self.size:
+                self.seen.popitem(last=False)
+            if self.log:
+                self.__append(message_id, now)
+        return True
+
+    def __expire(self, now):
+        while self.seen:
+            message_id, received = next(iter(self.seen.items()))
+            if now - received <= self.window:
+                break
+            self.seen.popitem(last=False)
+
+    def __load(self):
+        if os.path.exists(self.log_file):
+            now = time.time()
+            with open(self.log_file) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        continue
+                    try:
+                        received = float(parts[0])
+                    except ValueError:
+                        continue
+                    if now - received <= self.window:
+                        self.seen[parts[1]] = received
+                        self.seen.move_to_end(parts[1])
+            while len(self.seen) > self.size:
+                self.seen.popitem(last=False)
+            logger.info('Loaded %i recent message ids from %s' % (len(self.seen), self.log_file))
+        self.__compact()
+
+    def __append(self, message_id, received):
+        try:
+            self.log.write('%f %s\n' % (received, message_id))
+            self.log.flush()
+            self.logged += 1
+            # Keep the file about as small as the index
+            if self.logged > self.size * 2:
+                self.__compact()
+        except Exception:
+            logger.exception('Failed to write %s' % self.log_file)
+
+    def __compact(self):
+        if self.log:
+            self.log.close()
+        temp_file = self.log_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            for message_id, received in self.seen.items():
+                f.write('%f %s\n' % (received, message_id))
+        os.replace(temp_file, self.log_file)
+        self.log = open(self.log_file, 'a')
+        self.logged = len(self.seen)
+
+    def close(self):
+        with self.lock:
+            if self.log:
+                self.log.close()
+                self.log = None
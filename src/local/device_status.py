@@ -0,0 +1,58 @@
+import time
+import threading
+from collections import namedtuple
+
+"""
+Latest known state of each Chromecast, kept up to date by the status
+messages the devices push to us. Snapshots are immutable, so they can be
+read from any thread without waiting on the device.
+
+connected    - True/False from the connection status, None until first heard from
+app_id, app  - Running application id and display name
+content_id   - Media playing, e.g. the YouTube video id
+player_state - PLAYING, PAUSED, BUFFERING, IDLE or UNKNOWN
+volume       - Device volume, 0 to 1
+muted        - Device muted
+queue        - Videos last queued by the skill
+queue_loaded - How many of them have been added to the device's queue so far
+queue_position - Index in the device's queue of the video playing, None if not known
+updated      - time.time() of the last update
+"""
+DeviceSnapshot = namedtuple('DeviceSnapshot', [
+    'name', 'connected', 'app_id', 'app', 'content_id', 'player_state', 'volume', 'muted', 'queue', 'queue_loaded', 'queue_position', 'updated'])
+
+EMPTY_SNAPSHOT = DeviceSnapshot(None, None, None, None, None, None, None, None, (), 0, None, None)
+
+class StatusStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {}
+
+    def update(self, name, **fields):
+        """ Replace some fields of a device's snapshot, returns the new snapshot """
+        with self.lock:
+            snapshot = self.snapshots.get(name, EMPTY_SNAPSHOT)._replace(name=name, updated=time.time(), **fields)
+            self.snapshots[name] = snapshot
+            return snapshot
+
+    def get(self, name):
+        return self.snapshots.get(name)
+
+    def all(self):
+        with self.lock:
+            return dict(self.snapshots)
+
+    def rename(self, old, new):
+        with self.lock:
+            snapshot = self.snapshots.pop(old, None)
+            if snapshot:
+                self.snapshots[new] = snapshot._replace(name=new)
+
+    def remove(self, name):
+        with self.lock:
+            self.snapshots.pop(name, None)
+
+    def as_dict(self):
+        """ Every snapshot as plain data, e.g. for JSON """
+        return {name: dict(x._asdict(), queue=list(x.queue)) for name, x in self.all().items()}
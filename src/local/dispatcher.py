@@ -0,0 +1,70 @@
+import time
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from local.metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 16
+
+"""
+Runs notification handlers on a bounded pool of worker threads.
+Work for the same room runs in the order it was submitted, work for
+different rooms runs in parallel.
+"""
+class RoomDispatcher:
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dispatch')
+
+    @staticmethod
+    def room_key(room):
+        return str(room or '').strip().lower()
+
+    def submit(self, room, func, *args):
+        key = self.room_key(room)
+        with self.lock:
+            queue = self.queues.get(key)
+            start = queue is None
+            if start:
+                queue = deque()
+                self.queues[key] = queue
+            elif len(queue) >= self.queue_size:
+                logger.warning('Dropping command for %s, %i commands already queued' % (key, len(queue)))
+                return False
+            # Run in the submitter's context, so logs keep its correlation id
+            queue.append((func, args, time.perf_counter(), contextvars.copy_context()))
+        if start:
+            self.executor.submit(self.__drain, key)
+        return True
+
+    def pending(self, room):
+        with self.lock:
+            queue = self.queues.get(self.room_key(room))
+            return len(queue) if queue else 0
+
+    def __drain(self, key):
+        # A room's queue stays registered while it is being drained, so new
+        # work for the room is appended here rather than starting a second worker
+        while True:
+            with self.lock:
+                queue = self.queues[key]
+                if not queue:
+                    del self.queues[key]
+                    return
+                func, args, queued, context = queue.popleft()
+            stage_seconds.observe(time.perf_counter() - queued, stage='room_queue_wait')
+            try:
+                context.run(func, *args)
+            except Exception:
+                logger.exception('Unexpected error dispatching command for %s' % key)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
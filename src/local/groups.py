@@ -0,0 +1,43 @@
+import json
+import logging
+from local.room_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Room names that mean every Chromecast
+ALL_ROOMS = ['all', 'everywhere', 'every room', 'all rooms', 'whole house', 'everything']
+DEFAULT_GROUP_DEADLINE = 10
+
+def load_groups(filename):
+    """
+    Load room groups from a JSON file mapping a group name to the rooms in it.
+    e.g. {"downstairs": ["living room", "kitchen"]}
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+def group_key(name):
+    return ' '.join(tokenize(name))
+
+class RoomGroups:
+    """
+    Resolves a room heard by Alexa to the rooms of a group. Rooms in a group
+    are matched to Chromecasts like any other room.
+    """
+
+    def __init__(self, groups=None):
+        self.groups = {group_key(name): list(rooms) for name, rooms in (groups or {}).items()}
+        self.all = {group_key(x) for x in ALL_ROOMS}
+
+    def is_all(self, room):
+        return group_key(room) in self.all
+
+    def resolve(self, room, names):
+        """
+        The rooms in the group, or None if room isn't a group.
+        names is every known Chromecast name, used for "all".
+        """
+        key = group_key(room)
+        if key in self.all:
+            return sorted(names)
+        return self.groups.get(key)
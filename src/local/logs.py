@@ -0,0 +1,161 @@
+import sys
+import copy
+import json
+import uuid
+import queue
+import signal
+import itertools
+import contextvars
+import logging
+import logging.handlers
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+"""
+Logging for the local listener. Records are put on a queue by the thread
+that logs them and written to stdout and the log file by a QueueListener
+thread, so a slow disk or terminal never holds up a command. Each record
+carries the correlation id of the message it was logged for, which follows
+the command across the dispatcher and device queues.
+"""
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+LOG_FORMATS = [LOG_FORMAT_TEXT, LOG_FORMAT_JSON]
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(correlation_id)s - %(message)s'
+# Every Cast message the YouTube controller receives is logged at debug, keep 1 in 20 of them
+DEFAULT_SAMPLING = 'local.ChromecastSkill.cast=20'
+
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+def new_correlation_id():
+    return uuid.uuid4().hex[:12]
+
+@contextmanager
+def correlated(id=None):
+    """ Log under id, or the id already set, or a new one """
+    token = correlation_id.set(id or correlation_id.get() or new_correlation_id())
+    try:
+        yield correlation_id.get()
+    finally:
+        correlation_id.reset(token)
+
+class CorrelationFilter(logging.Filter):
+    """ Stamps records with the correlation id, on the thread that logged them """
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get() or '-'
+        return True
+
+class SampleFilter(logging.Filter):
+    """ Keeps one in every `every` records below WARNING """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self.counter) % self.every == 0
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per line """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'correlation_id': getattr(record, 'correlation_id', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    The standard QueueHandler formats the whole record before queueing it,
+    which would leave nothing for the JSON formatter. Only the message and
+    traceback are resolved here, while the arguments are still as logged.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def parse_settings(text):
+    """ 'a=DEBUG,b.c=INFO' as {'a': 'DEBUG', 'b.c': 'INFO'} """
+    settings = {}
+    for item in (text or '').split(','):
+        if item.strip():
+            name, _, value = item.partition('=')
+            settings[name.strip()] = value.strip()
+    return settings
+
+def load_levels(filename):
+    """ A JSON file of logger names to levels, e.g. {"local.ChromecastSkill": "DEBUG"}. "root" is the root logger """
+    with open(filename) as f:
+        return json.load(f)
+
+def apply_levels(levels):
+    for name, level in levels.items():
+        logging.getLogger(None if name == 'root' else name).setLevel(str(level).upper())
+
+def apply_sampling(sampling):
+    for name, every in sampling.items():
+        log = logging.getLogger(name)
+        for existing in [x for x in log.filters if isinstance(x, SampleFilter)]:
+            log.removeFilter(existing)
+        if int(every) > 1:
+            log.addFilter(SampleFilter(int(every)))
+
+class LogPipeline:
+    """ Moves the root logger's output onto a QueueListener thread """
+
+    def __init__(self, handlers, log_format=LOG_FORMAT_TEXT, level=logging.INFO):
+        if log_format not in LOG_FORMATS:
+            raise ValueError('Unknown log format: %s' % log_format)
+        formatter = JsonFormatter() if log_format == LOG_FORMAT_JSON else logging.Formatter(TEXT_FORMAT)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        self.handler = LogQueueHandler(self.queue)
+        self.handler.addFilter(CorrelationFilter())
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def start(self):
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        root.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """ Write out whatever is still queued """
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+
+    def reload_on_hangup(self, levels_file):
+        """ Re-read levels_file whenever the process is sent SIGHUP, to change levels without a restart """
+        def reload(signum, frame):
+            try:
+                apply_levels(load_levels(levels_file))
+                logger.info('Log levels reloaded from %s' % levels_file)
+            except (OSError, ValueError) as e:
+                logger.warning('Could not reload log levels from %s: %s' % (levels_file, e))
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, reload)
+
+def stdout_and_file(filename):
+    return [logging.StreamHandler(sys.stdout),
+            logging.handlers.TimedRotatingFileHandler(filename, when='D', interval=1, backupCount=5)]
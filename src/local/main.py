@@ -9,33 +9,138 @@ AWS_DEFAULT_REGION - AWS Lambda and SNS Region (e.g. eu-west-1)
 AWS_SNS_TOPIC_ARN - AWS SNS Topic ARN (e.g. arn:aws:sns:eu-west-1:236205202378:Alexa-Chromecast) 
 PORT - Hardcode external port.
 CHROMECAST_NAME - name of the Chromecast to send commands to
+TRANSPORT - 'http' (default) has SNS push commands to the listener, 'sqs' pulls them from SQS_QUEUE_URL,
+            'relay' keeps a connection open to RELAY_URL
+SQS_QUEUE_URL - URL of an SQS queue subscribed to the SNS topic, for the sqs transport
+SQS_BATCH_SIZE - Messages received from the queue at a time, 1 to 10 (default 10)
+SQS_WAIT_TIME - Seconds each receive waits for a message, 0 to 20 (default 20)
+RELAY_URL - tcp://host:port or tls://host:port of a relay, for the relay transport
+RELAY_TOKEN - Shared secret the relay expects
+RELAY_HEARTBEAT - Seconds between heartbeats to the relay (default 15)
+NETWORK_CACHE_FILE - File keeping the gateway, addresses and port for a fast restart, e.g. network-cache.json (off by default)
+NETWORK_CHECK_INTERVAL - Seconds between background checks of the port mapping and external IP (default 600, 0 to turn off)
+STATUS_ADDRESS - host:port /status and /metrics are served on, kept off the port forwarded for SNS (default 127.0.0.1:9102, empty to turn off)
+SERVER_MODE - 'simple' (default) handles one notification at a time, 'threaded' runs rooms in parallel
+DISPATCH_WORKERS - Number of worker threads in threaded mode (default 4)
+ROOM_QUEUE_SIZE - Maximum commands waiting per room in threaded mode (default 16)
+COALESCE_RULES_FILE - JSON file overriding how queued commands are collapsed per Chromecast
+COMMAND_COALESCE_WINDOW - Seconds to wait for a burst of commands before sending (default 0)
+DISCOVERY_MODE - 'rescan' (default) rescans every 2 hours, 'incremental' follows mDNS updates continuously
+FAST_START - Set to 1 to start listening before the Chromecasts have connected
+CONNECT_TIMEOUT - Seconds to wait for each Chromecast to connect during discovery (default 30)
+COMMAND_READY_TIMEOUT - With FAST_START, seconds a command waits for its Chromecast to be ready (default 30)
+ROOM_ALIASES_FILE - JSON file mapping Chromecast names to other room names, e.g. {"Living Room TV": ["lounge"]}
+ROOM_GROUPS_FILE - JSON file of room groups, e.g. {"downstairs": ["living room", "kitchen"]}. "all" and "everywhere" always mean every Chromecast
+GROUP_DEADLINE - Seconds a command for a group of rooms has to reach each Chromecast (default 10)
+DEDUP_WINDOW - Seconds a message id is remembered, so a message SNS delivers twice is only handled once (default 600)
+DEDUP_SIZE - Maximum message ids remembered (default 4096)
+DEDUP_LOG_FILE - Optional file keeping recent message ids across restarts
+SNS_VERIFY - Set to 0 to skip checking that messages were signed by SNS (default 1)
+SNS_CERT_CACHE_DIR - Folder the SNS signing certificates are kept in (default sns-certs)
+SNS_CA_FILE - Optional PEM file of CAs that must have issued the SNS signing certificate
+YOUTUBE_QUEUE_BATCH_SIZE - Videos added to the YouTube queue per request, after the first has started (default 5)
+WARM_APP_POLICY - 'off' (default), 'session' keeps a running YouTube's lounge session fresh, 'idle' also launches YouTube on idle Chromecasts
+WARM_APP_INTERVAL - Seconds between warming each Chromecast (default 600)
+WARM_APP_HOURS - Hours of the day to warm Chromecasts in, e.g. 7-23 (default all day)
+YOUTUBE_CACHE_TTL, YOUTUBE_CACHE_MAX_AGE, YOUTUBE_CACHE_SIZE, YOUTUBE_CACHE_FILE, YOUTUBE_CACHE_FILE_SIZE - YouTube search cache settings
+LOG_FORMAT - 'text' (default) or 'json', one object per line
+LOG_LEVELS - Logger levels, e.g. local.ChromecastSkill=DEBUG,pychromecast=WARNING (everything is INFO by default)
+LOG_LEVELS_FILE - JSON file of logger levels, e.g. {"local.ChromecastSkill": "DEBUG"}, re-read on SIGHUP
+LOG_SAMPLING - Keep 1 in N debug and info records from a logger, e.g. local.ChromecastSkill.cast=20 (the default)
 
 """
 
 import os
 import sys
+import atexit
 import logging
-from local.SkillSubscriber import Subscriber
-from local.ChromecastSkill import Skill
+from local.logs import (LogPipeline, stdout_and_file, parse_settings, load_levels, apply_levels, apply_sampling,
+                        LOG_FORMAT_TEXT, DEFAULT_SAMPLING)
+from local.SkillSubscriber import (Subscriber, SERVER_MODE_SIMPLE, TRANSPORT_HTTP, DEFAULT_STATUS_ADDRESS,
+                                   parse_address)
+from local.sqs_consumer import DEFAULT_BATCH_SIZE, DEFAULT_WAIT_TIME
+from local.relay import DEFAULT_HEARTBEAT
+from local.network import NetworkCache, DEFAULT_CHECK_INTERVAL
+from local.dispatcher import DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from local.command_queue import load_rules
+from local.room_index import load_aliases
+from local.groups import load_groups, DEFAULT_GROUP_DEADLINE
+from local.dedup import MessageDeduplicator, DEFAULT_WINDOW, DEFAULT_SIZE
+from local.sns_verify import SignatureVerifier, CertificateStore, load_ca_certs
+from local.ChromecastSkill import Skill, DISCOVERY_MODE_RESCAN, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READY_TIMEOUT
+from local.queue_loader import DEFAULT_BATCH_SIZE as DEFAULT_QUEUE_BATCH_SIZE
+from local.warm_apps import WarmPolicy, parse_hours, WARM_OFF, DEFAULT_WARM_INTERVAL
 
 cwd = os.getcwd()
 
-#Setup root logger to log to stdout and a file
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(formatter)
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.INFO)
-root_logger.addHandler(handler)
+LOG_FORMAT = os.getenv('LOG_FORMAT', LOG_FORMAT_TEXT)
+LOG_LEVELS = os.getenv('LOG_LEVELS')
+LOG_LEVELS_FILE = os.getenv('LOG_LEVELS_FILE')
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', DEFAULT_SAMPLING)
 
-handler = logging.handlers.TimedRotatingFileHandler(cwd+os.path.sep+'alexa-chromecast.log', when='D', interval=1, backupCount=5)
-handler.setFormatter(formatter)
-root_logger.addHandler(handler)
+#Log to stdout and a file, from a background thread
+log_pipeline = LogPipeline(stdout_and_file(cwd+os.path.sep+'alexa-chromecast.log'), LOG_FORMAT).start()
+atexit.register(log_pipeline.stop)
+apply_levels(parse_settings(LOG_LEVELS))
+if LOG_LEVELS_FILE:
+    apply_levels(load_levels(LOG_LEVELS_FILE))
+    log_pipeline.reload_on_hangup(LOG_LEVELS_FILE)
+apply_sampling(parse_settings(LOG_SAMPLING))
+root_logger = logging.getLogger()
 
 PORT = os.getenv('EXTERNAL_PORT')
 IP = os.getenv('EXTERNAL_IP')
+TRANSPORT = os.getenv('TRANSPORT', TRANSPORT_HTTP)
+SQS_QUEUE_URL = os.getenv('SQS_QUEUE_URL')
+SQS_BATCH_SIZE = int(os.getenv('SQS_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+SQS_WAIT_TIME = int(os.getenv('SQS_WAIT_TIME', DEFAULT_WAIT_TIME))
+RELAY_URL = os.getenv('RELAY_URL')
+RELAY_TOKEN = os.getenv('RELAY_TOKEN')
+RELAY_HEARTBEAT = float(os.getenv('RELAY_HEARTBEAT', DEFAULT_HEARTBEAT))
+NETWORK_CACHE_FILE = os.getenv('NETWORK_CACHE_FILE')
+NETWORK_CHECK_INTERVAL = float(os.getenv('NETWORK_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL))
+STATUS_ADDRESS = parse_address(os.getenv('STATUS_ADDRESS', DEFAULT_STATUS_ADDRESS))
+SERVER_MODE = os.getenv('SERVER_MODE', SERVER_MODE_SIMPLE)
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', DEFAULT_WORKERS))
+ROOM_QUEUE_SIZE = int(os.getenv('ROOM_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+COALESCE_RULES_FILE = os.getenv('COALESCE_RULES_FILE')
+COMMAND_COALESCE_WINDOW = float(os.getenv('COMMAND_COALESCE_WINDOW', 0))
+DISCOVERY_MODE = os.getenv('DISCOVERY_MODE', DISCOVERY_MODE_RESCAN)
+FAST_START = os.getenv('FAST_START', '0') == '1'
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT))
+COMMAND_READY_TIMEOUT = float(os.getenv('COMMAND_READY_TIMEOUT', DEFAULT_READY_TIMEOUT))
+ROOM_ALIASES_FILE = os.getenv('ROOM_ALIASES_FILE')
+ROOM_GROUPS_FILE = os.getenv('ROOM_GROUPS_FILE')
+GROUP_DEADLINE = float(os.getenv('GROUP_DEADLINE', DEFAULT_GROUP_DEADLINE))
+DEDUP_WINDOW = float(os.getenv('DEDUP_WINDOW', DEFAULT_WINDOW))
+DEDUP_SIZE = int(os.getenv('DEDUP_SIZE', DEFAULT_SIZE))
+DEDUP_LOG_FILE = os.getenv('DEDUP_LOG_FILE')
+SNS_VERIFY = os.getenv('SNS_VERIFY', '1') == '1'
+SNS_CERT_CACHE_DIR = os.getenv('SNS_CERT_CACHE_DIR', cwd+os.path.sep+'sns-certs')
+SNS_CA_FILE = os.getenv('SNS_CA_FILE')
+YOUTUBE_QUEUE_BATCH_SIZE = int(os.getenv('YOUTUBE_QUEUE_BATCH_SIZE', DEFAULT_QUEUE_BATCH_SIZE))
+WARM_APP_POLICY = os.getenv('WARM_APP_POLICY', WARM_OFF)
+WARM_APP_INTERVAL = float(os.getenv('WARM_APP_INTERVAL', DEFAULT_WARM_INTERVAL))
+WARM_APP_HOURS = os.getenv('WARM_APP_HOURS')
 
 if __name__ == "__main__":
     root_logger.info("Starting Alexa Chromecast listener...")
-    chromecast_skill = Skill()
-    Subscriber({'chromecast': chromecast_skill}, IP, PORT)
+    coalesce_rules = load_rules(COALESCE_RULES_FILE) if COALESCE_RULES_FILE else None
+    aliases = load_aliases(ROOM_ALIASES_FILE) if ROOM_ALIASES_FILE else None
+    groups = load_groups(ROOM_GROUPS_FILE) if ROOM_GROUPS_FILE else None
+    chromecast_skill = Skill(coalesce_rules, COMMAND_COALESCE_WINDOW, DISCOVERY_MODE,
+                             FAST_START, CONNECT_TIMEOUT, COMMAND_READY_TIMEOUT, aliases, groups, GROUP_DEADLINE,
+                             YOUTUBE_QUEUE_BATCH_SIZE,
+                             WarmPolicy(WARM_APP_POLICY, WARM_APP_INTERVAL, parse_hours(WARM_APP_HOURS)))
+    dedup = MessageDeduplicator(DEDUP_WINDOW, DEDUP_SIZE, DEDUP_LOG_FILE)
+    verifier = None
+    if SNS_VERIFY:
+        ca_certs = load_ca_certs(SNS_CA_FILE) if SNS_CA_FILE else None
+        verifier = SignatureVerifier(CertificateStore(SNS_CERT_CACHE_DIR, ca_certs=ca_certs))
+    Subscriber({'chromecast': chromecast_skill}, IP, PORT,
+               server_mode=SERVER_MODE, workers=DISPATCH_WORKERS, queue_size=ROOM_QUEUE_SIZE, dedup=dedup,
+               verifier=verifier, transport=TRANSPORT, queue_url=SQS_QUEUE_URL,
+               sqs_batch_size=SQS_BATCH_SIZE, sqs_wait_time=SQS_WAIT_TIME,
+               relay_url=RELAY_URL, relay_token=RELAY_TOKEN, relay_heartbeat=RELAY_HEARTBEAT,
+               network_cache=NetworkCache(NETWORK_CACHE_FILE) if NETWORK_CACHE_FILE else None,
+               network_check_interval=NETWORK_CHECK_INTERVAL, status_address=STATUS_ADDRESS)
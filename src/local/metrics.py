@@ -0,0 +1,170 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+"""
+Lightweight in-process metrics, rendered in the Prometheus text format.
+Recording a value is a lock and a few list updates, so instrumentation can
+stay on in production.
+"""
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+class Counter:
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(x, '') for x in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(x, '') for x in self.label_names)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return ['%s%s %s' % (self.name, format_labels(self.label_names, key), value) for key, value in values]
+
+class Histogram:
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(x, '') for x in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # [bucket counts..., +Inf count, sum]
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[key] = series
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        key = tuple(labels.get(x, '') for x in self.label_names)
+        with self.lock:
+            series = self.values.get(key)
+            return sum(series[:-1]) if series else 0
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self.lock:
+            values = sorted((key, list(series)) for key, series in self.values.items())
+        lines = []
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %i' % (self.name, format_labels(self.label_names, key, ('le', bound)), cumulative))
+            labels = format_labels(self.label_names, key)
+            lines.append('%s_sum%s %s' % (self.name, labels, series[-1]))
+            lines.append('%s_count%s %i' % (self.name, labels, cumulative))
+        return lines
+
+class Gauge:
+    """
+    Values read from a callback when metrics are rendered.
+    The callback returns a list of (label values, value) tuples.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labels, callback):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.callback = callback
+
+    def render(self):
+        return ['%s%s %s' % (self.name, format_labels(self.label_names, key), value) for key, value in self.callback()]
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def __register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self.__register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.__register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels, callback):
+        return self.__register(Gauge(name, help, labels, callback))
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda x: x.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Shared metrics for the command path
+stage_seconds = registry.histogram(
+    'alexa_chromecast_stage_seconds', 'Time spent in each stage of handling a command', ['stage'])
+command_seconds = registry.histogram(
+    'alexa_chromecast_command_seconds', 'Time taken to send a command to a Chromecast', ['command', 'device'])
+commands_total = registry.counter(
+    'alexa_chromecast_commands_total', 'Commands handled, by result', ['command', 'device', 'result'])
+notifications_total = registry.counter(
+    'alexa_chromecast_notifications_total', 'SNS messages received, by type', ['type'])
+notifications_dropped_total = registry.counter(
+    'alexa_chromecast_notifications_dropped_total', 'SNS messages not handled, by reason', ['reason'])
+notifications_late_total = registry.counter(
+    'alexa_chromecast_notifications_late_total', 'SNS messages handled although sent longer ago than message ids are kept')
+
+def cache_gauge(name, cache):
+    """ Expose a ResultCache's counters """
+    return registry.gauge('alexa_chromecast_%s_cache' % name, 'Counters for the %s cache' % name, ['stat'],
+                          lambda: sorted(((k,), v) for k, v in cache.stats().items()))
@@ -1,64 +1,103 @@
-import urllib
-import json
-import requests
 import os
+import threading
 import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from local.cache import ResultCache, normalize_key
+from local.metrics import stage_seconds, cache_gauge
+from shared.lookups import moviedb_movie, moviedb_trailer_key, MOVIEDB_API_URI, MOVIEDB_LANGUAGE
 
 MOVIEDB_API_KEY = os.getenv("MOVIEDB_API_KEY", False)
-MOVIEDB_API_URI = "https://api.themoviedb.org/3"
+MOVIEDB_TIMEOUT = (3.05, 10) # (connect, read) seconds
+MOVIEDB_CACHE_TTL = int(os.getenv('MOVIEDB_CACHE_TTL', 24 * 60 * 60))
+MOVIEDB_CACHE_SIZE = int(os.getenv('MOVIEDB_CACHE_SIZE', 256))
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
 
-def moviedb_search_movies(movie):
-    if not MOVIEDB_API_KEY:
-        logger.error('You need to set a moviedb API key. e.g. export MOVIEDB_API_KEY=xxxxxx')
-        logger.error('You can request this at: %s' % MOVIEDB_API_URI)
-        raise Exception("No MovieDb API Key")
-
-    query = {
-        "api_key": MOVIEDB_API_KEY,
-        "language": 'en-GB',
-        "query": movie,
-        "page": 1,
-        "include_adult": False
-    }
-
-    uri = "{}/search/movie?{}".format(MOVIEDB_API_URI, urllib.parse.urlencode(query))
-
-    r = requests.get(uri)
-    response = r.json()
-
-    if response["total_results"] > 0:
-        first_result = response["results"][0]
-        return first_result
-    else:
-        raise Exception("No Results")
+class MovieDbError(Exception):
+    """ If a MovieDb lookup fails or finds nothing """
+    pass
 
-def moviedb_search_movie_videos(moviedb_id):
-    query = {
-        "api_key": MOVIEDB_API_KEY,
-        "language": 'en-GB'
-    }
-    url = "{}/movie/{}/videos?{}".format(MOVIEDB_API_URI, moviedb_id, urllib.parse.urlencode(query))
-    r = requests.get(url)
-    response = r.json()
+class MovieDbClient:
+    """
+    MovieDb API client that reuses pooled connections and caches both the
+    title to movie lookup and the movie to trailer lookup.
+    """
 
-    print (url, response)
+    def __init__(self, api_key=MOVIEDB_API_KEY, api_uri=MOVIEDB_API_URI, timeout=MOVIEDB_TIMEOUT,
+                 cache_ttl=MOVIEDB_CACHE_TTL, cache_size=MOVIEDB_CACHE_SIZE):
+        self.api_key = api_key
+        self.api_uri = api_uri
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=4, max_retries=Retry(
+            total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.movies = ResultCache('moviedb-movies', cache_ttl, size=cache_size)
+        self.trailers = ResultCache('moviedb-trailers', cache_ttl, size=cache_size)
+        cache_gauge('moviedb_movies', self.movies)
+        cache_gauge('moviedb_trailers', self.trailers)
 
-    try:
-        return response["results"][0]["key"]
-    except Exception as err:
-        logger.exception('Unexpected error parsing MovieDb response')
-        raise err
+    def cache_stats(self):
+        return {
+            'movies': self.movies.stats(),
+            'trailers': self.trailers.stats()
+        }
 
+    def __get(self, path, **params):
+        if not self.api_key:
+            logger.error('You need to set a moviedb API key. e.g. export MOVIEDB_API_KEY=xxxxxx')
+            logger.error('You can request this at: %s' % self.api_uri)
+            raise MovieDbError("No MovieDb API Key")
+        params.update({"api_key": self.api_key, "language": MOVIEDB_LANGUAGE})
+        r = self.session.get(self.api_uri + path, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
 
-def get_movie_trailer_youtube_id(movie_name):
-    moviedb_movie = moviedb_search_movies(movie_name)
-    youtube_id = moviedb_search_movie_videos(moviedb_movie["id"])
-    return {
-        "youtube_id": youtube_id,
-        "title": moviedb_movie["title"]
-    }
+    def search_movie(self, movie):
+        return self.movies.get_or_load(normalize_key(movie), lambda: self.__search_movie(movie))
+
+    def __search_movie(self, movie):
+        found = moviedb_movie(self.__get, movie)
+        if not found:
+            raise MovieDbError("No Results")
+        return found
+
+    def get_trailer_key(self, moviedb_id):
+        return self.trailers.get_or_load(moviedb_id, lambda: self.__get_trailer_key(moviedb_id))
+
+    def __get_trailer_key(self, moviedb_id):
+        # A second call after /search/movie on a cold lookup, for just the movie's videos
+        key = moviedb_trailer_key(self.__get, moviedb_id)
+        if not key:
+            raise MovieDbError("No trailer found for %s" % moviedb_id)
+        return key
 
+    def get_movie_trailer_youtube_id(self, movie_name):
+        with stage_seconds.time(stage='moviedb_lookup'):
+            moviedb_movie = self.search_movie(movie_name)
+            return {
+                "youtube_id": self.get_trailer_key(moviedb_movie["id"]),
+                "title": moviedb_movie["title"]
+            }
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if not _client:
+            _client = MovieDbClient()
+        return _client
+
+def moviedb_search_movies(movie):
+    return get_client().search_movie(movie)
+
+def moviedb_search_movie_videos(moviedb_id):
+    return get_client().get_trailer_key(moviedb_id)
+
+def get_movie_trailer_youtube_id(movie_name):
+    return get_client().get_movie_trailer_youtube_id(movie_name)
@@ -0,0 +1,72 @@
+import os
+import json
+import socket
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+"""
+What the listener found out about the network last time it ran, so it can
+start listening straight away and check it all again in the background.
+
+igd_url     - Root description URL of the UPnP gateway, so it needn't be discovered again
+lan_address - Our address on the LAN, that the port is mapped to
+external_ip - Public address SNS posts to
+port        - Port listened on and mapped on the gateway
+"""
+NetworkState = namedtuple('NetworkState', ['igd_url', 'lan_address', 'external_ip', 'port'])
+
+SSDP_ADDRESS = ('239.255.255.250', 1900)
+IGD_SEARCH_TARGET = 'urn:schemas-upnp-org:device:InternetGatewayDevice:1'
+DEFAULT_CHECK_INTERVAL = 600
+
+class NetworkCache:
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        """ The saved NetworkState, or None """
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            return NetworkState(*[data.get(x) for x in NetworkState._fields])
+        except Exception:
+            logger.exception('Ignoring unreadable network cache %s' % self.filename)
+            return None
+
+    def save(self, state):
+        temp_file = self.filename + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state._asdict(), f)
+        os.replace(temp_file, self.filename)
+
+def find_igd_location(timeout=3):
+    """
+    Ask the network for an Internet Gateway Device with an SSDP search and
+    return the first root description URL that answers, or None.
+    """
+    request = '\r\n'.join([
+        'M-SEARCH * HTTP/1.1',
+        'HOST: %s:%i' % SSDP_ADDRESS,
+        'MAN: "ssdp:discover"',
+        'MX: %i' % max(1, int(timeout)),
+        'ST: %s' % IGD_SEARCH_TARGET,
+        '', '']).encode('ascii')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.settimeout(timeout)
+        sock.sendto(request, SSDP_ADDRESS)
+        while True:
+            data = sock.recv(4096).decode('utf-8', 'replace')
+            for line in data.split('\r\n'):
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'location' and value.strip():
+                    return value.strip()
+    except (socket.timeout, OSError):
+        return None
+    finally:
+        sock.close()
@@ -0,0 +1,94 @@
+import time
+import threading
+import contextvars
+import logging
+from local.metrics import registry, stage_seconds
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5
+# Seconds before a failed batch is tried again
+RETRY_DELAY = 0.5
+# Seconds to wait for a batch being sent when loading is cancelled. casttube's requests have no timeout,
+# so this bounds how long a new command can be held up by one.
+CANCEL_TIMEOUT = 5
+
+queue_videos_total = registry.counter(
+    'alexa_chromecast_queue_videos_total', 'Videos added to a YouTube queue in the background, by result', ['result'])
+
+class QueueLoader:
+    """
+    Adds videos to the end of a YouTube queue on a background thread, once the
+    first video is playing. Each batch of batch_size videos is sent to the
+    YouTube session in a single request. A batch that fails is tried once
+    more after RETRY_DELAY, then its videos are counted as failed and loading
+    carries on.
+
+    on_progress(loader) is called after each batch.
+    """
+
+    def __init__(self, name, youtube_controller, video_ids, batch_size=DEFAULT_BATCH_SIZE, on_progress=None):
+        self.name = name
+        self.controller = youtube_controller
+        self.video_ids = list(video_ids)
+        self.batch_size = max(1, batch_size)
+        self.on_progress = on_progress
+        self.loaded = 0
+        self.failed = []
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def total(self):
+        return len(self.video_ids)
+
+    def start(self):
+        # Logs carry the correlation id of the command that started loading
+        threading.Thread(target=contextvars.copy_context().run, args=(self.run,), name='queue-%s' % self.name,
+                         daemon=True).start()
+        return self
+
+    def cancel(self, timeout=None):
+        """ Stop loading and wait for a batch that is being sent to finish """
+        self.cancelled.set()
+        return self.done.wait(timeout)
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            for i in range(0, self.total, self.batch_size):
+                batch = self.video_ids[i:i + self.batch_size]
+                added = self.__add(batch)
+                if added is None:
+                    logger.info('Stopped loading the queue on %s at %i of %i videos' % (self.name, self.loaded, self.total))
+                    return
+                if added:
+                    self.loaded += len(batch)
+                    queue_videos_total.inc(len(batch), result='loaded')
+                else:
+                    self.failed.extend(batch)
+                    queue_videos_total.inc(len(batch), result='failed')
+                if self.on_progress:
+                    self.on_progress(self)
+            logger.info('Loaded %i of %i queued videos on %s in %.2fs' % (
+                self.loaded, self.total, self.name, time.monotonic() - started))
+        finally:
+            stage_seconds.observe(time.monotonic() - started, stage='queue_load')
+            self.done.set()
+
+    def __add(self, batch):
+        """ True if the batch was added, False if it failed, None if cancelled """
+        for attempt in range(2):
+            if attempt and self.cancelled.wait(RETRY_DELAY):
+                return None
+            # Holding the session lock means a new command can't start between the check and the request
+            with self.controller.session_lock:
+                if self.cancelled.is_set():
+                    return None
+                try:
+                    self.controller.add_videos_to_queue(batch)
+                    return True
+                except Exception as e:
+                    logger.warning('Failed to add %i videos to the queue on %s (attempt %i): %s' % (
+                        len(batch), self.name, attempt + 1, e))
+        return False
@@ -0,0 +1,322 @@
+import os
+import ssl
+import hmac
+import ipaddress
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import socketserver
+from urllib.parse import urlparse
+from local.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+"""
+A relay keeps one connection open to the local listener, so commands from
+the Lambda function arrive over a socket that is already connected instead
+of SNS opening a new HTTP connection for every message.
+
+Every frame is a JSON object on its own line:
+
+  listener -> relay   {"type": "subscribe", "token": "..."}
+  relay -> listener   {"type": "subscribed"}
+  listener -> relay   {"type": "ping"}                     every heartbeat
+  relay -> listener   {"type": "pong"}
+  Lambda -> relay     {"type": "publish", "token": "...", "id": "...", "message": {...}}
+  relay -> Lambda     {"type": "published", "id": "...", "delivered": 1}
+  relay -> listener   {"type": "message", "id": "...", "message": {...}}
+
+A bad token gets {"type": "error", "error": "..."} and the connection is
+closed. RelayServer is a small relay that can be run on any host both the
+Lambda function and the listener can reach, e.g.
+
+  RELAY_TOKEN=secret RELAY_CERT_FILE=cert.pem RELAY_KEY_FILE=key.pem python3 -m local.relay 0.0.0.0 8765
+
+It won't listen on anything but a loopback address without a token. Frames
+aren't signed, so without a certificate the token and commands cross the
+network in the clear; put the relay behind a TLS terminator if it isn't
+given one.
+"""
+
+DEFAULT_HEARTBEAT = 15
+MAX_BACKOFF = 30
+# Messages waiting for one listener before it is taken to have stopped reading and is dropped
+SUBSCRIBER_BACKLOG = 100
+
+relay_connections_total = registry.counter(
+    'alexa_chromecast_relay_connections_total', 'Connections to the relay, by result', ['result'])
+
+def parse_url(url):
+    """ tcp://host:port or tls://host:port, returns (host, port, use_tls) """
+    parsed = urlparse(url if '://' in url else 'tcp://' + url)
+    if parsed.scheme not in ('tcp', 'tls') or not parsed.hostname or not parsed.port:
+        raise ValueError('Relay URL should look like tcp://host:port or tls://host:port, not %s' % url)
+    return parsed.hostname, parsed.port, parsed.scheme == 'tls'
+
+def encode(frame):
+    return (json.dumps(frame) + '\n').encode('utf-8')
+
+def check_token(expected, token):
+    return not expected or hmac.compare_digest(expected.encode('utf-8'), (token or '').encode('utf-8'))
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+def server_ssl_context(cert_file, key_file=None):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+class RelayServer(socketserver.ThreadingTCPServer):
+    """
+    Passes each published message on to every connected listener.
+    Each listener is written to from its own thread, so a slow one only
+    holds up itself, and it is dropped once SUBSCRIBER_BACKLOG messages
+    are waiting for it. Connections that send nothing for idle_timeout
+    seconds are closed.
+    With ssl_context connections are TLS, for tls:// URLs.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), token=None, idle_timeout=DEFAULT_HEARTBEAT * 3, ssl_context=None):
+        if not token and not is_loopback(address[0]):
+            raise ValueError('A relay listening on %s needs a token, or anyone who can reach it can send commands' % (
+                address[0] or 'all addresses'))
+        self.token = token
+        self.ssl_context = ssl_context
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.published = 0
+        self.subscribed = threading.Condition(self.lock)
+        super().__init__(address, RelayHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return '%s://%s:%i' % ('tls' if self.ssl_context else 'tcp', host, port)
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context:
+            # The handshake is left to the connection's own thread, so a slow client can't hold up accept()
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def add(self, handler):
+        with self.lock:
+            self.subscribers.add(handler)
+            self.subscribed.notify_all()
+
+    def remove(self, handler):
+        with self.lock:
+            self.subscribers.discard(handler)
+
+    def wait_for_subscribers(self, count=1, timeout=None):
+        with self.lock:
+            return self.subscribed.wait_for(lambda: len(self.subscribers) >= count, timeout)
+
+    def publish(self, message_id, message):
+        """ Queue a message for every listener, returns the number it was queued for """
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.published += 1
+        frame = encode({'type': 'message', 'id': message_id, 'message': message})
+        delivered = 0
+        for subscriber in subscribers:
+            if subscriber.offer(frame):
+                delivered += 1
+        return delivered
+
+class RelayHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.request.settimeout(self.server.idle_timeout)
+        self.send_lock = threading.Lock()
+        self.outbox = queue.Queue(SUBSCRIBER_BACKLOG)
+
+    def offer(self, frame):
+        """ Queue a frame for the writer thread, or drop the connection if it isn't keeping up """
+        try:
+            self.outbox.put_nowait(frame)
+            return True
+        except queue.Full:
+            logger.warning('Relay listener %s:%i is not keeping up, dropping it' % self.client_address[:2])
+            self.server.remove(self)
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return False
+
+    def write_outbox(self):
+        while True:
+            frame = self.outbox.get()
+            if frame is None or not self.send(frame):
+                return
+
+    def send(self, data):
+        try:
+            with self.send_lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+            return True
+        except OSError:
+            logger.info('Dropping relay connection from %s:%i' % self.client_address[:2])
+            self.server.remove(self)
+            return False
+
+    def handle(self):
+        try:
+            if isinstance(self.request, ssl.SSLSocket):
+                self.request.do_handshake()
+            for line in self.rfile:
+                frame = json.loads(line)
+                type = frame.get('type')
+                if type == 'ping':
+                    self.send(encode({'type': 'pong'}))
+                elif type in ('subscribe', 'publish'):
+                    if not check_token(self.server.token, frame.get('token')):
+                        self.send(encode({'type': 'error', 'error': 'Invalid token'}))
+                        return
+                    if type == 'subscribe':
+                        self.send(encode({'type': 'subscribed'}))
+                        if self not in self.server.subscribers:
+                            threading.Thread(target=self.write_outbox, name='relay-writer', daemon=True).start()
+                            self.server.add(self)
+                    else:
+                        delivered = self.server.publish(frame.get('id'), frame.get('message'))
+                        self.send(encode({'type': 'published', 'id': frame.get('id'), 'delivered': delivered}))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.server.remove(self)
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                pass
+
+class RelayClient:
+    """
+    The listener's side of the relay. Connects, subscribes and passes every
+    message frame to handle(frame). A ping is sent whenever nothing has been
+    heard for `heartbeat` seconds, and the connection is dropped if the relay
+    stays quiet for two heartbeats. Reconnects back off up to MAX_BACKOFF.
+    """
+
+    def __init__(self, url, handle, token=None, heartbeat=DEFAULT_HEARTBEAT, connect_timeout=10, ssl_context=None):
+        self.host, self.port, self.tls = parse_url(url)
+        self.ssl_context = ssl_context
+        self.url = url
+        self.handle = handle
+        self.token = token
+        self.heartbeat = heartbeat
+        self.connect_timeout = connect_timeout
+        self.stopped = threading.Event()
+        self.connected = threading.Event()
+        self.sock = None
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        if self.tls:
+            context = self.ssl_context or ssl.create_default_context()
+            sock = context.wrap_socket(sock, server_hostname=self.host)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        sock.sendall(encode({'type': 'subscribe', 'token': self.token}))
+        self.buffer = b''
+        frame = self.read_frame(self.connect_timeout)
+        if not frame or frame.get('type') != 'subscribed':
+            raise ConnectionError('Relay refused subscription: %s' % (frame or {}).get('error'))
+        self.connected.set()
+        relay_connections_total.inc(result='connected')
+        logger.info('Connected to relay %s' % self.url)
+
+    def read_frame(self, timeout):
+        """ The next frame, or None if nothing arrived within timeout """
+        while b'\n' not in self.buffer:
+            self.sock.settimeout(timeout)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise ConnectionError('Relay closed the connection')
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def listen(self):
+        last_heard = time.monotonic()
+        while not self.stopped.is_set():
+            frame = self.read_frame(self.heartbeat)
+            now = time.monotonic()
+            if frame is None:
+                if now - last_heard >= self.heartbeat * 2:
+                    raise ConnectionError('No heartbeat from relay for %is' % (now - last_heard))
+                self.sock.sendall(encode({'type': 'ping'}))
+                continue
+            last_heard = now
+            if frame.get('type') == 'message':
+                try:
+                    self.handle(frame)
+                except Exception:
+                    logger.exception('Failed to handle relay message %s' % frame.get('id'))
+
+    def run(self):
+        """ Stay connected until stop() is called """
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                self.connect()
+                backoff = 1
+                self.listen()
+            except Exception as e:
+                if not self.stopped.is_set():
+                    relay_connections_total.inc(result='lost' if self.connected.is_set() else 'failed')
+                    logger.warning('Relay connection to %s failed: %s, reconnecting in %is' % (self.url, e, backoff))
+            finally:
+                self.close()
+            if self.stopped.wait(backoff):
+                break
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def close(self):
+        self.connected.clear()
+        sock, self.sock = self.sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.close()
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    host = sys.argv[1] if len(sys.argv) > 1 else '0.0.0.0'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    cert_file = os.getenv('RELAY_CERT_FILE')
+    context = server_ssl_context(cert_file, os.getenv('RELAY_KEY_FILE')) if cert_file else None
+    try:
+        server = RelayServer((host, port), os.getenv('RELAY_TOKEN'), ssl_context=context)
+    except ValueError as e:
+        logger.error('%s. Set RELAY_TOKEN, or listen on 127.0.0.1' % e)
+        sys.exit(1)
+    if not context and not is_loopback(host):
+        logger.warning('Relay is not using TLS; set RELAY_CERT_FILE or put it behind a TLS terminator')
+    logger.info('Relay listening on %s' % server.url)
+    server.serve_forever()
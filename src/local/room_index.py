@@ -0,0 +1,106 @@
+import re
+import json
+import difflib
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = {'the', 'in', 'on', 'my', 'a'}
+DEVICE_WORDS = {'tv', 'chromecast', 'speaker', 'display'}
+FUZZY_THRESHOLD = 0.8
+CACHE_SIZE = 256
+
+# Match scores, higher is better
+SCORE_EXACT = 100
+SCORE_ALIAS = 90
+SCORE_TOKENS = 70
+SCORE_SUBSTRING = 50
+SCORE_FUZZY = 40
+
+def tokenize(name):
+    # casefold and \W keep accented and non-Latin names intact, e.g. Küche
+    words = re.split(r'[\W_]+', str(name).casefold())
+    return [x for x in words if x and x not in STOP_WORDS]
+
+def load_aliases(filename):
+    """
+    Load room aliases from a JSON file mapping a Chromecast name to a list of aliases.
+    e.g. {"Living Room TV": ["lounge", "front room"]}
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+class RoomIndex:
+    """
+    Normalized index of Chromecast names, used to resolve the room names heard
+    by Alexa. Build a new index when the set of Chromecasts changes.
+    """
+
+    def __init__(self, names, aliases=None):
+        self.names = sorted(names)
+        self.keys = {}
+        self.tokens = {}
+        for name in self.names:
+            tokens = tokenize(name)
+            room_tokens = [x for x in tokens if x not in DEVICE_WORDS] or tokens
+            self.tokens[name] = set(tokens)
+            for words in [tokens, room_tokens]:
+                self.__add_key(' '.join(words), name, SCORE_EXACT)
+                self.__add_key(''.join(words), name, SCORE_EXACT)
+        for name, name_aliases in (aliases or {}).items():
+            if name not in self.tokens:
+                continue
+            for alias in name_aliases:
+                words = tokenize(alias)
+                self.__add_key(' '.join(words), name, SCORE_ALIAS)
+                self.__add_key(''.join(words), name, SCORE_ALIAS)
+        self.match = lru_cache(maxsize=CACHE_SIZE)(self.__match)
+
+    def __add_key(self, key, name, score):
+        if not key:
+            return
+        existing = self.keys.get(key)
+        # Names are added in sorted order, so ties always go to the same device
+        if not existing or existing[0] < score:
+            self.keys[key] = (score, name)
+
+    def rank(self, room):
+        """
+        All matching Chromecast names for a room, best match first.
+        Returns a list of (score, name) tuples.
+        """
+        words = tokenize(room)
+        if not words:
+            return []
+        for key in [' '.join(words), ''.join(words)]:
+            if key in self.keys:
+                return [self.keys[key]]
+
+        compact = ''.join(words)
+        query_tokens = set(words)
+        results = []
+        for name in self.names:
+            tokens = self.tokens[name]
+            name_compact = ''.join(tokenize(name))
+            if query_tokens <= tokens:
+                # Prefer the name with the fewest extra words
+                results.append((SCORE_TOKENS - len(tokens - query_tokens), name))
+            elif compact in name_compact:
+                results.append((SCORE_SUBSTRING, name))
+            else:
+                # A name made only of stop words has no keys to compare with
+                ratio = max((difflib.SequenceMatcher(None, compact, key).ratio()
+                             for key, (_score, key_name) in self.keys.items() if key_name == name), default=0)
+                if ratio >= FUZZY_THRESHOLD:
+                    results.append((SCORE_FUZZY * ratio, name))
+        results.sort(key=lambda x: (-x[0], x[1]))
+        return results
+
+    def __match(self, room):
+        results = self.rank(room)
+        if not results:
+            return None
+        if len(results) > 1:
+            logger.debug('Room %s matched %s, using %s' % (room, [x[1] for x in results], results[0][1]))
+        return results[0][1]
@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import requests
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+logger = logging.getLogger(__name__)
+
+"""
+Checks that messages posted to the listener were signed by SNS.
+https://docs.aws.amazon.com/sns/latest/dg/sns-verify-signature-of-message.html
+"""
+
+# Signing certificates are only fetched from SNS itself
+CERT_HOST_PATTERN = r'^sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?$'
+NOTIFICATION_FIELDS = ['Message', 'MessageId', 'Subject', 'Timestamp', 'TopicArn', 'Type']
+CONFIRMATION_FIELDS = ['Message', 'MessageId', 'SubscribeURL', 'Timestamp', 'Token', 'TopicArn', 'Type']
+SIGNATURE_HASHES = {'1': hashes.SHA1, '2': hashes.SHA256}
+# Seconds before a certificate URL that couldn't be fetched or loaded is tried again
+FAILURE_TTL = 60
+
+class SignatureError(Exception):
+    """ A message that wasn't signed by SNS """
+    pass
+
+def string_to_sign(message):
+    fields = NOTIFICATION_FIELDS if message.get('Type') == 'Notification' else CONFIRMATION_FIELDS
+    try:
+        # Subject is the only optional field
+        return ''.join('%s\n%s\n' % (x, message[x]) for x in fields if x != 'Subject' or x in message).encode('utf-8')
+    except KeyError as e:
+        raise SignatureError('Message is missing %s' % e)
+
+def not_valid_after(cert):
+    return getattr(cert, 'not_valid_after_utc', None) or cert.not_valid_after.replace(tzinfo=timezone.utc)
+
+def not_valid_before(cert):
+    return getattr(cert, 'not_valid_before_utc', None) or cert.not_valid_before.replace(tzinfo=timezone.utc)
+
+class CertificateStore:
+    """
+    SNS signing certificates, fetched once per SigningCertURL and kept in
+    memory and, with cache_dir, on disk. A URL is only fetched if it is an
+    https .pem URL on an SNS host, and with ca_certs the certificate must
+    also be issued by one of those CAs. A URL that fails is remembered for
+    failure_ttl seconds, so each message signed with it doesn't fetch it again.
+    """
+
+    def __init__(self, cache_dir=None, host_pattern=CERT_HOST_PATTERN, ca_certs=None, fetch=None, timeout=5,
+                 failure_ttl=FAILURE_TTL):
+        self.cache_dir = cache_dir
+        self.host_pattern = re.compile(host_pattern)
+        self.ca_certs = ca_certs or []
+        self.fetch = fetch or self.__fetch
+        self.timeout = timeout
+        self.failure_ttl = failure_ttl
+        self.lock = threading.Lock()
+        self.certs = {}
+        self.failures = {}
+        self.fetched = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __fetch(self, url):
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def __check_url(self, url):
+        parsed = urlparse(url or '')
+        if parsed.scheme != 'https' or not self.host_pattern.match(parsed.hostname or '') or not parsed.path.endswith('.pem'):
+            raise SignatureError('Untrusted SigningCertURL: %s' % url)
+
+    def __check_cert(self, cert):
+        now = datetime.now(timezone.utc)
+        if not not_valid_before(cert) <= now <= not_valid_after(cert):
+            raise SignatureError('Signing certificate has expired or is not yet valid')
+        if not self.ca_certs:
+            return
+        for ca in self.ca_certs:
+            if ca.subject != cert.issuer:
+                continue
+            try:
+                ca.public_key().verify(cert.signature, cert.tbs_certificate_bytes,
+                                       padding.PKCS1v15(), cert.signature_hash_algorithm)
+                return
+            except InvalidSignature:
+                pass
+        raise SignatureError('Signing certificate was not issued by a trusted CA')
+
+    def __cache_file(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.pem')
+
+    def __load_cached(self, url):
+        """ The certificate from the disk cache, or None if it isn't there or is no longer good """
+        if not self.cache_dir or not os.path.exists(self.__cache_file(url)):
+            return None
+        try:
+            with open(self.__cache_file(url), 'rb') as f:
+                cert = x509.load_pem_x509_certificate(f.read())
+            self.__check_cert(cert)
+            return cert
+        except (OSError, ValueError, SignatureError) as e:
+            # e.g. expired, so fetch it again rather than rejecting every message until the file is deleted
+            logger.info('Discarding cached SNS signing certificate %s: %s' % (url, e))
+            os.remove(self.__cache_file(url))
+            return None
+
+    def __load(self, url):
+        cert = self.__load_cached(url)
+        if cert:
+            return cert
+        logger.info('Fetching SNS signing certificate %s' % url)
+        pem = self.fetch(url)
+        self.fetched += 1
+        cert = x509.load_pem_x509_certificate(pem)
+        self.__check_cert(cert)
+        if self.cache_dir:
+            with open(self.__cache_file(url), 'wb') as f:
+                f.write(pem)
+        return cert
+
+    def __valid(self, url):
+        """ The certificate kept in memory for url, dropping it once it has expired """
+        cert = self.certs.get(url)
+        if cert and not_valid_after(cert) < datetime.now(timezone.utc):
+            self.certs.pop(url, None)
+            return None
+        return cert
+
+    def get(self, url):
+        cert = self.__valid(url)
+        if cert:
+            return cert
+        self.__check_url(url)
+        with self.lock:
+            cert = self.__valid(url)
+            if cert:
+                return cert
+            failure = self.failures.get(url)
+            if failure and failure[0] > time.monotonic():
+                raise SignatureError(failure[1])
+            try:
+                cert = self.__load(url)
+            except SignatureError as e:
+                self.failures[url] = (time.monotonic() + self.failure_ttl, str(e))
+                raise
+            except Exception as e:
+                # A fetch error or malformed PEM is an invalid signature like any other
+                error = 'Could not load signing certificate %s: %s' % (url, e)
+                self.failures[url] = (time.monotonic() + self.failure_ttl, error)
+                raise SignatureError(error) from e
+            self.failures.pop(url, None)
+            self.certs[url] = cert
+            return cert
+
+class SignatureVerifier:
+
+    def __init__(self, store=None):
+        self.store = store or CertificateStore()
+
+    def verify(self, message):
+        """ Raises SignatureError unless the message was signed by SNS """
+        hash_class = SIGNATURE_HASHES.get(str(message.get('SignatureVersion')))
+        if not hash_class:
+            raise SignatureError('Unsupported SignatureVersion %s' % message.get('SignatureVersion'))
+        try:
+            signature = base64.b64decode(message.get('Signature') or '')
+        except ValueError:
+            raise SignatureError('Signature is not base64')
+        cert = self.store.get(message.get('SigningCertURL'))
+        try:
+            cert.public_key().verify(signature, string_to_sign(message), padding.PKCS1v15(), hash_class())
+        except InvalidSignature:
+            raise SignatureError('Invalid signature for message %s' % message.get('MessageId'))
+
+def load_ca_certs(filename):
+    """ CA certificates from a PEM file, e.g. to trust a local test CA """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return [x509.load_pem_x509_certificate(x.group(0)) for x in
+            re.finditer(rb'-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', data, re.S)]
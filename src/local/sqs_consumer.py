@@ -0,0 +1,77 @@
+import threading
+import logging
+from local.metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+"""
+Pulls commands from an SQS queue subscribed to the SNS topic, instead of
+SNS pushing them to the listener over HTTP. Nothing has to reach the
+listener from outside, so no port forward or public IP is needed.
+"""
+
+DEFAULT_WAIT_TIME = 20
+DEFAULT_BATCH_SIZE = 10
+MAX_BACKOFF = 30
+
+class SqsConsumer:
+    """
+    Long polls the queue for up to batch_size messages at a time, passes each
+    message to handle(message) and then deletes the batch in one call.
+    A message that can't be handled is logged and deleted too, so it isn't
+    redelivered forever.
+    """
+
+    def __init__(self, queue_url, handle, sqs_client=None, batch_size=DEFAULT_BATCH_SIZE,
+                 wait_time=DEFAULT_WAIT_TIME):
+        if not sqs_client:
+            import boto3
+            sqs_client = boto3.client('sqs')
+        self.queue_url = queue_url
+        self.handle = handle
+        self.sqs_client = sqs_client
+        self.batch_size = max(1, min(10, int(batch_size)))
+        self.wait_time = max(0, min(20, int(wait_time)))
+        self.stopped = threading.Event()
+
+    def poll(self):
+        """ Receive, handle and delete one batch, returns the number of messages """
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=self.batch_size,
+            WaitTimeSeconds=self.wait_time)
+        messages = response.get('Messages') or []
+        if not messages:
+            return 0
+        with stage_seconds.time(stage='sqs_handle'):
+            for message in messages:
+                try:
+                    self.handle(message)
+                except Exception:
+                    logger.exception('Failed to handle SQS message %s' % message.get('MessageId'))
+        self.delete(messages)
+        return len(messages)
+
+    def delete(self, messages):
+        response = self.sqs_client.delete_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': x['ReceiptHandle']} for i, x in enumerate(messages)])
+        for failed in response.get('Failed') or []:
+            # The message will be received again, and dropped as a duplicate
+            logger.warning('Failed to delete SQS message %s: %s' % (
+                messages[int(failed['Id'])].get('MessageId'), failed.get('Message')))
+
+    def run(self):
+        """ Poll until stop() is called, backing off while SQS can't be reached """
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+                backoff = 1
+            except Exception:
+                logger.exception('Failed to receive from %s, retrying in %is' % (self.queue_url, backoff))
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def stop(self):
+        self.stopped.set()
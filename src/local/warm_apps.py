@@ -0,0 +1,132 @@
+import time
+import threading
+import logging
+from collections import namedtuple
+from datetime import datetime
+from pychromecast import IDLE_APP_ID
+from pychromecast.config import APP_YOUTUBE
+from local.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+"""
+Keeping the YouTube receiver ready on each Chromecast, so a play command
+doesn't pay for launching the app and starting a lounge session first.
+
+off     - Nothing is done ahead of time (default)
+session - While YouTube is running, its lounge session is refreshed every
+          interval, so playing a video only needs a bind
+idle    - As session, and YouTube is also launched on idle devices
+
+Devices playing something else are never touched, and nor is a TV that is
+in standby or showing another input, as launching an app could switch it
+over. hours limits warming to part of the day, e.g. (7, 23).
+
+Each warm-up is queued on the device's CommandQueue like a command, so it
+never runs while a command is being sent to the same Chromecast.
+"""
+WARM_OFF = 'off'
+WARM_SESSION = 'session'
+WARM_IDLE = 'idle'
+WARM_POLICIES = [WARM_OFF, WARM_SESSION, WARM_IDLE]
+DEFAULT_WARM_INTERVAL = 600
+# A session refreshed longer ago than this is started again before playing
+SESSION_MAX_AGE = 20 * 60
+LAUNCH_TIMEOUT = 20
+# Queued on the device's CommandQueue, see ChromecastWrapper
+WARM_COMMAND = 'warm_app'
+
+WarmPolicy = namedtuple('WarmPolicy', ['mode', 'interval', 'hours'])
+
+app_warmups_total = registry.counter(
+    'alexa_chromecast_app_warmups_total', 'Attempts to keep YouTube ready on a Chromecast, by result', ['result'])
+youtube_starts_total = registry.counter(
+    'alexa_chromecast_youtube_starts_total', 'Videos started on YouTube, warm if the app and session were ready', ['start'])
+youtube_start_seconds = registry.histogram(
+    'alexa_chromecast_youtube_start_seconds', 'Time to start a video on YouTube, warm or cold', ['start'])
+
+def parse_hours(text):
+    """ '7-23' as (7, 23), or None for all day """
+    if not text:
+        return None
+    start, _, end = text.partition('-')
+    hours = (int(start), int(end))
+    if not all(0 <= x <= 24 for x in hours):
+        raise ValueError('Hours should look like 7-23, not %s' % text)
+    return hours
+
+def within_hours(hours, hour):
+    if not hours:
+        return True
+    start, end = hours
+    # e.g. 18-2 runs past midnight
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+class AppWarmer:
+    """ Keeps YouTube ready on one ChromecastWrapper, following a WarmPolicy """
+
+    def __init__(self, wrapper, policy):
+        self.wrapper = wrapper
+        self.policy = policy
+        self.stopped = threading.Event()
+        self.queued = False
+
+    def start(self):
+        threading.Thread(target=self.run, name='warm-%s' % self.wrapper.name, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.policy.interval):
+            # A device that is slow to take commands only ever has one warm-up waiting
+            if not self.queued:
+                self.queued = True
+                self.wrapper.commands.submit(WARM_COMMAND, None)
+
+    def run_queued(self):
+        """ Called from the device's CommandQueue """
+        self.queued = False
+        if self.stopped.is_set():
+            return
+        try:
+            self.warm()
+        except Exception:
+            app_warmups_total.inc(result='failed')
+            logger.exception('Failed to warm YouTube on %s' % self.wrapper.name)
+
+    def warm(self, hour=None):
+        """ Launch YouTube and/or refresh its session if the policy allows, returns what was done """
+        result = self.__warm(datetime.now().hour if hour is None else hour)
+        app_warmups_total.inc(result=result)
+        logger.debug('Warming YouTube on %s: %s' % (self.wrapper.name, result))
+        return result
+
+    def __warm(self, hour):
+        if not within_hours(self.policy.hours, hour):
+            return 'outside_hours'
+        snapshot = self.wrapper.snapshot
+        if not snapshot or not snapshot.connected:
+            return 'offline'
+        if snapshot.app_id == APP_YOUTUBE:
+            self.wrapper.youtube_controller.refresh_session()
+            return 'refreshed'
+        if snapshot.app_id not in (None, IDLE_APP_ID):
+            return 'busy'
+        status = self.wrapper.cast.status
+        if getattr(status, 'is_stand_by', None) or getattr(status, 'is_active_input', None) is False:
+            return 'busy'
+        if self.policy.mode != WARM_IDLE:
+            return 'idle'
+        self.wrapper.cast.start_app(APP_YOUTUBE)
+        deadline = time.monotonic() + LAUNCH_TIMEOUT
+        while (self.wrapper.snapshot.app_id != APP_YOUTUBE and time.monotonic() < deadline
+               and not self.stopped.wait(0.2)):
+            pass
+        # Checked again, as something else may have been cast while YouTube was starting
+        snapshot = self.wrapper.snapshot
+        if not snapshot.connected or snapshot.app_id != APP_YOUTUBE:
+            return 'launch_failed'
+        self.wrapper.youtube_controller.refresh_session()
+        return 'launched'
@@ -1,29 +1,44 @@
+import os
+import copy
 import time
 from youtube_search import YoutubeSearch
+from local.cache import ResultCache, SqliteStore, normalize_key
+from local.metrics import stage_seconds, cache_gauge
+from shared.lookups import split_video_id, playable_results
+
+CACHE_TTL = int(os.getenv('YOUTUBE_CACHE_TTL', 6 * 60 * 60))
+CACHE_MAX_AGE = int(os.getenv('YOUTUBE_CACHE_MAX_AGE', 7 * 24 * 60 * 60))
+CACHE_SIZE = int(os.getenv('YOUTUBE_CACHE_SIZE', 256))
+CACHE_FILE = os.getenv('YOUTUBE_CACHE_FILE')
+CACHE_FILE_SIZE = int(os.getenv('YOUTUBE_CACHE_FILE_SIZE', 10000))
+
+cache = ResultCache('youtube', CACHE_TTL, CACHE_MAX_AGE, CACHE_SIZE,
+                    SqliteStore(CACHE_FILE, 'youtube_search', CACHE_MAX_AGE, CACHE_FILE_SIZE) if CACHE_FILE else None)
+cache_gauge('youtube', cache)
+
+def cache_stats():
+    return cache.stats()
 
 def search(video_title):
+    # Empty results aren't cached, so a failed search is retried next time
+    with stage_seconds.time(stage='youtube_search'):
+        results = cache.get_or_load(normalize_key(video_title), lambda: search_youtube(video_title))
+    return copy.deepcopy(results)
+
+def search_youtube(video_title):
     attempts = 4
     results = []
-    is_playlist = 'playlist' in video_title
 
     for _attempt in range(attempts):
         #Not found - sometimes we get an empty list - so try again
-        results = YoutubeSearch(video_title, max_results=20)
-        if len(results.videos) > 0:
-            results = results.videos
+        found = YoutubeSearch(video_title, max_results=20)
+        if len(found.videos) > 0:
+            results = found.videos
             break
         time.sleep(2)
 
     for video in results:
-        if '&list' in video['id']:
-            vals = video['id'].split('&')
-            video['id'] = vals[0]
-            video['playlist_id'] = vals[1].replace('list=', '')
-        else:
-            video['playlist_id'] = None
-
-    #Ok if the search was a playlist, or the the first result was a playlist just return this
-    if is_playlist or (len(results) > 0 and results[0]['playlist_id']):
-        results = next(([x] for x in results if x['playlist_id']), [])
-
-    return results
+        video['id'], video['playlist_id'] = split_video_id(video['id'])
+
+    # The same rule the Lambda function uses when it searches, see RESOLVE_IN_CLOUD
+    return playable_results(video_title, results)
@@ -0,0 +1,74 @@
+import threading
+import logging
+from local.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+queue_navigation_total = registry.counter(
+    'alexa_chromecast_queue_navigation_total',
+    'Moves to another video in a YouTube queue: direct when the local queue was in sync, '
+    'resynced when it had to be read from the device first, missing when there was no such video', ['result'])
+
+class QueueModel:
+    """
+    What we know of a device's YouTube queue: the videos on it in order, the
+    position of the one playing and, once looked up, the queue's list id.
+    The position follows the media status the device pushes, so moving to
+    another video is a single request to the device. The model is out of sync
+    when the device plays something it doesn't know about, e.g. when the
+    queue was changed from a phone, and has to be read from the device again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.video_ids = []
+        self.position = None
+        self.list_id = None
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def reset(self, video_ids=(), position=0, list_id=None):
+        with self.lock:
+            self.video_ids = list(video_ids)
+            self.position = position if self.video_ids else None
+            self.list_id = list_id
+
+    def extend(self, video_ids):
+        with self.lock:
+            self.video_ids.extend(video_ids)
+
+    @property
+    def in_sync(self):
+        return self.position is not None
+
+    def current(self):
+        with self.lock:
+            return self.video_ids[self.position] if self.position is not None else None
+
+    def sync(self, content_id):
+        """
+        Move the position to the video playing, returns False if it isn't in
+        the queue. A video can be queued more than once, so the nearest one
+        after the current position wins.
+        """
+        if not content_id:
+            return self.in_sync
+        with self.lock:
+            if self.position is not None and self.video_ids[self.position] == content_id:
+                return True
+            start = self.position or 0
+            order = list(range(start, len(self.video_ids))) + list(range(start - 1, -1, -1))
+            self.position = next((i for i in order if self.video_ids[i] == content_id), None)
+            if self.position is None and self.video_ids:
+                logger.debug('%s is not in the local queue of %i videos' % (content_id, len(self.video_ids)))
+            return self.position is not None
+
+    def target(self, offset=0, index=None):
+        """ The index offset places from the current position, or index itself, if that is in the queue """
+        with self.lock:
+            if index is None:
+                if self.position is None:
+                    return None
+                index = self.position + offset
+            return index if 0 <= index < len(self.video_ids) else None
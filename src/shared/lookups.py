@@ -0,0 +1,40 @@
+"""
+Lookups made both by the Lambda function, when it resolves ids ahead of the
+listener, and by the local listener. The two are deployed separately, so
+this package is copied into the Lambda bundle and the listener's image.
+"""
+
+MOVIEDB_API_URI = "https://api.themoviedb.org/3"
+MOVIEDB_LANGUAGE = 'en-GB'
+
+def moviedb_movie(get, title):
+    """
+    {'id': ..., 'title': ...} for the first movie matching title, or None.
+    get(path, **params) makes the API request and returns the decoded JSON.
+    """
+    results = get('/search/movie', query=title, page=1, include_adult='false').get('results') or []
+    return {'id': results[0]['id'], 'title': results[0]['title']} if results else None
+
+def moviedb_trailer_key(get, movie_id):
+    """ The YouTube key of the movie's trailer, or of its first YouTube video, or None """
+    # Just the videos, where append_to_response=videos on /movie/{id} returns the whole movie record too
+    videos = get('/movie/{}/videos'.format(movie_id)).get('results') or []
+    youtube_videos = [x for x in videos if x.get('site', 'YouTube') == 'YouTube']
+    trailer = next((x for x in youtube_videos if x.get('type') == 'Trailer'), youtube_videos[0] if youtube_videos else None)
+    return trailer['key'] if trailer else None
+
+def split_video_id(video_id):
+    """ A YouTube search result id such as 'abc&list=PL1' as ('abc', 'PL1'), or ('abc', None) """
+    video_id, _, playlist = video_id.partition('&list=')
+    return video_id, playlist.split('&')[0] or None
+
+def playable_results(title, results):
+    """
+    The search results, with playlist_id set, that should be played. If the
+    title asks for a playlist, or the first result is one, the first
+    playlist is played on its own. Titles are compared ignoring case, as
+    the search cache keys are.
+    """
+    if 'playlist' in title.casefold() or (results and results[0]['playlist_id']):
+        return next(([x] for x in results if x['playlist_id']), [])
+    return results
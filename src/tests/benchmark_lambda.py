@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+Cold start benchmark for the Lambda function.
+
+Each run starts a fresh Python process, the same way Lambda starts a new
+container, and times importing lambda_function.main (the init phase), the
+first invocation and a number of warm invocations. S3 and SNS are stubbed
+with botocore's Stubber, so only the skill's own work is measured.
+
+e.g. (from src)
+python -m tests.benchmark_lambda --runs 10 --output lambda.json
+python -m tests.benchmark_lambda --runs 10 --compare lambda.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+
+SRC_DIR = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+COMPARED = ['p50', 'p95', 'p99']
+
+ENVIRONMENT = {
+    'AWS_SNS_ARN': 'arn:aws:sns:eu-west-1:123456789012:Alexa-Chromecast',
+    'AWS_S3_BUCKET': 'alexa-chromecast-benchmark',
+    'AWS_DEFAULT_REGION': 'eu-west-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+}
+
+def alexa_request(intent, device_id, slots=None):
+    """ A minimal Alexa IntentRequest envelope """
+    return {
+        'version': '1.0',
+        'session': {
+            'new': True,
+            'sessionId': 'amzn1.echo-api.session.benchmark',
+            'application': {'applicationId': 'amzn1.ask.skill.benchmark'},
+            'user': {'userId': 'amzn1.ask.account.benchmark'}
+        },
+        'context': {
+            'System': {
+                'application': {'applicationId': 'amzn1.ask.skill.benchmark'},
+                'user': {'userId': 'amzn1.ask.account.benchmark'},
+                'device': {'deviceId': device_id, 'supportedInterfaces': {}},
+                'apiEndpoint': 'https://api.eu.amazonalexa.com'
+            }
+        },
+        'request': {
+            'type': 'IntentRequest',
+            'requestId': 'amzn1.echo-api.request.benchmark',
+            'timestamp': '2020-01-01T00:00:00Z',
+            'locale': 'en-GB',
+            'intent': {'name': intent, 'confirmationStatus': 'NONE', 'slots': slots or {}}
+        }
+    }
+
+def child(invocations, publish_latency):
+    """ Runs in the fresh process, prints timings in milliseconds as JSON """
+    for key, value in ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    started = time.perf_counter()
+    import lambda_function.main as main
+    imported = time.perf_counter()
+
+    from botocore.stub import Stubber
+    from botocore.response import StreamingBody
+    import lambda_function.utils as utils
+    device_id = 'amzn1.ask.device.benchmark'
+    attributes = json.dumps({'DEVICE_' + device_id: 'Media Room'}).encode('utf-8')
+    s3 = Stubber(utils.get_client('s3'))
+    sns_client = main.get_sns_client()
+    if publish_latency:
+        # Runs before the stubbed response is returned, standing in for the round trip to SNS
+        sns_client.meta.events.register('before-parameter-build.sns.Publish', lambda **kwargs: time.sleep(publish_latency))
+    sns = Stubber(sns_client)
+    for i in range(invocations):
+        s3.add_response('get_object', {'Body': StreamingBody(io.BytesIO(attributes), len(attributes))})
+        sns.add_response('publish', {'MessageId': 'benchmark-%i' % i, 'ResponseMetadata': {'HTTPStatusCode': 200}})
+    s3.activate()
+    sns.activate()
+
+    event = alexa_request('PauseIntent', device_id)
+    invokes = []
+    for i in range(invocations):
+        invoke_started = time.perf_counter()
+        response = main.lambda_handler(event, None)
+        invokes.append((time.perf_counter() - invoke_started) * 1000)
+        if 'error' in json.dumps(response).lower():
+            raise RuntimeError('Unexpected response: %s' % response)
+    print(json.dumps({
+        'init_ms': (imported - started) * 1000,
+        'first_invoke_ms': invokes[0],
+        'warm_invoke_ms': invokes[1:]
+    }))
+
+def run_once(args):
+    environment = dict(os.environ, PUBLISH_MODE=args.publish_mode)
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'tests.benchmark_lambda', '--child', '--invocations', str(max(args.invocations, 1)),
+         '--publish-latency', str(args.publish_latency)],
+        cwd=SRC_DIR, env=environment)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def compare(result, baseline):
+    changes = {}
+    for key in ['init_ms', 'first_invoke_ms', 'warm_invoke_ms']:
+        for stat in COMPARED:
+            old = baseline.get(key, {}).get(stat)
+            new = result.get(key, {}).get(stat)
+            if old and new is not None:
+                changes['%s.%s' % (key, stat)] = {'baseline': old, 'current': new, 'change_pct': (new - old) / old * 100}
+    return changes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Lambda init and invocation latency')
+    parser.add_argument('--runs', type=int, default=10, help='Number of cold starts')
+    parser.add_argument('--invocations', type=int, default=20, help='Invocations per cold start')
+    parser.add_argument('--publish-mode', choices=['sync', 'async'], default='async', help='PUBLISH_MODE for the Lambda')
+    parser.add_argument('--publish-latency', type=float, default=0, help='Seconds added to each SNS publish')
+    parser.add_argument('--output', help='Write the JSON result to this file')
+    parser.add_argument('--compare', help='Compare against an earlier JSON result')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(max(args.invocations, 1), args.publish_latency)
+
+    # Only loaded here, so it isn't part of the timed cold start
+    from tests.benchmark_local import summarize
+    runs = [run_once(args) for _ in range(args.runs)]
+
+    def ms(values):
+        # summarize takes seconds
+        return summarize([x / 1000 for x in values])
+
+    result = {
+        'config': {
+            'runs': args.runs,
+            'invocations': args.invocations,
+            'publish_mode': args.publish_mode,
+            'publish_latency': args.publish_latency,
+            'python': sys.version.split()[0]
+        },
+        'init_ms': ms([x['init_ms'] for x in runs]),
+        'first_invoke_ms': ms([x['first_invoke_ms'] for x in runs]),
+        'warm_invoke_ms': ms([y for x in runs for y in x['warm_invoke_ms']]),
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            result['comparison'] = compare(result, json.load(f))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end latency benchmark for the local listener.
+
+Runs Subscriber and Skill in-process against fake Chromecasts and a local
+SNS stand-in, replays a mix of commands at a fixed rate across the devices
+and prints the results as JSON. Runs can be compared with --compare.
+
+e.g. (from src)
+python -m tests.benchmark_local --devices 4 --rate 20 --duration 10 --server-mode threaded --output threaded.json
+python -m tests.benchmark_local --devices 4 --rate 20 --duration 10 --compare threaded.json
+python -m tests.benchmark_local --devices 4 --rate 20 --duration 10 --transport relay --compare threaded.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import resource
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+
+import pychromecast
+from local.SkillSubscriber import Subscriber, SERVER_MODES, SERVER_MODE_SIMPLE, TRANSPORT_HTTP, TRANSPORT_RELAY
+from local.relay import RelayServer
+from lambda_function.relay import RelayPublisher
+from local.ChromecastSkill import Skill
+from local.moviedb_search import MovieDbClient
+from tests.fake_chromecast import FakeChromecast, FakeYouTubeController
+from local.sns_verify import SignatureVerifier, CertificateStore
+from tests.fake_sns import FakeSnsClient, LocalCertificateAuthority
+
+DEFAULT_MIX = 'play=2,pause=2,set_volume=3,play_video=1,play_trailer=1'
+COMPARED = ['p50', 'p95', 'p99']
+
+def parse_mix(text):
+    mix = []
+    for item in text.split(','):
+        command, weight = item.split('=')
+        mix.append((command.strip(), float(weight)))
+    return mix
+
+def command_data(command, i):
+    if command == 'set_volume':
+        return {'volume': i % 11}
+    if command == 'play_video':
+        return {'title': 'songs by artist %i' % (i % 10), 'app': 'youtube'}
+    if command == 'play_trailer':
+        return {'title': 'movie %i' % (i % 10)}
+    return {}
+
+def summarize(values):
+    """ Latency summary in milliseconds """
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def percentile(p):
+        return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)] * 1000
+
+    return {
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'mean': sum(values) / len(values) * 1000,
+        'max': values[-1] * 1000
+    }
+
+class BenchmarkSkill(Skill):
+
+    def __init__(self, completed, *args, **kwargs):
+        self.completed = completed
+        super().__init__(*args, **kwargs)
+
+    def run_command(self, func, data, name):
+        super().run_command(func, data, name)
+        self.completed(data.get('bench_id'))
+
+class Benchmark:
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.published = {}
+        self.latencies = []
+        self.ack_latencies = []
+        self.last_completed = None
+        self.devices = [FakeChromecast('Room %i TV' % i, latency=args.device_latency) for i in range(args.devices)]
+
+    def completed(self, bench_id):
+        now = time.perf_counter()
+        with self.lock:
+            published = self.published.get(bench_id)
+            if published is not None:
+                self.latencies.append(now - published)
+                self.last_completed = now
+
+    def publish(self, publish, bench_id, message):
+        started = time.perf_counter()
+        with self.lock:
+            self.published[bench_id] = started
+        publish(message)
+        with self.lock:
+            self.ack_latencies.append(time.perf_counter() - started)
+
+    def __busy(self, skill):
+        for device in self.devices:
+            commands = skill.get_chromecast(device.name).commands
+            if commands.pending or commands.sent + commands.coalesced < commands.submitted:
+                return True
+        return False
+
+    def fake_youtube_search(self, video_title):
+        time.sleep(self.args.search_latency)
+        return [{'id': 'video%i' % i, 'playlist_id': None} for i in range(5)]
+
+    def fake_movie_search(self, movie):
+        time.sleep(self.args.search_latency / 2)
+        return {'id': abs(hash(movie)), 'title': movie}
+
+    def fake_trailer(self, moviedb_id):
+        time.sleep(self.args.search_latency / 2)
+        return 'trailer%i' % moviedb_id
+
+    def patches(self):
+        hosts = {x.uuid: x for x in self.devices}
+        return [
+            patch.object(pychromecast, 'discover_chromecasts', return_value=[x.host_tuple for x in self.devices]),
+            patch.object(pychromecast, 'get_chromecast_from_host', side_effect=lambda host, *a, **k: hosts[host[2]]),
+            patch('local.ChromecastSkill.MyYouTubeController', FakeYouTubeController),
+            patch('local.youtube.search_youtube', side_effect=self.fake_youtube_search),
+            patch.object(MovieDbClient, '_MovieDbClient__search_movie', side_effect=self.fake_movie_search, autospec=False),
+            patch.object(MovieDbClient, '_MovieDbClient__get_trailer_key', side_effect=self.fake_trailer, autospec=False),
+            patch('local.moviedb_search.MOVIEDB_API_KEY', 'benchmark'),
+        ]
+
+    def run(self):
+        args = self.args
+        patches = self.patches()
+        for p in patches:
+            p.start()
+        if args.trace_memory:
+            tracemalloc.start()
+        try:
+            return self.__run()
+        finally:
+            for p in reversed(patches):
+                p.stop()
+
+    def __run(self):
+        args = self.args
+        verifier = None
+        signer = None
+        if args.verify:
+            signer = LocalCertificateAuthority()
+            verifier = SignatureVerifier(CertificateStore(fetch=signer.fetch, ca_certs=[signer.ca_cert]))
+        sns = FakeSnsClient(signer=signer)
+        skill = BenchmarkSkill(self.completed, {} if args.no_coalesce else None)
+        if args.transport == TRANSPORT_RELAY:
+            relay = RelayServer()
+            threading.Thread(target=relay.serve_forever, daemon=True).start()
+            subscriber = Subscriber({'chromecast': skill}, None, None, server_mode=args.server_mode,
+                                    workers=args.workers, sns_client=sns, serve=False,
+                                    transport=TRANSPORT_RELAY, relay_url=relay.url)
+            threading.Thread(target=subscriber.consumer.run, daemon=True).start()
+            relay.wait_for_subscribers(1, 10)
+            # One connection, as a warm Lambda container would keep
+            publish = RelayPublisher(relay.url).publish
+        else:
+            subscriber = Subscriber({'chromecast': skill}, '127.0.0.1', '0', topic_arn=sns.topic_arn,
+                                    server_mode=args.server_mode, workers=args.workers, sns_client=sns, serve=False,
+                                    verifier=verifier)
+            threading.Thread(target=subscriber.server.serve_forever, daemon=True).start()
+            sns.confirmed.wait(10)
+            publish = sns.publish_message
+
+        mix = parse_mix(args.mix)
+        commands = [x[0] for x in mix]
+        weights = [x[1] for x in mix]
+        total = int(args.rate * args.duration)
+        publishers = ThreadPoolExecutor(max_workers=args.publishers)
+
+        started = time.perf_counter()
+        for i in range(total):
+            # Open loop: commands are sent on schedule whether or not earlier ones finished
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            command = self.random.choices(commands, weights)[0]
+            data = command_data(command, i)
+            data['bench_id'] = i
+            message = {
+                'handler_name': 'chromecast',
+                'room': self.random.choice(self.devices).name.replace(' TV', ''),
+                'command': command.replace('_', '-'),
+                'data': data
+            }
+            publishers.submit(self.publish, publish, i, message)
+        publishers.shutdown(wait=True)
+        sent_duration = time.perf_counter() - started
+
+        # Wait for queued commands, stopping early once nothing is left running
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if len(self.latencies) >= total:
+                    break
+                idle = time.perf_counter() - (self.last_completed or started)
+            if idle > args.idle_timeout and not self.__busy(skill):
+                break
+            time.sleep(0.05)
+        elapsed = (self.last_completed or time.perf_counter()) - started
+
+        if subscriber.consumer:
+            subscriber.consumer.stop()
+            relay.shutdown()
+            relay.server_close()
+        else:
+            subscriber.server.shutdown()
+        if subscriber.dispatcher:
+            subscriber.dispatcher.shutdown(wait=False)
+        skill.chromecast_controller.stop()
+
+        memory = {'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if args.trace_memory:
+            memory['traced_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+        with self.lock:
+            latencies = list(self.latencies)
+            ack_latencies = list(self.ack_latencies)
+        return {
+            'config': {
+                'devices': args.devices,
+                'rate': args.rate,
+                'duration': args.duration,
+                'mix': args.mix,
+                'server_mode': args.server_mode,
+                'transport': args.transport,
+                'workers': args.workers,
+                'coalesce': not args.no_coalesce,
+                'verify': args.verify,
+                'device_latency': args.device_latency,
+                'search_latency': args.search_latency,
+                'seed': args.seed
+            },
+            'sent': total,
+            'completed': len(latencies),
+            # Coalesced commands never reach the device, so don't complete
+            'not_completed': total - len(latencies),
+            'send_seconds': sent_duration,
+            'elapsed_seconds': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed else 0,
+            'dispatch_latency_ms': summarize(latencies),
+            'sns_ack_latency_ms': summarize(ack_latencies),
+            'device_calls': sum(len(x.calls) for x in self.devices),
+            'memory': memory
+        }
+
+def compare(result, baseline):
+    changes = {}
+    for key in ['dispatch_latency_ms', 'sns_ack_latency_ms']:
+        for stat in COMPARED:
+            old = baseline.get(key, {}).get(stat)
+            new = result.get(key, {}).get(stat)
+            if old and new is not None:
+                changes['%s.%s' % (key, stat)] = {'baseline': old, 'current': new, 'change_pct': (new - old) / old * 100}
+    if baseline.get('throughput'):
+        changes['throughput'] = {
+            'baseline': baseline['throughput'],
+            'current': result['throughput'],
+            'change_pct': (result['throughput'] - baseline['throughput']) / baseline['throughput'] * 100
+        }
+    return changes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the local listener against fake Chromecasts')
+    parser.add_argument('--devices', type=int, default=4, help='Number of fake Chromecasts')
+    parser.add_argument('--rate', type=float, default=10, help='Commands per second')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to send commands for')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Command weights, e.g. %s' % DEFAULT_MIX)
+    parser.add_argument('--server-mode', choices=SERVER_MODES, default=SERVER_MODE_SIMPLE)
+    parser.add_argument('--transport', choices=[TRANSPORT_HTTP, TRANSPORT_RELAY], default=TRANSPORT_HTTP,
+                        help='Deliver commands by SNS HTTP push or over a local relay')
+    parser.add_argument('--workers', type=int, default=4, help='Dispatch workers in threaded mode')
+    parser.add_argument('--publishers', type=int, default=16, help='Concurrent SNS deliveries')
+    parser.add_argument('--verify', action='store_true', help='Sign messages and check their signatures')
+    parser.add_argument('--no-coalesce', action='store_true', help='Disable command coalescing')
+    parser.add_argument('--device-latency', type=float, default=0.02, help='Seconds per fake device call')
+    parser.add_argument('--search-latency', type=float, default=0.5, help='Seconds per fake YouTube/MovieDb search')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='Seconds to wait for queued commands')
+    parser.add_argument('--idle-timeout', type=float, default=2, help='Stop waiting once idle for this many seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-memory', action='store_true', help='Report the peak traced Python allocation')
+    parser.add_argument('--output', help='Write the JSON result to this file')
+    parser.add_argument('--compare', help='Compare against an earlier JSON result')
+    args = parser.parse_args(argv)
+
+    # No module sets a level of its own, so this quietens everything
+    logging.basicConfig(level=logging.WARNING)
+
+    result = Benchmark(args).run()
+    if args.compare:
+        with open(args.compare) as f:
+            result['comparison'] = compare(result, json.load(f))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return result
+
+if __name__ == "__main__":
+    main()
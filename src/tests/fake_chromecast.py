@@ -0,0 +1,243 @@
+import time
+import unittest
+import threading
+import uuid as uuid_lib
+from mock import patch
+import pychromecast
+from local.youtube_queue import QueueModel
+from pychromecast.dial import DeviceStatus
+from pychromecast.controllers.media import MediaStatus
+from pychromecast.socket_client import (CastStatus, ConnectionStatus, NetworkAddress,
+                                        CONNECTION_STATUS_CONNECTED, CONNECTION_STATUS_LOST)
+
+"""
+In-process stand-ins for pychromecast devices, so the local skill can be
+exercised without Chromecasts on the network.
+"""
+
+class FakeMediaController:
+
+    def __init__(self, cast):
+        self.cast = cast
+        self.status = MediaStatus()
+        self.listeners = []
+
+    def register_status_listener(self, listener):
+        self.listeners.append(listener)
+
+    def play(self):
+        self.cast.record('play')
+
+    def pause(self):
+        self.cast.record('pause')
+
+    def skip(self):
+        self.cast.record('skip')
+
+    def push_status(self, content_id, player_state='PLAYING'):
+        self.status = MediaStatus()
+        self.status.content_id = content_id
+        self.status.player_state = player_state
+        for listener in self.listeners:
+            listener.new_media_status(self.status)
+
+class FakeSocketClient:
+
+    def __init__(self):
+        self.connection_listeners = []
+
+    def register_connection_listener(self, listener):
+        self.connection_listeners.append(listener)
+
+class FakeChromecast:
+
+    def __init__(self, friendly_name, latency=0, host='127.0.0.1', port=8009):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.device = DeviceStatus(
+            friendly_name=friendly_name,
+            model_name='Chromecast',
+            manufacturer='Google Inc.',
+            uuid=uuid_lib.uuid4(),
+            cast_type='cast')
+        self.ready = threading.Event()
+        self.ready.set()
+        self.calls = []
+        self.handlers = []
+        self.listeners = []
+        self.disconnected = False
+        self.status_pushed = False
+        self.cast_status = None
+        self.lock = threading.Lock()
+        self.media_controller = FakeMediaController(self)
+        self.socket_client = FakeSocketClient()
+
+    @property
+    def uuid(self):
+        return self.device.uuid
+
+    @property
+    def name(self):
+        return self.device.friendly_name
+
+    @property
+    def host_tuple(self):
+        return (self.host, self.port, self.uuid, self.device.model_name, self.device.friendly_name)
+
+    @property
+    def status(self):
+        return (self.cast_status or object()) if self.ready.is_set() else None
+
+    def record(self, call, *args):
+        # Simulate the device round-trip
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((call,) + args)
+
+    def wait(self, timeout=None):
+        # Like a real device, the first status arrives once connected
+        if self.ready.wait(timeout) and not self.status_pushed:
+            self.push_status()
+
+    def set_ready(self, ready):
+        """ Connect or lose the connection, telling the connection listeners """
+        if ready:
+            self.ready.set()
+        else:
+            self.ready.clear()
+        status = ConnectionStatus(CONNECTION_STATUS_CONNECTED if ready else CONNECTION_STATUS_LOST,
+                                  NetworkAddress(self.host, self.port))
+        for listener in self.socket_client.connection_listeners:
+            listener.new_connection_status(status)
+
+    def push_status(self, app_id=None, display_name=None, volume_level=1.0, volume_muted=False,
+                    is_active_input=True, is_stand_by=False):
+        self.status_pushed = True
+        self.cast_status = CastStatus(is_active_input, is_stand_by, volume_level, volume_muted, app_id, display_name,
+                                      [], None, None, None, None)
+        for listener in self.listeners:
+            listener.new_cast_status(self.cast_status)
+
+    def register_handler(self, handler):
+        self.handlers.append(handler)
+        if isinstance(handler, FakeYouTubeController):
+            handler.registered(self)
+
+    def register_status_listener(self, listener):
+        self.listeners.append(listener)
+
+    def set_volume(self, volume):
+        self.record('set_volume', volume)
+
+    def start_app(self, app_id):
+        self.record('start_app', app_id)
+        self.push_status(app_id)
+
+    def quit_app(self):
+        self.record('quit_app')
+
+    def reboot(self):
+        self.record('reboot')
+
+    def disconnect(self, timeout=None, blocking=True):
+        self.disconnected = True
+
+class FakeYouTubeController:
+    """ Replaces MyYouTubeController, recording calls on the device it is registered with """
+
+    def __init__(self):
+        self.cast = None
+        self.session_lock = threading.RLock()
+        self.fail_batches = 0
+        self.queue = QueueModel()
+        # Whether YouTube is running with a lounge session, see MyYouTubeController.session_ready
+        self.warm = False
+
+    def registered(self, cast):
+        self.cast = cast
+
+    def session_ready(self):
+        return self.warm
+
+    def refresh_session(self):
+        self.cast.record('youtube.refresh_session')
+        self.warm = True
+
+    def clear_playlist(self):
+        self.cast.record('youtube.clear_playlist')
+        self.queue.reset()
+
+    def play_video(self, video_id, playlist_id=None):
+        self.cast.record('youtube.play_video', video_id)
+        self.queue.reset([video_id], list_id=playlist_id)
+
+    def add_to_queue(self, video_id):
+        self.cast.record('youtube.add_to_queue', video_id)
+
+    def add_videos_to_queue(self, video_ids):
+        if self.fail_batches:
+            self.fail_batches -= 1
+            raise IOError('Lounge request failed')
+        self.cast.record('youtube.add_videos_to_queue', list(video_ids))
+        self.queue.extend(video_ids)
+
+    def play_from_queue(self, current_id, offset=0, index=None):
+        self.cast.record('youtube.play_from_queue', current_id, offset, index)
+        return True
+
+class FakeDevices:
+    """ The Chromecasts discovery finds, patched in for pychromecast's discovery and connect calls """
+
+    def __init__(self, *names):
+        self.casts = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        cc = FakeChromecast(name)
+        self.casts[cc.uuid] = cc
+        return cc
+
+    def hosts(self):
+        return [x.host_tuple for x in self.casts.values()]
+
+    def from_host(self, host, *args, **kwargs):
+        return self.casts[host[2]]
+
+    def from_service(self, services, *args, **kwargs):
+        return self.casts[services[2]]
+
+def wait_for_calls(cc, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not cc.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cc.calls
+
+class FakeSkillTestCase(unittest.TestCase):
+    """ Runs a Skill against FakeDevices called device_names, with a FakeYouTubeController for each """
+
+    device_names = ['Living Room TV']
+
+    def setUp(self):
+        self.devices = FakeDevices(*self.device_names)
+        self.start_patches(
+            patch.object(pychromecast, 'discover_chromecasts', side_effect=self.devices.hosts),
+            patch.object(pychromecast, 'get_chromecast_from_host', side_effect=self.devices.from_host),
+            patch('local.ChromecastSkill.MyYouTubeController', FakeYouTubeController))
+
+    def start_patches(self, *patches):
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def start_skill(self, **kwargs):
+        from local.ChromecastSkill import Skill
+        skill = Skill(**kwargs)
+        self.addCleanup(skill.chromecast_controller.stop)
+        return skill
+
+    def cast(self, name=None):
+        """ The fake device called name, or the first one """
+        return next(x for x in self.devices.casts.values() if name in (None, x.name))
@@ -0,0 +1,125 @@
+import json
+import uuid
+import base64
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+
+"""
+Local stand-in for the boto3 SNS client. Messages are pushed to subscribed
+HTTP endpoints the same way SNS delivers them.
+"""
+
+class LocalCertificateAuthority:
+    """ A throwaway CA and SNS signing certificate, so signatures can be checked offline """
+
+    CERT_URL = 'https://sns.eu-west-1.amazonaws.com/SimpleNotificationService-local.pem'
+
+    def __init__(self):
+        self.ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.ca_cert = self.__certificate('Local Test CA', self.ca_key.public_key(), self.ca_key, None, ca=True)
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.cert = self.__certificate('sns.amazonaws.com', self.key.public_key(), self.ca_key, self.ca_cert)
+        self.cert_pem = self.cert.public_bytes(serialization.Encoding.PEM)
+        # The same key, in a certificate that expired yesterday
+        self.expired_cert = self.__certificate('sns.amazonaws.com', self.key.public_key(), self.ca_key, self.ca_cert,
+                                               valid_days=-1)
+        self.fetches = 0
+
+    @staticmethod
+    def __certificate(common_name, public_key, signing_key, issuer, ca=False, valid_days=1):
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.utcnow()
+        return (x509.CertificateBuilder()
+                .subject_name(subject)
+                .issuer_name(issuer.subject if issuer else subject)
+                .public_key(public_key)
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - timedelta(days=2))
+                .not_valid_after(now + timedelta(days=valid_days))
+                .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+                .sign(signing_key, hashes.SHA256()))
+
+    def fetch(self, url):
+        self.fetches += 1
+        return self.cert_pem
+
+    def sign(self, message, version='1', key=None):
+        """ Add SNS signature fields to a message """
+        from local.sns_verify import string_to_sign
+        message['SignatureVersion'] = version
+        message['SigningCertURL'] = self.CERT_URL
+        hash_class = hashes.SHA1 if version == '1' else hashes.SHA256
+        signature = (key or self.key).sign(string_to_sign(message), padding.PKCS1v15(), hash_class())
+        message['Signature'] = base64.b64encode(signature).decode('ascii')
+        return message
+
+class FakeSnsClient:
+
+    def __init__(self, topic_arn='arn:aws:sns:eu-west-1:123456789012:Alexa-Chromecast', signer=None):
+        self.topic_arn = topic_arn
+        # A LocalCertificateAuthority to sign messages with
+        self.signer = signer
+        self.endpoints = []
+        self.confirmed = threading.Event()
+
+    def subscribe(self, TopicArn, Protocol, Endpoint):
+        self.endpoints.append(Endpoint)
+        token = uuid.uuid4().hex
+        # SNS confirms asynchronously, after subscribe has returned
+        threading.Thread(target=self.post, args=(Endpoint, self.__sign({
+            'Type': 'SubscriptionConfirmation',
+            'MessageId': str(uuid.uuid4()),
+            'Token': token,
+            'TopicArn': TopicArn,
+            'Message': 'You have chosen to subscribe to the topic %s.' % TopicArn,
+            'SubscribeURL': 'https://sns.eu-west-1.amazonaws.com/?Action=ConfirmSubscription&Token=%s' % token,
+            'Timestamp': datetime.utcnow().isoformat() + 'Z'
+        })), daemon=True).start()
+        return {'SubscriptionArn': 'pending confirmation'}
+
+    def confirm_subscription(self, TopicArn, Token, AuthenticateOnUnsubscribe):
+        self.confirmed.set()
+        return {'SubscriptionArn': '%s:%s' % (TopicArn, uuid.uuid4())}
+
+    def list_subscriptions_by_topic(self, TopicArn):
+        return {'Subscriptions': [{
+            'TopicArn': TopicArn,
+            'Endpoint': x,
+            'SubscriptionArn': '%s:%s' % (TopicArn, i)} for i, x in enumerate(self.endpoints)]}
+
+    def unsubscribe(self, SubscriptionArn):
+        pass
+
+    def __sign(self, body):
+        return self.signer.sign(body) if self.signer else body
+
+    def notification(self, message):
+        return self.__sign({
+            'Type': 'Notification',
+            'MessageId': str(uuid.uuid4()),
+            'TopicArn': self.topic_arn,
+            'Message': json.dumps(message),
+            'Timestamp': datetime.utcnow().isoformat() + 'Z'
+        })
+
+    def publish_message(self, message):
+        """ Deliver a skill message (handler_name, room, command, data) to every endpoint """
+        body = self.notification(message)
+        for endpoint in self.endpoints:
+            self.post(endpoint, body)
+        return body['MessageId']
+
+    def post(self, endpoint, body):
+        request = urllib.request.Request(endpoint, data=json.dumps(body).encode('utf-8'), headers={
+            'Content-Type': 'text/plain; charset=UTF-8',
+            'X-Amz-Sns-Message-Type': body['Type'],
+            'X-Amz-Sns-Message-Id': body['MessageId'],
+            'X-Amz-Sns-Topic-Arn': self.topic_arn,
+        })
+        with urllib.request.urlopen(request, timeout=15) as response:
+            response.read()
@@ -0,0 +1,73 @@
+import json
+import uuid
+import time
+import threading
+
+"""
+Local stand-in for the boto3 SQS client, for a single queue. Received
+messages are hidden until they are deleted or their visibility timeout
+runs out, then they are delivered again, as SQS does.
+"""
+
+class FakeSqsClient:
+
+    def __init__(self, queue_url='https://sqs.eu-west-1.amazonaws.com/123456789012/Alexa-Chromecast',
+                 visibility_timeout=30):
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.condition = threading.Condition()
+        # MessageId -> message, in the order sent
+        self.messages = {}
+        # MessageId -> time.monotonic() it becomes visible again
+        self.hidden = {}
+        self.receipts = {}
+        self.receive_calls = 0
+        self.delete_calls = 0
+        self.fail_deletes = False
+
+    def send_message(self, QueueUrl, MessageBody):
+        message_id = str(uuid.uuid4())
+        with self.condition:
+            self.messages[message_id] = MessageBody
+            self.condition.notify_all()
+        return {'MessageId': message_id}
+
+    def send_sns(self, sns, message):
+        """ Queue a skill message the way an SNS subscription without raw delivery does """
+        return self.send_message(self.queue_url, json.dumps(sns.notification(message)))
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None):
+        self.receive_calls += 1
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                visible = [x for x in self.messages if self.hidden.get(x, 0) <= now][:MaxNumberOfMessages]
+                if visible or now >= deadline:
+                    break
+                self.condition.wait(min(0.05, deadline - now))
+            result = []
+            for message_id in visible:
+                receipt = uuid.uuid4().hex
+                self.receipts[receipt] = message_id
+                self.hidden[message_id] = now + (VisibilityTimeout or self.visibility_timeout)
+                result.append({'MessageId': message_id, 'ReceiptHandle': receipt, 'Body': self.messages[message_id]})
+        return {'Messages': result} if result else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.delete_calls += 1
+        successful, failed = [], []
+        with self.condition:
+            for entry in Entries:
+                message_id = self.receipts.pop(entry['ReceiptHandle'], None)
+                if self.fail_deletes or message_id is None:
+                    failed.append({'Id': entry['Id'], 'SenderFault': True, 'Message': 'ReceiptHandleIsInvalid'})
+                    continue
+                self.messages.pop(message_id, None)
+                self.hidden.pop(message_id, None)
+                successful.append({'Id': entry['Id']})
+        return {'Successful': successful, 'Failed': failed}
+
+    def pending(self):
+        with self.condition:
+            return len(self.messages)
@@ -0,0 +1,56 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.batch import parse_message, STEP_OK, STEP_ERROR, STEP_UNKNOWN, STEP_SKIPPED
+from tests.fake_chromecast import FakeSkillTestCase
+
+class TestParseMessage(unittest.TestCase):
+
+    def test_single_command(self):
+        rooms, steps, stop_on_error = parse_message({'room': 'Kitchen', 'command': 'pause', 'data': {}})
+        self.assertEqual(rooms, ['Kitchen'])
+        self.assertEqual(steps, [('pause', {})])
+        self.assertTrue(stop_on_error)
+
+    def test_batch(self):
+        rooms, steps, stop_on_error = parse_message({
+            'rooms': ['Kitchen', 'Media Room'],
+            'commands': [{'command': 'set-volume', 'data': {'volume': 3}}, {'command': 'play'}],
+            'stop_on_error': False
+        })
+        self.assertEqual(rooms, ['Kitchen', 'Media Room'])
+        self.assertEqual(steps, [('set-volume', {'volume': 3}), ('play', {})])
+        self.assertFalse(stop_on_error)
+
+class TestSkillBatch(FakeSkillTestCase):
+
+    device_names = ['Living Room TV', 'Media Room TV']
+
+    def setUp(self):
+        super().setUp()
+        self.skill = self.start_skill()
+
+    def calls(self, name):
+        return self.skill.get_chromecast(name).cast.calls
+
+    def test_steps_run_in_order_in_each_room(self):
+        batches = self.skill.handle_batch(['living room', 'media room', 'media'],
+                                          [('set-volume', {'volume': 5}), ('pause', {}), ('play', {})])
+        self.assertEqual(sorted(x.name for x in batches), ['Living Room TV', 'Media Room TV'])
+        for batch in batches:
+            self.assertEqual([x['result'] for x in batch.wait(5)], [STEP_OK] * 3)
+            # pause then play are both sent, they aren't coalesced inside a batch
+            self.assertEqual(self.calls(batch.name), [('set_volume', 0.5), ('pause',), ('play',)])
+
+    def test_unknown_and_failed_steps(self):
+        batch, = self.skill.handle_batch(['living room'], [('dance', {}), ('set-volume', {}), ('play', {})])
+        results = batch.wait(5)
+        self.assertEqual([x['result'] for x in results], [STEP_UNKNOWN, STEP_ERROR, STEP_SKIPPED])
+        self.assertIn('volume', results[1]['error'])
+        self.assertEqual(self.calls('Living Room TV'), [])
+
+    def test_continue_on_error(self):
+        batch, = self.skill.handle_batch(['living room'], [('set-volume', {}), ('play', {})], stop_on_error=False)
+        self.assertEqual([x['result'] for x in batch.wait(5)], [STEP_ERROR, STEP_OK])
+        self.assertEqual(self.calls('Living Room TV'), [('play',)])
@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import threading
+import time
+import sys
+import os
+from mock import patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.cache import ResultCache, SqliteStore, normalize_key
+
+class TestResultCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = ResultCache('test', ttl=60)
+        loads = []
+        loader = lambda: loads.append(1) or ['video']
+        self.assertEqual(cache.get_or_load('songs', loader), ['video'])
+        self.assertEqual(cache.get_or_load('songs', loader), ['video'])
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_empty_not_cached(self):
+        cache = ResultCache('test', ttl=60)
+        cache.get_or_load('songs', lambda: [])
+        self.assertIsNone(cache.get('songs'))
+
+    def test_lru_eviction(self):
+        cache = ResultCache('test', ttl=60, size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_stale_served_while_refreshing(self):
+        cache = ResultCache('test', ttl=60, max_age=3600)
+        refreshed = threading.Event()
+        with patch('local.cache.time.time', return_value=time.time() - 120):
+            cache.set('songs', ['old'])
+
+        def loader():
+            refreshed.set()
+            return ['new']
+
+        self.assertEqual(cache.get_or_load('songs', loader), ['old'])
+        self.assertTrue(refreshed.wait(2))
+        for _attempt in range(100):
+            if cache.get('songs'):
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('songs'), ['new'])
+        self.assertEqual(cache.stats()['stale'], 1)
+
+    def test_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'cache.db')
+            cache = ResultCache('test', ttl=60, store=SqliteStore(filename, 'results'))
+            cache.set(normalize_key(' Songs  by Macklemore'), [{'id': 'abc'}])
+            cache = ResultCache('test', ttl=60, store=SqliteStore(filename, 'results'))
+            self.assertEqual(cache.get('songs by macklemore'), [{'id': 'abc'}])
+
+class TestSqliteStore(unittest.TestCase):
+
+    def test_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'cache.db')
+            store = SqliteStore(filename, 'results', max_age=3600, max_rows=3)
+            now = time.time()
+            store.set('expired', ['old'], now - 7200)
+            for i in range(4):
+                store.set('key%i' % i, [i], now - i)
+            self.assertEqual(store.prune(), 2)
+            self.assertIsNone(store.get('expired'))
+            self.assertIsNone(store.get('key3'))
+            self.assertEqual(store.get('key0')[0], [0])
+
+    def test_pruned_while_writing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteStore(os.path.join(directory, 'cache.db'), 'results', max_rows=5)
+            with patch('local.cache.PRUNE_EVERY', 10):
+                for i in range(25):
+                    store.set('key%i' % i, [i], i)
+            count = store.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            self.assertEqual(count, 10)
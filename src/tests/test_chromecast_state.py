@@ -0,0 +1,148 @@
+import unittest
+import threading
+import time
+from mock import Mock, patch
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+import pychromecast
+from local.ChromecastSkill import ChromecastState, Skill, DISCOVERY_MODE_INCREMENTAL
+from tests.fake_chromecast import FakeDevices, wait_for_calls
+
+class TestRescanDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = FakeDevices('Living Room TV', 'Media Room TV')
+        patches = [
+            patch.object(pychromecast, 'discover_chromecasts', side_effect=self.devices.hosts),
+            patch.object(pychromecast, 'get_chromecast_from_host', side_effect=self.devices.from_host),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.state = ChromecastState(Mock())
+        self.addCleanup(self.state.stop)
+
+    def test_found(self):
+        self.assertEqual(self.state.count, 2)
+        self.assertEqual(self.state.match_chromecast('media room').name, 'Media Room TV')
+
+    def test_refresh_keeps_wrappers(self):
+        wrapper = self.state.get_chromecast('Living Room TV')
+        self.devices.add('Kitchen')
+        self.state._ChromecastState__set_chromecasts()
+        self.assertEqual(self.state.count, 3)
+        self.assertIs(self.state.get_chromecast('Living Room TV'), wrapper)
+        self.assertEqual(len(wrapper.cast.handlers), 1)
+
+    def test_refresh_removes_lost(self):
+        lost = self.state.get_chromecast('Media Room TV')
+        del self.devices.casts[lost.cast.uuid]
+        self.state._ChromecastState__set_chromecasts()
+        self.assertEqual(self.state.count, 1)
+        self.assertTrue(lost.cast.disconnected)
+
+class TestIncrementalDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = FakeDevices()
+        self.listener = None
+        patches = [
+            patch.object(pychromecast, 'start_discovery', side_effect=self.start_discovery),
+            patch.object(pychromecast, 'stop_discovery'),
+            patch.object(pychromecast, 'get_chromecast_from_service', side_effect=self.devices.from_service),
+            patch.object(pychromecast, 'DISCOVER_TIMEOUT', 0),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.state = ChromecastState(Mock(), discovery_mode=DISCOVERY_MODE_INCREMENTAL)
+        self.addCleanup(self.state.stop)
+
+    def start_discovery(self, listener):
+        self.listener = listener
+        return Mock()
+
+    def announce(self, cc, callback):
+        self.listener.services[cc.name] = cc.host_tuple
+        callback(cc.name)
+        self.state.wait_for_discovery(0)
+
+    def test_add_update_remove(self):
+        cc = self.devices.add('Living Room TV')
+        self.announce(cc, self.listener.add_callback)
+        wrapper = self.state.match_chromecast('living room')
+        self.assertEqual(wrapper.cast, cc)
+
+        # An update for a known device changes it in place
+        self.announce(cc, self.listener.update_callback)
+        self.assertIs(self.state.match_chromecast('living room'), wrapper)
+
+        self.listener.remove_callback(cc.name, cc.host_tuple)
+        self.assertEqual(self.state.count, 0)
+        self.assertTrue(cc.disconnected)
+
+    def test_rename(self):
+        cc = self.devices.add('Living Room TV')
+        self.announce(cc, self.listener.add_callback)
+        wrapper = self.state.get_chromecast('Living Room TV')
+        self.listener.services[cc.name] = cc.host_tuple[:4] + ('Lounge TV',)
+        self.listener.update_callback(cc.name)
+        self.assertIs(self.state.get_chromecast('Lounge TV'), wrapper)
+        self.assertEqual(self.state.count, 1)
+
+class TestFastStart(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = FakeDevices('Living Room TV')
+        self.release = threading.Event()
+
+        def slow_discovery():
+            self.release.wait(5)
+            return self.devices.hosts()
+
+        patches = [
+            patch.object(pychromecast, 'discover_chromecasts', side_effect=slow_discovery),
+            patch.object(pychromecast, 'get_chromecast_from_host', side_effect=self.devices.from_host),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_command_waits_for_discovery(self):
+        skill = Skill(fast_start=True, ready_timeout=5)
+        self.addCleanup(skill.chromecast_controller.stop)
+        self.assertEqual(skill.chromecast_controller.count, 0)
+
+        command = threading.Thread(target=skill.handle_command, args=('living room', 'pause', {}))
+        command.start()
+        self.release.set()
+        command.join(5)
+        cc = next(iter(self.devices.casts.values()))
+        self.assertEqual(wait_for_calls(cc), [('pause',)])
+
+    def test_command_waits_for_device(self):
+        cc = next(iter(self.devices.casts.values()))
+        cc.ready.clear()
+        skill = Skill(fast_start=True, ready_timeout=5, connect_timeout=0.1)
+        self.addCleanup(skill.chromecast_controller.stop)
+        self.release.set()
+        self.assertTrue(skill.chromecast_controller.wait_for_chromecasts(5))
+
+        skill.handle_command('living room', 'pause', {})
+        self.assertEqual(cc.calls, [])
+        cc.ready.set()
+        self.assertEqual(wait_for_calls(cc), [('pause',)])
+
+    def test_command_dropped_after_deadline(self):
+        cc = next(iter(self.devices.casts.values()))
+        cc.ready.clear()
+        skill = Skill(fast_start=True, ready_timeout=0.1, connect_timeout=0.1)
+        self.addCleanup(skill.chromecast_controller.stop)
+        self.release.set()
+        self.assertTrue(skill.chromecast_controller.wait_for_chromecasts(5))
+
+        skill.handle_command('living room', 'pause', {})
+        time.sleep(0.3)
+        cc.ready.set()
+        self.assertEqual(wait_for_calls(cc, 0.2), [])
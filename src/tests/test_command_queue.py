@@ -0,0 +1,51 @@
+import unittest
+import threading
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.command_queue import CommandQueue, coalesce, DEFAULT_RULES
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_last_volume_wins(self):
+        commands = [('set_volume', {'volume': 3}), ('set_volume', {'volume': 5}), ('set_volume', {'volume': 7})]
+        self.assertEqual(coalesce(commands, DEFAULT_RULES), [('set_volume', {'volume': 7})])
+
+    def test_pause_play_cancel(self):
+        commands = [('pause', {}), ('play', {}), ('pause', {})]
+        self.assertEqual(coalesce(commands, DEFAULT_RULES), [('pause', {})])
+
+    def test_order_kept_for_other_commands(self):
+        commands = [('set_volume', {'volume': 3}), ('play_next', {}), ('set_volume', {'volume': 5})]
+        self.assertEqual(coalesce(commands, DEFAULT_RULES), [('play_next', {}), ('set_volume', {'volume': 5})])
+
+    def test_no_rules(self):
+        commands = [('pause', {}), ('play', {})]
+        self.assertEqual(coalesce(commands, {}), commands)
+
+class TestCommandQueue(unittest.TestCase):
+
+    def test_coalesces_while_busy(self):
+        sent = []
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+
+        def execute(command, data):
+            sent.append((command, data))
+            if command == 'play_next':
+                started.set()
+                release.wait(5)
+            if command == 'set_volume':
+                done.set()
+
+        queue = CommandQueue('Living Room', execute)
+        queue.submit('play_next', {})
+        self.assertTrue(started.wait(2))
+        for volume in [3, 5, 7]:
+            queue.submit('set_volume', {'volume': volume})
+        release.set()
+        self.assertTrue(done.wait(2))
+        queue.stop()
+        self.assertEqual(sent, [('play_next', {}), ('set_volume', {'volume': 7})])
+        self.assertEqual(queue.coalesced, 2)
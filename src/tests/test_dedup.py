@@ -0,0 +1,67 @@
+import unittest
+import tempfile
+import time
+import sys
+import os
+from mock import patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.dedup import MessageDeduplicator, parse_timestamp
+from local.metrics import notifications_dropped_total, notifications_late_total
+from tests.test_subscriber import SubscriberTestCase
+
+class TestMessageDeduplicator(unittest.TestCase):
+
+    def test_duplicates(self):
+        dedup = MessageDeduplicator()
+        duplicates = notifications_dropped_total.value(reason='duplicate')
+        self.assertTrue(dedup.accept('a'))
+        self.assertTrue(dedup.accept('b'))
+        self.assertFalse(dedup.accept('a'))
+        self.assertEqual(notifications_dropped_total.value(reason='duplicate'), duplicates + 1)
+
+    def test_late(self):
+        dedup = MessageDeduplicator(window=60)
+        late = notifications_late_total.value()
+        # Counted, but still handled, as the clocks may not agree
+        self.assertTrue(dedup.accept('a', '2020-01-01T12:00:00.000Z'))
+        self.assertTrue(dedup.accept('b', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())))
+        self.assertEqual(notifications_late_total.value(), late + 1)
+        self.assertFalse(dedup.accept('a', '2020-01-01T12:00:00.000Z'))
+
+    def test_window_and_size(self):
+        dedup = MessageDeduplicator(window=60, size=3)
+        with patch('local.dedup.time.time', return_value=1000):
+            for x in 'abcd':
+                dedup.accept(x)
+        self.assertEqual(list(dedup.seen), ['b', 'c', 'd'])
+        with patch('local.dedup.time.time', return_value=1061):
+            self.assertTrue(dedup.accept('b'))
+        self.assertEqual(list(dedup.seen), ['b'])
+
+    def test_log_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, 'messages.log')
+            dedup = MessageDeduplicator(size=2, log_file=log_file)
+            for x in 'abcdefg':
+                dedup.accept(x)
+            dedup.close()
+            with open(log_file) as f:
+                self.assertLessEqual(len(f.readlines()), 5)
+            restarted = MessageDeduplicator(size=2, log_file=log_file)
+            self.assertFalse(restarted.accept('g'))
+            self.assertTrue(restarted.accept('a'))
+            restarted.close()
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('1970-01-01T00:01:00.500Z'), 60.5)
+        self.assertIsNone(parse_timestamp('yesterday'))
+
+class TestRedelivery(SubscriberTestCase):
+
+    def test_redelivered_message_handled_once(self):
+        body = self.sns.notification({'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'play', 'data': {}})
+        self.sns.post(self.sns.endpoints[0], body)
+        self.sns.post(self.sns.endpoints[0], body)
+        self.assertTrue(self.handled.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(self.skill.handle_command.call_count, 1)
@@ -0,0 +1,56 @@
+import unittest
+from mock import Mock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.device_status import StatusStore
+from tests.fake_chromecast import FakeSkillTestCase, wait_for_calls
+
+class TestStatusStore(unittest.TestCase):
+
+    def test_update(self):
+        store = StatusStore()
+        store.update('Kitchen', connected=True, volume=0.5)
+        snapshot = store.update('Kitchen', content_id='abc')
+        self.assertEqual((snapshot.connected, snapshot.volume, snapshot.content_id), (True, 0.5, 'abc'))
+        store.rename('Kitchen', 'Kitchen Speaker')
+        self.assertIsNone(store.get('Kitchen'))
+        self.assertEqual(store.get('Kitchen Speaker').name, 'Kitchen Speaker')
+        self.assertEqual(store.as_dict()['Kitchen Speaker']['queue'], [])
+        store.remove('Kitchen Speaker')
+        self.assertEqual(store.all(), {})
+
+class TestPushedStatus(FakeSkillTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.skill = self.start_skill()
+        self.cc = self.cast()
+
+    def test_snapshot(self):
+        self.cc.push_status(app_id='233637DE', display_name='YouTube', volume_level=0.4)
+        self.cc.media_controller.push_status('video1', 'PAUSED')
+        status = self.skill.status()['Living Room TV']
+        self.assertTrue(status['connected'])
+        self.assertEqual((status['app'], status['volume']), ('YouTube', 0.4))
+        self.assertEqual((status['content_id'], status['player_state']), ('video1', 'PAUSED'))
+
+    def test_no_wait_while_connected(self):
+        self.cc.wait = Mock()
+        self.skill.handle_command('living room', 'pause', {})
+        self.assertEqual(wait_for_calls(self.cc), [('pause',)])
+        self.cc.wait.assert_not_called()
+
+    def test_wait_after_connection_lost(self):
+        self.cc.set_ready(False)
+        self.assertFalse(self.skill.status()['Living Room TV']['connected'])
+        self.skill.handle_command('living room', 'pause', {})
+        self.assertEqual(wait_for_calls(self.cc, 0.2), [])
+        self.cc.set_ready(True)
+        self.assertEqual(wait_for_calls(self.cc), [('pause',)])
+
+    def test_previous_uses_pushed_content(self):
+        self.cc.media_controller.push_status('video2')
+        self.cc.media_controller.status = None
+        self.skill.handle_command('living room', 'play-previous', {})
+        self.assertEqual(wait_for_calls(self.cc), [('youtube.play_from_queue', 'video2', -1, None)])
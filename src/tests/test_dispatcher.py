@@ -0,0 +1,77 @@
+import unittest
+import threading
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.dispatcher import RoomDispatcher
+
+class TestRoomDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = RoomDispatcher(workers=4, queue_size=8)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def test_same_room_in_order(self):
+        results = []
+        done = threading.Event()
+
+        def work(i):
+            time.sleep(0.01)
+            results.append(i)
+            if i == 4:
+                done.set()
+
+        for i in range(5):
+            self.dispatcher.submit('Living Room', work, i)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+
+    def test_rooms_run_in_parallel(self):
+        release = threading.Event()
+        other_done = threading.Event()
+        self.dispatcher.submit('media room', release.wait, 5)
+        self.dispatcher.submit('kitchen', other_done.set)
+        self.assertTrue(other_done.wait(2))
+        release.set()
+
+    def test_room_key_normalized(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        self.dispatcher.submit('Media Room', block)
+        self.assertTrue(started.wait(2))
+        self.dispatcher.submit(' media room ', lambda: None)
+        self.assertEqual(self.dispatcher.pending('MEDIA ROOM'), 1)
+        release.set()
+
+    def test_queue_is_bounded(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        self.dispatcher.submit('media room', block)
+        self.assertTrue(started.wait(2))
+        accepted = [self.dispatcher.submit('media room', lambda: None) for _i in range(10)]
+        self.assertEqual(accepted.count(True), 8)
+        self.assertEqual(accepted.count(False), 2)
+        release.set()
+
+    def test_errors_do_not_stop_room(self):
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError('boom')
+
+        self.dispatcher.submit('media room', fail)
+        self.dispatcher.submit('media room', done.set)
+        self.assertTrue(done.wait(2))
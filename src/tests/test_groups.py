@@ -0,0 +1,58 @@
+import unittest
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.groups import RoomGroups
+from local.batch import collect, STEP_OK, STEP_EXPIRED, DEVICE_TIMEOUT
+from tests.fake_chromecast import FakeSkillTestCase, wait_for_calls
+
+class TestRoomGroups(unittest.TestCase):
+
+    def test_resolve(self):
+        groups = RoomGroups({'Downstairs': ['living room', 'kitchen']})
+        self.assertEqual(groups.resolve('the downstairs', ['Kitchen']), ['living room', 'kitchen'])
+        self.assertEqual(groups.resolve('Everywhere', ['Kitchen', 'Bedroom']), ['Bedroom', 'Kitchen'])
+        self.assertIsNone(groups.resolve('kitchen', ['Kitchen']))
+
+class TestGroupCommands(FakeSkillTestCase):
+
+    device_names = ['Living Room TV', 'Kitchen Speaker', 'Bedroom TV']
+
+    def skill(self, **kwargs):
+        return self.start_skill(groups={'downstairs': ['living room', 'kitchen']}, **kwargs)
+
+    def test_group(self):
+        skill = self.skill()
+        skill.handle_command('downstairs', 'pause', {})
+        self.assertEqual(wait_for_calls(self.cast('Living Room TV')), [('pause',)])
+        self.assertEqual(wait_for_calls(self.cast('Kitchen Speaker')), [('pause',)])
+        self.assertEqual(self.cast('Bedroom TV').calls, [])
+
+    def test_everywhere_in_parallel(self):
+        skill = self.skill()
+        for cc in self.devices.casts.values():
+            cc.latency = 0.3
+        started = time.monotonic()
+        batches = skill.handle_batch(['everywhere'], [('pause', {})])
+        results = collect(batches, time.monotonic() + 5)
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual({name: x['result'] for name, x in results.items()},
+                         {'Living Room TV': STEP_OK, 'Kitchen Speaker': STEP_OK, 'Bedroom TV': STEP_OK})
+
+    def test_deadline(self):
+        skill = self.skill(group_deadline=0.2)
+        slow = self.cast('Kitchen Speaker')
+        slow.set_ready(False)
+        started = time.monotonic()
+        batches = skill.handle_batch(['downstairs'], [('pause', {})])
+        results = collect(batches, time.monotonic() + 0.2)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(results['Living Room TV']['result'], STEP_OK)
+        self.assertEqual(results['Kitchen Speaker']['result'], DEVICE_TIMEOUT)
+
+        # Once the device is back, the late command is given up rather than sent
+        slow.set_ready(True)
+        batch = [x for x in batches if x.name == 'Kitchen Speaker'][0]
+        self.assertEqual([x['result'] for x in batch.wait(5)], [STEP_EXPIRED])
+        self.assertEqual(slow.calls, [])
@@ -1,10 +1,11 @@
 import unittest
 import pychromecast
-from mock import Mock
+from mock import Mock, patch
 from dotenv import load_dotenv
 from os.path import join, dirname
 import sys
 import os
+import time
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
 
 class SlotValue:
@@ -56,3 +57,106 @@ class TestChromecast(unittest.TestCase):
             }
         response = req.handle(handler_input)
         self.assertTrue('playing' in response.speak_text.lower())
+
+    def test_clients_are_reused(self):
+        import lambda_function.utils as utils
+        client = utils.get_client('s3')
+        self.assertIs(client, utils.get_client('s3'))
+        self.assertIsNot(client, utils.get_client('s3', signature_version='s3v4'))
+        self.assertEqual(client.meta.config.connect_timeout, utils.AWS_CONNECT_TIMEOUT)
+        self.assertEqual(client.meta.config.read_timeout, utils.AWS_READ_TIMEOUT)
+
+    def test_sns_client_region_from_topic(self):
+        from lambda_function import main
+        with patch.object(main, 'AWS_SNS_ARN', 'arn:aws:sns:eu-west-2:123456789012:Alexa-Chromecast'):
+            self.assertEqual(main.get_sns_client().meta.region_name, 'eu-west-2')
+
+    def test_benchmark(self):
+        from tests import benchmark_lambda
+        result = benchmark_lambda.main(['--runs', '1', '--invocations', '2'])
+        self.assertGreater(result['init_ms']['p50'], 0)
+        self.assertGreater(result['warm_invoke_ms']['p50'], 0)
+
+    def play_trailer(self, publish):
+        from lambda_function.main import PlayTrailerIntentHandler
+        req = PlayTrailerIntentHandler()
+        req.publish_command_to_sns = publish
+        handler_input = Mock()
+        handler_input.response_builder = MockResponseBuilder()
+        handler_input.request_envelope.request.intent.slots = {
+            'movie': SlotValue('The Matrix'),
+            'room': SlotValue('Media Room')
+            }
+        return req.handle(handler_input)
+
+    def test_publish_failure_is_reported(self):
+        response = self.play_trailer(Mock(side_effect=Exception('Could not connect')))
+        self.assertTrue('error' in response.speak_text.lower())
+
+    def test_publish_wait_is_bounded(self):
+        from lambda_function import main
+        with patch.object(main, 'PUBLISH_TIMEOUT', 0.05):
+            started = time.perf_counter()
+            response = self.play_trailer(Mock(side_effect=lambda *args: time.sleep(0.5)))
+            self.assertLess(time.perf_counter() - started, 0.4)
+        # A command that may still be sent is neither answered with 'playing' nor reported as an error
+        self.assertEqual(response.speak_text, main.PUBLISH_PENDING_RESPONSE)
+
+    def test_batch_message(self):
+        from lambda_function.main import batch_message
+        message = batch_message(['Media Room', 'Kitchen'], [('set-volume', {'volume': 3}), ('play', {})])
+        self.assertEqual(message['rooms'], ['Media Room', 'Kitchen'])
+        self.assertEqual(message['commands'], [
+            {'command': 'set-volume', 'data': {'volume': 3}},
+            {'command': 'play', 'data': {}}
+        ])
+
+    def test_relay_falls_back_to_sns(self):
+        from lambda_function import main
+        from lambda_function.relay import RelayError
+        relay = Mock()
+        with patch.object(main, 'relay_publisher', relay), \
+                patch.object(main, 'AWS_SNS_ARN', 'arn:aws:sns:eu-west-1:123456789012:Alexa-Chromecast'), \
+                patch.object(main, 'publish_message_to_sns') as publish_to_sns:
+            relay.publish.return_value = 1
+            main.publish_message({'command': 'play'})
+            publish_to_sns.assert_not_called()
+            # No listener connected to the relay
+            relay.publish.return_value = 0
+            main.publish_message({'command': 'play'})
+            relay.publish.side_effect = RelayError('Connection refused')
+            main.publish_message({'command': 'pause'})
+        self.assertEqual(publish_to_sns.call_count, 2)
+
+    def test_relay_delivery_unknown_is_not_sent_to_sns(self):
+        from lambda_function import main
+        from lambda_function.relay import RelayDeliveryUnknown
+        relay = Mock()
+        relay.publish.side_effect = RelayDeliveryUnknown('timed out')
+        with patch.object(main, 'relay_publisher', relay), \
+                patch.object(main, 'AWS_SNS_ARN', 'arn:aws:sns:eu-west-1:123456789012:Alexa-Chromecast'), \
+                patch.object(main, 'publish_message_to_sns') as publish_to_sns:
+            main.publish_message({'command': 'play'})
+        publish_to_sns.assert_not_called()
+
+    def test_resolved_trailer_is_sent(self):
+        from lambda_function import main
+        from lambda_function.resolve import Resolver
+        resolver = Resolver(timeout=0.2, moviedb_api_key='key')
+        publish = Mock()
+        with patch.object(main, 'resolver', resolver), \
+                patch('lambda_function.resolve.moviedb_trailer', return_value={'youtube_id': 'abc', 'title': 'The Matrix'}):
+            response = self.play_trailer(publish)
+        self.assertTrue('playing' in response.speak_text.lower())
+        self.assertEqual(publish.call_args[0][2], {'title': 'The Matrix', 'youtube_id': 'abc'})
+
+    def test_slow_lookup_is_left_to_listener(self):
+        from lambda_function import main
+        from lambda_function.resolve import Resolver
+        resolver = Resolver(timeout=0.05, moviedb_api_key='key')
+        publish = Mock()
+        with patch.object(main, 'resolver', resolver), \
+                patch('lambda_function.resolve.moviedb_trailer', side_effect=lambda *args: time.sleep(0.3)):
+            response = self.play_trailer(publish)
+        self.assertTrue('playing' in response.speak_text.lower())
+        self.assertEqual(publish.call_args[0][2], {'title': 'The Matrix'})
@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import io
+import json
+import logging
+import threading
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.logs import (LogPipeline, SampleFilter, correlated, correlation_id, parse_settings, apply_levels,
+                        apply_sampling, LOG_FORMAT_JSON)
+from local.command_queue import CommandQueue
+
+class TestLogPipeline(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        self.stream = io.StringIO()
+        self.pipeline = LogPipeline([logging.StreamHandler(self.stream)], LOG_FORMAT_JSON).start()
+        self.log = logging.getLogger('tests.logs')
+
+    def records(self):
+        self.pipeline.stop()
+        return [json.loads(x) for x in self.stream.getvalue().splitlines()]
+
+    def test_json_records(self):
+        with correlated('message-1'):
+            self.log.info('Playing %s', 'abc')
+            try:
+                raise IOError('Connection refused')
+            except IOError:
+                self.log.exception('Failed')
+        self.log.info('Later')
+        first, failed, later = self.records()
+        self.assertEqual((first['message'], first['correlation_id'], first['logger']), ('Playing abc', 'message-1', 'tests.logs'))
+        self.assertIn('Connection refused', failed['exception'])
+        self.assertEqual(later['correlation_id'], '-')
+
+    def test_id_follows_command_queue(self):
+        seen = []
+        done = threading.Event()
+        def execute(command, data):
+            seen.append(correlation_id.get())
+            self.log.info('Sent %s' % command)
+            done.set()
+        commands = CommandQueue('Living Room TV', execute)
+        self.addCleanup(commands.stop)
+        with correlated('message-2'):
+            commands.submit('pause', {})
+        self.assertTrue(done.wait(2))
+        self.assertEqual(seen, ['message-2'])
+        self.assertEqual(self.records()[0]['correlation_id'], 'message-2')
+
+class TestLevels(unittest.TestCase):
+
+    def test_parse_and_apply(self):
+        self.assertEqual(parse_settings('local.youtube=DEBUG, pychromecast=warning'),
+                         {'local.youtube': 'DEBUG', 'pychromecast': 'warning'})
+        log = logging.getLogger('tests.logs.levels')
+        apply_levels({'tests.logs.levels': 'debug'})
+        self.assertEqual(log.level, logging.DEBUG)
+
+    def test_sampling(self):
+        sample = SampleFilter(3)
+        records = [logging.LogRecord('cast', logging.DEBUG, '', 0, 'msg', None, None) for _ in range(6)]
+        self.assertEqual([sample.filter(x) for x in records], [True, False, False, True, False, False])
+        warning = logging.LogRecord('cast', logging.WARNING, '', 0, 'msg', None, None)
+        self.assertTrue(sample.filter(warning))
+        # Applying again replaces the filter rather than adding another
+        log = logging.getLogger('tests.logs.cast')
+        apply_sampling({'tests.logs.cast': '20'})
+        apply_sampling({'tests.logs.cast': '20'})
+        self.assertEqual(len(log.filters), 1)
+        apply_sampling({'tests.logs.cast': '1'})
+        self.assertEqual(log.filters, [])
+
+if __name__ == '__main__':
+    unittest.main()
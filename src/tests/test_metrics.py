@@ -0,0 +1,47 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.metrics import Registry
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('commands_total', 'Commands', ['command'])
+        counter.inc(command='pause')
+        counter.inc(command='pause')
+        counter.inc(command='play')
+        text = self.registry.render()
+        self.assertIn('# TYPE commands_total counter', text)
+        self.assertIn('commands_total{command="pause"} 2', text)
+        self.assertIn('commands_total{command="play"} 1', text)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('stage_seconds', 'Stages', ['stage'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='match')
+        histogram.observe(0.5, stage='match')
+        histogram.observe(5, stage='match')
+        lines = self.registry.render().splitlines()
+        self.assertIn('stage_seconds_bucket{stage="match",le="0.1"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="match",le="1.0"} 2', lines)
+        self.assertIn('stage_seconds_bucket{stage="match",le="+Inf"} 3', lines)
+        self.assertIn('stage_seconds_sum{stage="match"} 5.55', lines)
+        self.assertIn('stage_seconds_count{stage="match"} 3', lines)
+        self.assertEqual(histogram.count(stage='match'), 3)
+
+    def test_timer(self):
+        histogram = self.registry.histogram('stage_seconds', 'Stages', ['stage'])
+        with histogram.time(stage='dispatch'):
+            pass
+        self.assertEqual(histogram.count(stage='dispatch'), 1)
+
+    def test_gauge_and_escaping(self):
+        self.registry.gauge('cache', 'Cache', ['stat'], lambda: [(('say "hi"',), 3)])
+        self.assertIn('cache{stat="say \\"hi\\""} 3', self.registry.render())
+
+    def test_registered_once(self):
+        first = self.registry.counter('commands_total', 'Commands')
+        self.assertIs(self.registry.counter('commands_total', 'Commands'), first)
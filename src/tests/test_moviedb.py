@@ -0,0 +1,82 @@
+import unittest
+import json
+import threading
+import sys
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.moviedb_search import MovieDbClient, MovieDbError
+
+MOVIES = {'the matrix': {'id': 603, 'title': 'The Matrix'}}
+VIDEOS = {603: [
+    {'key': 'featurette', 'site': 'YouTube', 'type': 'Featurette'},
+    {'key': 'vKQi3bBA1y8', 'site': 'YouTube', 'type': 'Trailer'},
+]}
+
+class StubMovieDbHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        StubMovieDbHandler.requests.append(url.path)
+        if query.get('api_key') != ['test-key']:
+            return self.reply(401, {})
+        if url.path == '/3/search/movie':
+            movie = MOVIES.get(query['query'][0].lower())
+            results = [movie] if movie else []
+            return self.reply(200, {'total_results': len(results), 'results': results})
+        if url.path.startswith('/3/movie/') and url.path.endswith('/videos'):
+            movie_id = int(url.path.split('/')[-2])
+            return self.reply(200, {'id': movie_id, 'results': VIDEOS.get(movie_id, [])})
+        self.reply(404, {})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestMovieDbClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMovieDbHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_uri = 'http://127.0.0.1:%i/3' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubMovieDbHandler.requests = []
+        self.client = MovieDbClient('test-key', self.api_uri)
+
+    def test_trailer(self):
+        result = self.client.get_movie_trailer_youtube_id('The Matrix')
+        self.assertEqual(result, {'youtube_id': 'vKQi3bBA1y8', 'title': 'The Matrix'})
+        self.assertEqual(StubMovieDbHandler.requests, ['/3/search/movie', '/3/movie/603/videos'])
+
+    def test_cached(self):
+        self.client.get_movie_trailer_youtube_id('The Matrix')
+        self.client.get_movie_trailer_youtube_id('the  matrix')
+        self.assertEqual(len(StubMovieDbHandler.requests), 2)
+        self.assertEqual(self.client.cache_stats()['movies']['hits'], 1)
+
+    def test_no_results(self):
+        with self.assertRaises(MovieDbError):
+            self.client.get_movie_trailer_youtube_id('Not A Movie')
+
+    def test_no_api_key(self):
+        client = MovieDbClient(False, self.api_uri)
+        with self.assertRaises(MovieDbError):
+            client.search_movie('The Matrix')
+        self.assertEqual(StubMovieDbHandler.requests, [])
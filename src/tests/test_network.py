@@ -0,0 +1,176 @@
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+from mock import Mock, patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.network import NetworkCache, NetworkState
+from local.SkillSubscriber import Subscriber
+from tests.fake_sns import FakeSnsClient
+
+IGD_URL = 'http://192.168.1.1:5000/rootDesc.xml'
+
+class FakeUpnp:
+    """ Stands in for miniupnpc.UPnP, with a gateway that only answers at IGD_URL """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.lanaddr = '0.0.0.0'
+        self.discoverdelay = 0
+
+    def discover(self):
+        self.gateway.discovered += 1
+
+    def selectigd(self, url=None):
+        if url not in (None, IGD_URL):
+            raise Exception('No UPnP device discovered')
+        self.gateway.selected.append(url)
+        self.lanaddr = self.gateway.lanaddr
+
+    def addportmapping(self, external_port, protocol, client, internal_port, description, remote):
+        self.gateway.mappings[external_port] = (client, internal_port, description, True, 0)
+        return True
+
+    def getspecificportmapping(self, port, protocol):
+        return self.gateway.mappings.get(port)
+
+    def deleteportmapping(self, port, protocol):
+        return self.gateway.mappings.pop(port, None) is not None
+
+class FakeGateway:
+
+    def __init__(self):
+        self.lanaddr = '192.168.1.20'
+        self.mappings = {}
+        self.selected = []
+        self.discovered = 0
+
+    def upnp(self):
+        return FakeUpnp(self)
+
+class TestNetworkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.filename = os.path.join(self.folder, 'network-cache.json')
+
+    def test_round_trip(self):
+        cache = NetworkCache(self.filename)
+        self.assertIsNone(cache.load())
+        state = NetworkState(IGD_URL, '192.168.1.20', '127.0.0.1', 30000)
+        cache.save(state)
+        self.assertEqual(NetworkCache(self.filename).load(), state)
+
+    def test_unreadable(self):
+        with open(self.filename, 'w') as f:
+            f.write('{not json')
+        self.assertIsNone(NetworkCache(self.filename).load())
+
+class TestSubscriberNetwork(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = NetworkCache(os.path.join(self.folder, 'network-cache.json'))
+        self.gateway = FakeGateway()
+        self.sns = FakeSnsClient()
+        # Subscriptions are recorded without posting a confirmation
+        self.sns.subscribe = Mock(side_effect=lambda TopicArn, Protocol, Endpoint: self.sns.endpoints.append(Endpoint))
+        patches = [
+            patch('local.SkillSubscriber.miniupnpc.UPnP', side_effect=self.gateway.upnp),
+            patch('local.SkillSubscriber.find_igd_location', return_value=IGD_URL),
+            patch.object(Subscriber, 'get_external_ip', return_value='127.0.0.1'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def start(self):
+        subscriber = Subscriber({'chromecast': Mock()}, None, None, topic_arn=self.sns.topic_arn,
+                                sns_client=self.sns, serve=False, network_cache=self.cache)
+        self.addCleanup(subscriber.server.server_close)
+        return subscriber
+
+    def test_first_start_is_cached(self):
+        subscriber = self.start()
+        port = subscriber.server.server_port
+        self.assertEqual(subscriber.endpoint_url, 'http://127.0.0.1:%i' % port)
+        self.assertEqual(self.gateway.mappings[port][0], '192.168.1.20')
+        self.assertEqual(self.cache.load(), NetworkState(IGD_URL, '192.168.1.20', '127.0.0.1', port))
+        self.assertEqual(self.gateway.discovered, 0)
+
+    def test_restart_uses_cache(self):
+        first = self.start()
+        port = first.server.server_port
+        self.sns.unsubscribe = Mock(side_effect=lambda SubscriptionArn: self.sns.endpoints.clear())
+        # Stopping still removes the port forward and the subscription
+        with self.assertRaises(SystemExit):
+            first.unsubscribe()
+        first.server.server_close()
+        self.assertNotIn(port, self.gateway.mappings)
+        self.assertEqual(self.sns.endpoints, [])
+        self.sns.subscribe.reset_mock()
+        self.gateway.selected = []
+        Subscriber.get_external_ip.reset_mock()
+
+        with patch.object(Subscriber, 'watch_network'):
+            subscriber = self.start()
+        # Listening on the same address, without asking the gateway or looking up the IP first
+        self.assertEqual(subscriber.server.server_port, port)
+        self.assertEqual(subscriber.endpoint_url, 'http://127.0.0.1:%i' % port)
+        self.assertEqual(self.gateway.selected, [])
+        Subscriber.get_external_ip.assert_not_called()
+
+        # The background check puts the port forward and subscription back
+        self.assertTrue(subscriber.check_network())
+        self.assertEqual(self.gateway.selected, [IGD_URL])
+        self.assertIn(port, self.gateway.mappings)
+        self.sns.subscribe.assert_called_once_with(TopicArn=self.sns.topic_arn, Protocol='http',
+                                                   Endpoint=subscriber.endpoint_url)
+        self.sns.subscribe.reset_mock()
+        self.assertTrue(subscriber.check_network())
+        self.sns.subscribe.assert_not_called()
+
+    def test_address_changed(self):
+        subscriber = self.start()
+        old_endpoint = subscriber.endpoint_url
+        self.sns.unsubscribe = Mock()
+        Subscriber.get_external_ip.return_value = '127.0.0.2'
+        self.assertTrue(subscriber.check_network())
+        self.assertEqual(subscriber.endpoint_url, 'http://127.0.0.2:%i' % subscriber.server.server_port)
+        self.sns.subscribe.assert_called_with(TopicArn=self.sns.topic_arn, Protocol='http',
+                                              Endpoint=subscriber.endpoint_url)
+        self.sns.unsubscribe.assert_called_once()
+        self.assertEqual(self.cache.load().external_ip, '127.0.0.2')
+        self.assertNotEqual(old_endpoint, subscriber.endpoint_url)
+
+    def test_failed_check_changes_nothing(self):
+        subscriber = self.start()
+        endpoint = subscriber.endpoint_url
+        self.sns.subscribe.reset_mock()
+        Subscriber.get_external_ip.side_effect = OSError('Network is unreachable')
+        self.assertFalse(subscriber.check_network())
+        self.assertEqual(subscriber.endpoint_url, endpoint)
+        self.sns.subscribe.assert_not_called()
+
+    def test_first_check_is_retried(self):
+        subscriber = self.start()
+        self.addCleanup(subscriber.stopped.set)
+        checks = iter([False, False, True])
+        with patch.object(subscriber, 'check_network', side_effect=lambda: next(checks)) as check, \
+                patch('local.SkillSubscriber.FIRST_CHECK_RETRY', 0.01):
+            subscriber.watch_network(check_now=True)
+        self.assertEqual(check.call_count, 3)
+
+    def test_lost_mapping_is_restored(self):
+        subscriber = self.start()
+        self.sns.subscribe.reset_mock()
+        self.gateway.mappings.clear()
+        self.assertTrue(subscriber.check_network())
+        self.assertIn(subscriber.server.server_port, self.gateway.mappings)
+        self.sns.subscribe.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import sys
+import os
+from mock import Mock, patch, ANY
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+
+from botocore.stub import Stubber
+from lambda_function import utils
+from lambda_function.persistence import CachingAdapter, DynamoDbAdapter
+
+def envelope(user_id='user-1'):
+    request_envelope = Mock()
+    request_envelope.context.system.user.user_id = user_id
+    return request_envelope
+
+class TestCachingAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Mock()
+        self.store.get_attributes.side_effect = lambda request_envelope: {'DEVICE_1': 'Media Room'}
+        self.adapter = CachingAdapter(self.store, ttl=60)
+
+    def test_reads_are_cached_per_user(self):
+        self.assertEqual(self.adapter.get_attributes(envelope()), {'DEVICE_1': 'Media Room'})
+        self.adapter.get_attributes(envelope())
+        self.assertEqual(self.store.get_attributes.call_count, 1)
+        self.adapter.get_attributes(envelope('user-2'))
+        self.assertEqual(self.store.get_attributes.call_count, 2)
+        self.assertEqual((self.adapter.hits, self.adapter.misses), (1, 2))
+
+    def test_changes_are_not_shared_until_saved(self):
+        self.adapter.get_attributes(envelope())['DEVICE_1'] = 'Bedroom'
+        self.assertEqual(self.adapter.get_attributes(envelope()), {'DEVICE_1': 'Media Room'})
+
+    def test_save_writes_through(self):
+        self.adapter.get_attributes(envelope())
+        self.adapter.save_attributes(envelope(), {'DEVICE_1': 'Bedroom'})
+        self.store.save_attributes.assert_called_once_with(ANY, {'DEVICE_1': 'Bedroom'})
+        self.assertEqual(self.adapter.get_attributes(envelope()), {'DEVICE_1': 'Bedroom'})
+        self.assertEqual(self.store.get_attributes.call_count, 1)
+
+    def test_failed_save_is_read_again(self):
+        self.adapter.get_attributes(envelope())
+        self.store.save_attributes.side_effect = Exception('S3 is down')
+        with self.assertRaises(Exception):
+            self.adapter.save_attributes(envelope(), {'DEVICE_1': 'Bedroom'})
+        self.adapter.get_attributes(envelope())
+        self.assertEqual(self.store.get_attributes.call_count, 2)
+
+    def test_entries_expire(self):
+        with patch('lambda_function.persistence.time.monotonic', return_value=1000):
+            self.adapter.get_attributes(envelope())
+        with patch('lambda_function.persistence.time.monotonic', return_value=1061):
+            self.adapter.get_attributes(envelope())
+        self.assertEqual(self.store.get_attributes.call_count, 2)
+
+class TestDynamoDbAdapter(unittest.TestCase):
+
+    def test_round_trip(self):
+        client = utils.get_client('dynamodb', region_name='eu-west-1')
+        adapter = DynamoDbAdapter('alexa-chromecast', dynamodb_client=client)
+        with Stubber(client) as stubber:
+            stubber.add_response('get_item', {}, {'TableName': 'alexa-chromecast', 'Key': {'id': {'S': 'user-1'}}})
+            stubber.add_response('put_item', {}, {'TableName': 'alexa-chromecast', 'Item': {
+                'id': {'S': 'user-1'}, 'attributes': {'S': '{"DEVICE_1": "Media Room"}'}}})
+            stubber.add_response('get_item', {'Item': {
+                'id': {'S': 'user-1'}, 'attributes': {'S': '{"DEVICE_1": "Media Room"}'}}})
+            self.assertEqual(adapter.get_attributes(envelope()), {})
+            adapter.save_attributes(envelope(), {'DEVICE_1': 'Media Room'})
+            self.assertEqual(adapter.get_attributes(envelope()), {'DEVICE_1': 'Media Room'})
+            stubber.assert_no_pending_responses()
@@ -0,0 +1,125 @@
+import unittest
+import threading
+from mock import patch, Mock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from casttube import YouTubeSession
+from local.ChromecastSkill import MyYouTubeController
+from local.queue_loader import QueueLoader, queue_videos_total, RETRY_DELAY
+from local.metrics import stage_seconds
+from tests.fake_chromecast import FakeChromecast, FakeYouTubeController, FakeSkillTestCase
+
+def video_ids(count):
+    return ['video%i' % i for i in range(count)]
+
+class TestQueueLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = FakeChromecast('Living Room TV')
+        self.yt = FakeYouTubeController()
+        self.cc.register_handler(self.yt)
+
+    def test_batches(self):
+        loaded = queue_videos_total.value(result='loaded')
+        timed = stage_seconds.count(stage='queue_load')
+        progress = []
+        loader = QueueLoader(self.cc.name, self.yt, video_ids(5), 2, lambda x: progress.append(x.loaded))
+        loader.start().done.wait(2)
+        self.assertEqual(self.cc.calls, [
+            ('youtube.add_videos_to_queue', ['video0', 'video1']),
+            ('youtube.add_videos_to_queue', ['video2', 'video3']),
+            ('youtube.add_videos_to_queue', ['video4'])])
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(queue_videos_total.value(result='loaded') - loaded, 5)
+        self.assertEqual(stage_seconds.count(stage='queue_load') - timed, 1)
+
+    def test_failed_batch(self):
+        self.yt.fail_batches = 2
+        loader = QueueLoader(self.cc.name, self.yt, video_ids(4), 2)
+        loader.run()
+        self.assertEqual(loader.failed, ['video0', 'video1'])
+        self.assertEqual(loader.loaded, 2)
+        self.assertEqual(self.cc.calls, [('youtube.add_videos_to_queue', ['video2', 'video3'])])
+
+    def test_retry(self):
+        self.yt.fail_batches = 1
+        loader = QueueLoader(self.cc.name, self.yt, video_ids(2), 2)
+        with patch.object(loader.cancelled, 'wait', return_value=False) as wait:
+            loader.run()
+        wait.assert_called_once_with(RETRY_DELAY)
+        self.assertEqual((loader.loaded, loader.failed), (2, []))
+
+    def test_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_add(batch):
+            started.set()
+            release.wait(2)
+        self.yt.add_videos_to_queue = Mock(side_effect=slow_add)
+        loader = QueueLoader(self.cc.name, self.yt, video_ids(6), 2).start()
+        self.assertTrue(started.wait(2))
+        threading.Timer(0.1, release.set).start()
+        self.assertTrue(loader.cancel(2))
+        self.assertEqual(self.yt.add_videos_to_queue.call_count, 1)
+
+class TestPlayVideo(FakeSkillTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start_patches(patch('local.youtube.search', return_value=[{'id': x, 'playlist_id': None} for x in video_ids(7)]))
+        self.skill = self.start_skill(queue_batch_size=3)
+        self.cc = self.cast()
+
+    def test_first_video_then_batches(self):
+        self.skill.play_video({'title': 'songs', 'app': 'youtube'}, 'Living Room TV')
+        wrapper = self.skill.get_chromecast('Living Room TV')
+        self.assertTrue(wrapper.queue_loader.done.wait(2))
+        self.assertEqual(self.cc.calls, [
+            ('youtube.clear_playlist',),
+            ('youtube.play_video', 'video0'),
+            ('youtube.add_videos_to_queue', ['video1', 'video2', 'video3']),
+            ('youtube.add_videos_to_queue', ['video4', 'video5', 'video6'])])
+        status = self.skill.status()['Living Room TV']
+        self.assertEqual((len(status['queue']), status['queue_loaded']), (7, 7))
+
+    def test_new_video_stops_loading(self):
+        wrapper = self.skill.get_chromecast('Living Room TV')
+        loader = wrapper.load_queue(video_ids(3))
+        wrapper.stop_queue_load()
+        self.assertTrue(loader.done.is_set())
+        self.assertIsNone(wrapper.queue_loader)
+
+    def test_stuck_batch_does_not_hold_up_commands(self):
+        wrapper = self.skill.get_chromecast('Living Room TV')
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        wrapper.youtube_controller.add_videos_to_queue = Mock(side_effect=lambda batch: started.set() or release.wait(5))
+        loader = wrapper.load_queue(video_ids(3))
+        self.assertTrue(started.wait(2))
+        with patch('local.ChromecastSkill.CANCEL_TIMEOUT', 0.1):
+            wrapper.stop_queue_load()
+        self.assertFalse(loader.done.is_set())
+        self.assertIsNone(wrapper.queue_loader)
+
+class TestBulkQueueRequest(unittest.TestCase):
+
+    def test_add_videos_to_queue(self):
+        yt = MyYouTubeController()
+        session = YouTubeSession('screen')
+        session._lounge_token, session._gsession_id, session._sid = 'token', 'gsession', 'sid'
+        session._req_count = 3
+        session._bind = Mock()
+        session._do_post = Mock(side_effect=lambda *args, **kwargs: setattr(session, '_req_count', session._req_count + 1))
+        yt._screen_id, yt._session = 'screen', session
+        yt.add_videos_to_queue(['a', 'b'])
+        session._bind.assert_called_once_with()
+        data = session._do_post.call_args[1]['data']
+        self.assertEqual(data, {'count': 2, 'req3__sc': 'addVideo', 'req3_videoId': 'a',
+                                'req4__sc': 'addVideo', 'req4_videoId': 'b'})
+        self.assertEqual(session._req_count, 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+import unittest
+import threading
+import tempfile
+import ipaddress
+import socket
+import time
+import ssl
+import sys
+import os
+from datetime import datetime, timedelta
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from mock import Mock, patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.relay import RelayServer, RelayClient, parse_url, server_ssl_context
+from local.SkillSubscriber import Subscriber, TRANSPORT_RELAY, SERVER_MODE_THREADED
+from lambda_function.relay import RelayPublisher, RelayError, RelayDeliveryUnknown
+
+class RelayTestCase(unittest.TestCase):
+
+    token = 'secret'
+
+    def start_server(self, address=('127.0.0.1', 0), **kwargs):
+        server = RelayServer(address, self.token, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def start_client(self, url, handle, **kwargs):
+        client = RelayClient(url, handle, self.token, **kwargs)
+        thread = threading.Thread(target=client.run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(client.stop)
+        return client
+
+class TestRelay(RelayTestCase):
+
+    def setUp(self):
+        self.server = self.start_server()
+        self.received = []
+        self.event = threading.Event()
+        self.client = self.start_client(self.server.url, self.handle)
+        self.assertTrue(self.server.wait_for_subscribers(1, 5))
+
+    def handle(self, frame):
+        self.received.append(frame)
+        self.event.set()
+
+    def test_publish(self):
+        publisher = RelayPublisher(self.server.url, self.token)
+        self.addCleanup(publisher.close)
+        self.assertEqual(publisher.publish({'command': 'play'}), 1)
+        self.assertTrue(self.event.wait(2))
+        self.assertEqual(self.received[0]['message'], {'command': 'play'})
+        # The connection is kept for the next command
+        sock = publisher.sock
+        self.assertEqual(publisher.publish({'command': 'pause'}), 1)
+        self.assertIs(publisher.sock, sock)
+
+    def test_publisher_reconnects(self):
+        publisher = RelayPublisher(self.server.url, self.token)
+        self.addCleanup(publisher.close)
+        publisher.publish({'command': 'play'})
+        publisher.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(publisher.publish({'command': 'pause'}), 1)
+
+    def test_slow_listener_is_dropped(self):
+        # A listener that subscribes and then never reads
+        message = {'command': 'play', 'data': {'padding': 'x' * 1024 * 1024}}
+        with patch('local.relay.SUBSCRIBER_BACKLOG', 2):
+            slow = socket.create_connection(self.server.server_address)
+            self.addCleanup(slow.close)
+            slow.sendall(b'{"type": "subscribe", "token": "secret"}\n')
+            self.assertTrue(self.server.wait_for_subscribers(2, 5))
+            started = time.monotonic()
+            delivered = [self.server.publish(str(i), message) for i in range(20)]
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(delivered[0], 2)
+        self.assertEqual(delivered[-1], 1)
+        self.assertTrue(self.event.wait(2))
+
+    def test_bad_token(self):
+        publisher = RelayPublisher(self.server.url, 'wrong')
+        self.addCleanup(publisher.close)
+        with self.assertRaises(RelayError):
+            publisher.publish({'command': 'play'})
+        self.assertEqual(self.server.published, 0)
+
+    def test_heartbeat(self):
+        client = RelayClient(self.server.url, Mock(), self.token, heartbeat=0.1)
+        connect = Mock(side_effect=client.connect)
+        with patch.object(client, 'connect', connect):
+            threading.Thread(target=client.run, daemon=True).start()
+            self.addCleanup(client.stop)
+            self.assertTrue(self.server.wait_for_subscribers(2, 5))
+            # Pings are answered, so the connection stays up through several heartbeats
+            self.assertFalse(client.stopped.wait(0.6))
+        self.assertTrue(client.connected.is_set())
+        self.assertEqual(connect.call_count, 1)
+
+class TestRelayReconnect(RelayTestCase):
+
+    def test_silent_relay(self):
+        # A relay that accepts the subscription and then never answers
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        self.addCleanup(listener.close)
+        accepted = []
+
+        def serve():
+            while True:
+                try:
+                    conn, address = listener.accept()
+                except OSError:
+                    return
+                conn.recv(1024)
+                conn.sendall(b'{"type": "subscribed"}\n')
+                accepted.append(conn)
+
+        threading.Thread(target=serve, daemon=True).start()
+        with patch('local.relay.MAX_BACKOFF', 0.1):
+            client = self.start_client('tcp://127.0.0.1:%i' % listener.getsockname()[1], Mock(), heartbeat=0.1)
+            for i in range(50):
+                if len(accepted) >= 2:
+                    break
+                client.stopped.wait(0.1)
+        self.assertGreaterEqual(len(accepted), 2)
+        for conn in accepted:
+            conn.close()
+
+    def test_delivery_unknown_is_not_retried(self):
+        # A relay that takes the message and closes the connection without replying
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        self.addCleanup(listener.close)
+        frames = []
+
+        def serve():
+            while True:
+                try:
+                    conn, address = listener.accept()
+                except OSError:
+                    return
+                frames.append(conn.makefile('rb').readline())
+                conn.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        publisher = RelayPublisher('tcp://127.0.0.1:%i' % listener.getsockname()[1], self.token)
+        self.addCleanup(publisher.close)
+        with self.assertRaises(RelayDeliveryUnknown):
+            publisher.publish({'command': 'play'})
+        self.assertEqual(len(frames), 1)
+
+    def test_backoff(self):
+        client = RelayClient('tcp://127.0.0.1:9', Mock(), self.token)
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 7:
+                client.stopped.set()
+            return client.stopped.is_set()
+
+        with patch.object(client, 'connect', side_effect=ConnectionRefusedError()), \
+                patch.object(client.stopped, 'wait', side_effect=wait):
+            client.run()
+        self.assertEqual(waits, [1, 2, 4, 8, 16, 30, 30])
+
+    def test_parse_url(self):
+        self.assertEqual(parse_url('tls://relay.example.com:443'), ('relay.example.com', 443, True))
+        self.assertEqual(parse_url('127.0.0.1:8765'), ('127.0.0.1', 8765, False))
+        with self.assertRaises(ValueError):
+            parse_url('http://relay.example.com')
+
+def self_signed_certificate(folder):
+    """ A certificate for 127.0.0.1, returns the certificate and key file names """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), critical=False)
+            .sign(key, hashes.SHA256()))
+    cert_file, key_file = os.path.join(folder, 'cert.pem'), os.path.join(folder, 'key.pem')
+    with open(cert_file, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+class TestRelaySecurity(RelayTestCase):
+
+    def test_token_needed_off_loopback(self):
+        for host in ['0.0.0.0', '', '192.168.1.20']:
+            with self.assertRaises(ValueError):
+                RelayServer((host, 0), None)
+        server = RelayServer(('localhost', 0), None)
+        server.server_close()
+
+    def test_tls(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cert_file, key_file = self_signed_certificate(folder)
+            server = self.start_server(ssl_context=server_ssl_context(cert_file, key_file))
+            client_context = ssl.create_default_context(cafile=cert_file)
+        self.assertTrue(server.url.startswith('tls://'))
+        received = threading.Event()
+        self.start_client(server.url, lambda frame: received.set(), ssl_context=client_context)
+        self.assertTrue(server.wait_for_subscribers(1, 5))
+        self.assertEqual(server.publish('1', {'command': 'play'}), 1)
+        self.assertTrue(received.wait(2))
+
+        # A plain connection doesn't get past the handshake
+        publisher = RelayPublisher(server.url.replace('tls://', 'tcp://'), self.token)
+        self.addCleanup(publisher.close)
+        with self.assertRaises(RelayError):
+            publisher.publish({'command': 'play'})
+        self.assertEqual(server.published, 1)
+
+class TestRelaySubscriber(RelayTestCase):
+
+    def test_dispatch(self):
+        server = self.start_server()
+        skill = Mock()
+        handled = threading.Event()
+        skill.handle_command.side_effect = lambda *args: handled.set()
+        with patch('local.SkillSubscriber.miniupnpc') as upnp, \
+                patch.object(Subscriber, 'get_external_ip') as get_external_ip:
+            subscriber = Subscriber({'chromecast': skill}, None, None, server_mode=SERVER_MODE_THREADED,
+                                    sns_client=Mock(), serve=False, transport=TRANSPORT_RELAY,
+                                    relay_url=server.url, relay_token=self.token)
+        upnp.UPnP.assert_not_called()
+        get_external_ip.assert_not_called()
+        threading.Thread(target=subscriber.consumer.run, daemon=True).start()
+        self.addCleanup(subscriber.stop)
+        self.assertTrue(server.wait_for_subscribers(1, 5))
+
+        message = {'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'pause', 'data': {}}
+        server.publish('1', message)
+        # Sent twice, handled once
+        server.publish('1', message)
+        self.assertTrue(handled.wait(2))
+        subscriber.dispatcher.shutdown(wait=True)
+        skill.handle_command.assert_called_once_with('Kitchen', 'pause', {})
+
+if __name__ == '__main__':
+    unittest.main()
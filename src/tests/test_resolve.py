@@ -0,0 +1,69 @@
+import unittest
+import time
+from mock import Mock, patch
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from lambda_function.resolve import Resolver, youtube_videos, moviedb_trailer
+from tests.fake_chromecast import FakeSkillTestCase, wait_for_calls
+
+class TestResolver(unittest.TestCase):
+
+    def test_youtube_videos(self):
+        found = Mock(videos=[{'id': 'a'}, {'id': 'b&list=PL1'}])
+        with patch('youtube_search.YoutubeSearch', return_value=found):
+            self.assertEqual(youtube_videos('songs', 1), [{'id': 'a', 'playlist_id': None}, {'id': 'b', 'playlist_id': 'PL1'}])
+            self.assertEqual(youtube_videos('songs playlist', 1), [{'id': 'b', 'playlist_id': 'PL1'}])
+            # The same search as far as the cache is concerned, so the same videos
+            self.assertEqual(youtube_videos('Songs Playlist', 1), [{'id': 'b', 'playlist_id': 'PL1'}])
+
+    def test_moviedb_trailer(self):
+        replies = {'/search/movie': {'results': [{'id': 603, 'title': 'The Matrix'}]},
+                   '/movie/603/videos': {'results': [{'key': 'featurette', 'type': 'Featurette'},
+                                                     {'key': 'trailer', 'type': 'Trailer'}]}}
+        session = Mock()
+        session.get.side_effect = lambda url, **kwargs: Mock(json=Mock(return_value=replies[url.split('/3', 1)[1]]))
+        with patch('requests.Session', return_value=session):
+            self.assertEqual(moviedb_trailer('The Matrix', 'key', 1), {'youtube_id': 'trailer', 'title': 'The Matrix'})
+        # The same two calls the listener makes
+        self.assertEqual([x[0][0].split('/3', 1)[1] for x in session.get.call_args_list], list(replies))
+
+    def test_deadline_starts_with_lookup(self):
+        resolver = Resolver(timeout=0.2)
+        with patch('lambda_function.resolve.youtube_videos', side_effect=lambda *args: time.sleep(0.5) or ['late']):
+            lookup = resolver.videos('songs')
+            # e.g. finding the room
+            time.sleep(0.15)
+            started = time.monotonic()
+            self.assertIsNone(lookup.result())
+        self.assertLess(time.monotonic() - started, 0.15)
+
+    def test_failed_lookup(self):
+        resolver = Resolver(timeout=1)
+        with patch('lambda_function.resolve.youtube_videos', side_effect=IOError('Connection refused')):
+            self.assertIsNone(resolver.videos('songs').result())
+        # No MovieDb key, no lookup
+        self.assertIsNone(Resolver(moviedb_api_key=None).trailer('The Matrix'))
+
+class TestResolvedCommands(FakeSkillTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.skill = self.start_skill()
+        self.cc = self.cast()
+
+    def test_video_ids_skip_search(self):
+        with patch('local.youtube.search') as search:
+            self.skill.run_command('play_video', {
+                'title': 'songs', 'app': 'youtube', 'videos': [{'id': 'a', 'playlist_id': None}]}, 'Living Room TV')
+        self.assertEqual(self.cc.calls, [('youtube.clear_playlist',), ('youtube.play_video', 'a')])
+        search.assert_not_called()
+
+    def test_trailer_id_skips_moviedb(self):
+        with patch('local.moviedb_search.get_movie_trailer_youtube_id') as lookup:
+            self.skill.handle_command('living room', 'play-trailer', {'title': 'The Matrix', 'youtube_id': 'abc'})
+            self.assertEqual(wait_for_calls(self.cc), [('youtube.play_video', 'abc')])
+        lookup.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.room_index import RoomIndex
+
+class TestRoomIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RoomIndex(
+            ['Living Room TV', 'Master Bedroom TV', 'Media Room', 'Bedroom Speaker'],
+            {'Living Room TV': ['lounge', 'front room']})
+
+    def test_exact(self):
+        self.assertEqual(self.index.match('media room'), 'Media Room')
+        self.assertEqual(self.index.match('Master Bedroom TV'), 'Master Bedroom TV')
+
+    def test_spoken_variants(self):
+        for room in ['the living room', 'livingroom', 'Living Room', ' living room ', 'lounge', 'the front room']:
+            self.assertEqual(self.index.match(room), 'Living Room TV', room)
+
+    def test_tokens_prefer_closest(self):
+        self.assertEqual(self.index.match('bedroom'), 'Bedroom Speaker')
+        self.assertEqual(self.index.match('master'), 'Master Bedroom TV')
+
+    def test_fuzzy(self):
+        self.assertEqual(self.index.match('living rom'), 'Living Room TV')
+        self.assertEqual(self.index.match('medea room'), 'Media Room')
+
+    def test_rank(self):
+        names = [x[1] for x in self.index.rank('room')]
+        self.assertEqual(names, ['Media Room', 'Living Room TV', 'Bedroom Speaker', 'Master Bedroom TV'])
+
+    def test_no_match(self):
+        self.assertIsNone(self.index.match('garage'))
+        self.assertIsNone(self.index.match('the'))
+
+    def test_alias_for_unknown_device_ignored(self):
+        index = RoomIndex(['Media Room'], {'Kitchen': ['cooking']})
+        self.assertIsNone(index.match('cooking'))
+
+    def test_unicode_names(self):
+        index = RoomIndex(['客厅', 'Küche', 'Media Room', 'The'])
+        self.assertEqual(index.match('medea rom'), 'Media Room')
+        self.assertEqual(index.match('KÜCHE'), 'Küche')
+        self.assertEqual(index.match('客厅'), '客厅')
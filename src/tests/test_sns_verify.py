@@ -0,0 +1,127 @@
+import unittest
+import tempfile
+import hashlib
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from cryptography.hazmat.primitives import serialization
+from local.sns_verify import CertificateStore, SignatureVerifier, SignatureError
+from local.metrics import notifications_dropped_total
+from tests.fake_sns import LocalCertificateAuthority, FakeSnsClient
+from tests.test_subscriber import SubscriberTestCase
+
+class TestSignatureVerifier(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ca = LocalCertificateAuthority()
+
+    def setUp(self):
+        self.ca.fetches = 0
+        self.store = CertificateStore(fetch=self.ca.fetch, ca_certs=[self.ca.ca_cert])
+        self.verifier = SignatureVerifier(self.store)
+        self.sns = FakeSnsClient()
+
+    def test_valid_signatures(self):
+        for version in ['1', '2']:
+            self.verifier.verify(self.ca.sign(self.sns.notification({'command': 'play'}), version))
+        self.assertEqual(self.ca.fetches, 1)
+
+    def test_tampered_message(self):
+        message = self.ca.sign(self.sns.notification({'command': 'play'}))
+        message['Message'] = '{"command": "stop"}'
+        with self.assertRaises(SignatureError):
+            self.verifier.verify(message)
+
+    def test_missing_signature(self):
+        with self.assertRaises(SignatureError):
+            self.verifier.verify(self.sns.notification({'command': 'play'}))
+
+    def test_untrusted_certificate_url(self):
+        message = self.ca.sign(self.sns.notification({'command': 'play'}))
+        for url in ['http://sns.eu-west-1.amazonaws.com/cert.pem', 'https://sns.eu-west-1.amazonaws.com.example.com/cert.pem',
+                    'https://example.com/cert.pem']:
+            message['SigningCertURL'] = url
+            with self.assertRaises(SignatureError):
+                self.verifier.verify(message)
+        self.assertEqual(self.ca.fetches, 0)
+
+    def test_certificate_from_another_ca(self):
+        other = LocalCertificateAuthority()
+        verifier = SignatureVerifier(CertificateStore(fetch=other.fetch, ca_certs=[self.ca.ca_cert]))
+        with self.assertRaises(SignatureError):
+            verifier.verify(other.sign(self.sns.notification({'command': 'play'})))
+
+    def test_failed_fetch_is_remembered(self):
+        message = self.ca.sign(self.sns.notification({'command': 'play'}))
+        for error in [OSError('Connection refused'), None]:
+            fetches = []
+
+            def fetch(url):
+                fetches.append(url)
+                if error:
+                    raise error
+                return b'not a certificate'
+            verifier = SignatureVerifier(CertificateStore(fetch=fetch, failure_ttl=0.2))
+            for i in range(3):
+                with self.assertRaises(SignatureError):
+                    verifier.verify(message)
+            self.assertEqual(len(fetches), 1)
+            time.sleep(0.3)
+            with self.assertRaises(SignatureError):
+                verifier.verify(message)
+            self.assertEqual(len(fetches), 2)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            message = self.ca.sign(self.sns.notification({'command': 'play'}))
+            SignatureVerifier(CertificateStore(directory, fetch=self.ca.fetch)).verify(message)
+            SignatureVerifier(CertificateStore(directory, fetch=self.ca.fetch)).verify(message)
+            self.assertEqual(self.ca.fetches, 1)
+
+    def test_expired_disk_cache_is_fetched_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            message = self.ca.sign(self.sns.notification({'command': 'play'}))
+            cache_file = os.path.join(directory, hashlib.sha256(self.ca.CERT_URL.encode('utf-8')).hexdigest() + '.pem')
+            for pem in [self.ca.expired_cert.public_bytes(serialization.Encoding.PEM), b'not a certificate']:
+                with open(cache_file, 'wb') as f:
+                    f.write(pem)
+                SignatureVerifier(CertificateStore(directory, fetch=self.ca.fetch)).verify(message)
+                with open(cache_file, 'rb') as f:
+                    self.assertEqual(f.read(), self.ca.cert_pem)
+            self.assertEqual(self.ca.fetches, 2)
+
+    def test_expired_certificate_is_evicted(self):
+        message = self.ca.sign(self.sns.notification({'command': 'play'}))
+        self.verifier.verify(message)
+        self.store.certs[self.ca.CERT_URL] = self.ca.expired_cert
+        self.verifier.verify(message)
+        self.assertEqual(self.ca.fetches, 2)
+        self.assertEqual(self.store.certs[self.ca.CERT_URL], self.ca.cert)
+
+class TestVerifiedSubscriber(SubscriberTestCase):
+
+    signer = LocalCertificateAuthority()
+
+    def verifier(self):
+        return SignatureVerifier(CertificateStore(fetch=self.signer.fetch, ca_certs=[self.signer.ca_cert]))
+
+    def test_signed_message(self):
+        self.publish()
+        self.assertTrue(self.handled.wait(2))
+
+    def test_rejected_messages(self):
+        invalid = notifications_dropped_total.value(reason='invalid_signature')
+        wrong_topic = notifications_dropped_total.value(reason='wrong_topic')
+        unsigned = FakeSnsClient(self.sns.topic_arn)
+        endpoint = self.sns.endpoints[0]
+        self.sns.post(endpoint, unsigned.notification({'handler_name': 'chromecast', 'room': 'x', 'command': 'play', 'data': {}}))
+        other_topic = FakeSnsClient('arn:aws:sns:eu-west-1:123456789012:Other', signer=self.signer)
+        self.sns.post(endpoint, other_topic.notification({'handler_name': 'chromecast', 'room': 'x', 'command': 'play', 'data': {}}))
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and notifications_dropped_total.value(reason='wrong_topic') == wrong_topic:
+            time.sleep(0.01)
+        self.assertEqual(notifications_dropped_total.value(reason='invalid_signature'), invalid + 1)
+        self.assertEqual(notifications_dropped_total.value(reason='wrong_topic'), wrong_topic + 1)
+        self.skill.handle_command.assert_not_called()
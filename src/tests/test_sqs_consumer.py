@@ -0,0 +1,121 @@
+import unittest
+import threading
+import json
+import sys
+import os
+from mock import Mock, patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.sqs_consumer import SqsConsumer
+from local.SkillSubscriber import Subscriber, TRANSPORT_SQS, SERVER_MODE_THREADED
+from local.sns_verify import SignatureVerifier, CertificateStore
+from tests.fake_sqs import FakeSqsClient
+from tests.fake_sns import FakeSnsClient, LocalCertificateAuthority
+
+class TestSqsConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.sqs = FakeSqsClient()
+        self.handled = []
+        self.consumer = SqsConsumer(self.sqs.queue_url, lambda x: self.handled.append(x['Body']), self.sqs,
+                                    wait_time=0)
+
+    def send(self, count):
+        for i in range(count):
+            self.sqs.send_message(self.sqs.queue_url, str(i))
+
+    def test_batch_receive_and_delete(self):
+        self.send(12)
+        self.assertEqual(self.consumer.poll(), 10)
+        self.assertEqual(self.consumer.poll(), 2)
+        self.assertEqual(self.consumer.poll(), 0)
+        self.assertEqual(self.handled, [str(i) for i in range(12)])
+        self.assertEqual(self.sqs.delete_calls, 2)
+        self.assertEqual(self.sqs.pending(), 0)
+
+    def test_failed_message_is_deleted(self):
+        self.consumer.handle = Mock(side_effect=ValueError('bad message'))
+        self.send(2)
+        self.assertEqual(self.consumer.poll(), 2)
+        self.assertEqual(self.sqs.pending(), 0)
+
+    def test_undeleted_message_is_received_again(self):
+        self.sqs.visibility_timeout = 0
+        self.sqs.fail_deletes = True
+        self.send(1)
+        self.consumer.poll()
+        self.consumer.poll()
+        self.assertEqual(self.handled, ['0', '0'])
+
+    def test_run_until_stopped(self):
+        self.consumer.wait_time = 1
+        thread = threading.Thread(target=self.consumer.run)
+        thread.start()
+        self.send(1)
+        self.consumer.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_backoff_on_errors(self):
+        self.consumer.sqs_client = Mock()
+        self.consumer.sqs_client.receive_message.side_effect = RuntimeError('no network')
+        with patch.object(self.consumer.stopped, 'wait', side_effect=lambda timeout: self.consumer.stop()) as wait:
+            self.consumer.run()
+        wait.assert_called_once_with(1)
+
+class TestSqsSubscriber(unittest.TestCase):
+
+    def setUp(self):
+        self.authority = LocalCertificateAuthority()
+        self.sns = FakeSnsClient(signer=self.authority)
+        self.sqs = FakeSqsClient()
+        self.skill = Mock()
+        self.handled = threading.Event()
+        self.skill.handle_command.side_effect = lambda *args: self.handled.set()
+        verifier = SignatureVerifier(CertificateStore(fetch=self.authority.fetch))
+        with patch('local.SkillSubscriber.miniupnpc') as upnp, \
+                patch.object(Subscriber, 'get_external_ip') as get_external_ip:
+            self.subscriber = Subscriber({'chromecast': self.skill}, None, None, topic_arn=self.sns.topic_arn,
+                                         server_mode=SERVER_MODE_THREADED, sns_client=self.sns, serve=False,
+                                         verifier=verifier, transport=TRANSPORT_SQS,
+                                         queue_url=self.sqs.queue_url, sqs_client=self.sqs, sqs_wait_time=0)
+        upnp.UPnP.assert_not_called()
+        get_external_ip.assert_not_called()
+        self.assertEqual(self.sns.endpoints, [])
+
+    def test_sns_message(self):
+        self.sqs.send_sns(self.sns, {'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'pause', 'data': {}})
+        self.assertEqual(self.subscriber.consumer.poll(), 1)
+        self.assertTrue(self.handled.wait(2))
+        self.skill.handle_command.assert_called_once_with('Kitchen', 'pause', {})
+
+    def test_unsigned_sns_message_is_dropped(self):
+        self.sns.signer = None
+        self.sqs.send_sns(self.sns, {'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'pause', 'data': {}})
+        self.subscriber.consumer.poll()
+        self.subscriber.verify_executor.submit(lambda: None).result(2)
+        self.skill.handle_command.assert_not_called()
+
+    def test_raw_message(self):
+        self.sqs.send_message(self.sqs.queue_url, json.dumps(
+            {'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'play', 'data': {}}))
+        self.subscriber.consumer.poll()
+        self.assertTrue(self.handled.wait(2))
+        self.skill.handle_command.assert_called_once_with('Kitchen', 'play', {})
+
+    def test_redelivered_message_is_dropped(self):
+        self.sqs.visibility_timeout = 0
+        self.sqs.fail_deletes = True
+        self.sqs.send_message(self.sqs.queue_url, json.dumps(
+            {'handler_name': 'chromecast', 'room': 'Kitchen', 'command': 'play', 'data': {}}))
+        self.subscriber.consumer.poll()
+        self.subscriber.consumer.poll()
+        self.assertTrue(self.handled.wait(2))
+        self.subscriber.dispatcher.shutdown(wait=True)
+        self.assertEqual(self.skill.handle_command.call_count, 1)
+
+    def test_queue_url_required(self):
+        with self.assertRaises(ValueError):
+            Subscriber({}, None, None, sns_client=self.sns, serve=False, transport=TRANSPORT_SQS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import threading
+import time
+import sys
+import os
+import json
+import urllib.request
+import urllib.error
+from mock import Mock, patch
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from local.SkillSubscriber import Subscriber, SERVER_MODE_SIMPLE, SERVER_MODE_THREADED
+from tests.fake_sns import FakeSnsClient
+from tests import benchmark_local
+
+class SubscriberTestCase(unittest.TestCase):
+    """ Runs a Subscriber on a local port with a fake SNS client """
+
+    server_mode = SERVER_MODE_SIMPLE
+    signer = None
+
+    def verifier(self):
+        return None
+
+    def setUp(self):
+        self.sns = FakeSnsClient(signer=self.signer)
+        self.skill = Mock()
+        self.handled = threading.Event()
+        self.skill.handle_command.side_effect = lambda *args: self.handled.set()
+        self.subscriber = Subscriber({'chromecast': self.skill}, '127.0.0.1', '0', topic_arn=self.sns.topic_arn,
+                                     server_mode=self.server_mode, sns_client=self.sns, serve=False,
+                                     verifier=self.verifier(), status_address=('127.0.0.1', 0))
+        self.addCleanup(self.subscriber.stop)
+        threading.Thread(target=self.subscriber.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.subscriber.server.server_close)
+        self.addCleanup(self.subscriber.server.shutdown)
+        self.assertTrue(self.sns.confirmed.wait(5))
+
+    def publish(self, command='pause', room='Living Room', data=None):
+        return self.sns.publish_message({
+            'handler_name': 'chromecast',
+            'room': room,
+            'command': command,
+            'data': data or {}
+        })
+
+class TestSubscriber(SubscriberTestCase):
+
+    def test_dispatch(self):
+        self.publish('set-volume', data={'volume': 5})
+        self.assertTrue(self.handled.wait(2))
+        self.skill.handle_command.assert_called_once_with('Living Room', 'set-volume', {'volume': 5})
+
+    def test_dispatch_batch(self):
+        self.skill.handle_batch.side_effect = lambda *args: self.handled.set()
+        self.sns.publish_message({
+            'handler_name': 'chromecast',
+            'rooms': ['Living Room', 'Kitchen'],
+            'commands': [{'command': 'set-volume', 'data': {'volume': 5}}, {'command': 'play'}]
+        })
+        self.assertTrue(self.handled.wait(2))
+        self.skill.handle_batch.assert_called_once_with(
+            ['Living Room', 'Kitchen'], [('set-volume', {'volume': 5}), ('play', {})], True)
+        self.skill.handle_command.assert_not_called()
+
+    def status_url(self, path):
+        return 'http://127.0.0.1:%i%s' % (self.subscriber.status_server.server_port, path)
+
+    def test_status(self):
+        self.skill.status.return_value = {'Living Room TV': {'connected': True}}
+        with urllib.request.urlopen(self.status_url('/status')) as response:
+            self.assertEqual(json.loads(response.read().decode('utf-8')),
+                             {'chromecast': {'Living Room TV': {'connected': True}}})
+        # Not on the port SNS posts to, which is forwarded to the internet
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(self.subscriber.endpoint_url + '/status')
+        self.assertEqual(error.exception.code, 404)
+
+    def test_metrics(self):
+        self.publish()
+        with urllib.request.urlopen(self.status_url('/metrics')) as response:
+            text = response.read().decode('utf-8')
+        self.assertIn('alexa_chromecast_notifications_total{type="Notification"}', text)
+        self.assertIn('alexa_chromecast_stage_seconds_count{stage="dispatch"}', text)
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(self.subscriber.endpoint_url + '/metrics')
+
+class TestThreadedSubscriber(SubscriberTestCase):
+
+    server_mode = SERVER_MODE_THREADED
+
+    def test_ack_before_dispatch(self):
+        release = threading.Event()
+        running = threading.Event()
+
+        def handle_command(*args):
+            running.set()
+            release.wait(5)
+
+        self.skill.handle_command.side_effect = handle_command
+        started = time.perf_counter()
+        self.publish()
+        self.assertTrue(running.wait(2))
+        self.publish()
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual(self.subscriber.dispatcher.pending('Living Room'), 1)
+        release.set()
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_benchmark_runs(self):
+        with patch('builtins.print'):
+            result = benchmark_local.main(['--devices', '2', '--rate', '20', '--duration', '0.5', '--no-coalesce',
+                                           '--search-latency', '0', '--device-latency', '0', '--server-mode', 'threaded'])
+        self.assertEqual(result['sent'], 10)
+        self.assertEqual(result['completed'], 10)
+        self.assertIn('p99', result['dispatch_latency_ms'])
@@ -0,0 +1,121 @@
+import unittest
+from mock import Mock
+import sys
+import os
+import time
+import threading
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from casttube import YouTubeSession
+from pychromecast.config import APP_YOUTUBE
+from local.ChromecastSkill import MyYouTubeController
+from local.warm_apps import (WarmPolicy, parse_hours, within_hours, youtube_starts_total, SESSION_MAX_AGE,
+                             WARM_IDLE, WARM_SESSION)
+from tests.fake_chromecast import FakeSkillTestCase
+
+class TestHours(unittest.TestCase):
+
+    def test_hours(self):
+        self.assertIsNone(parse_hours(''))
+        self.assertEqual(parse_hours('7-23'), (7, 23))
+        self.assertRaises(ValueError, parse_hours, '7-25')
+        self.assertTrue(within_hours(None, 3))
+        self.assertEqual([within_hours((7, 23), x) for x in (6, 7, 22, 23)], [False, True, True, False])
+        # Past midnight
+        self.assertEqual([within_hours((18, 2), x) for x in (17, 18, 1, 2)], [False, True, True, False])
+
+class TestSessionReady(unittest.TestCase):
+
+    def setUp(self):
+        self.yt = MyYouTubeController()
+        self.yt._socket_client = Mock(app_namespaces=[self.yt.namespace])
+        session = YouTubeSession('screen')
+        session._lounge_token, session._gsession_id = 'token', 'gsession'
+        session._get_lounge_id = Mock()
+        session._bind = Mock()
+        session._initialize_queue = Mock()
+        self.yt._screen_id, self.yt._session = 'screen', session
+        self.session = session
+
+    def test_warm_play_only_binds(self):
+        self.yt.session_refreshed = time.monotonic()
+        self.assertTrue(self.yt.session_ready())
+        self.yt.play_video('a')
+        self.session._get_lounge_id.assert_not_called()
+        self.session._bind.assert_called_once_with()
+        self.session._initialize_queue.assert_called_once_with('a', None)
+
+    def test_stale_session_starts_again(self):
+        self.yt.session_refreshed = time.monotonic() - SESSION_MAX_AGE - 1
+        self.assertFalse(self.yt.session_ready())
+        self.yt.play_video('a')
+        self.session._get_lounge_id.assert_called_once_with()
+        self.assertTrue(self.yt.session_ready())
+
+    def test_not_running(self):
+        self.yt.session_refreshed = time.monotonic()
+        self.yt._socket_client.app_namespaces = []
+        self.assertFalse(self.yt.session_ready())
+
+class TestAppWarmer(FakeSkillTestCase):
+
+    def start(self, mode):
+        # A long interval, so warming only happens when the test asks for it
+        self.skill = self.start_skill(warm_policy=WarmPolicy(mode, 3600, (7, 23)))
+        self.cc = self.cast()
+        self.wrapper = self.skill.get_chromecast('Living Room TV')
+
+    def test_idle_device_is_launched(self):
+        self.start(WARM_IDLE)
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'launched')
+        self.assertEqual(self.cc.calls, [('start_app', APP_YOUTUBE), ('youtube.refresh_session',)])
+
+    def test_warm_up_waits_for_commands(self):
+        self.start(WARM_IDLE)
+        # The pause holds up the device's queue for several warming intervals
+        self.cc.latency = 0.5
+        self.skill.handle_command('Living Room TV', 'pause', {})
+        warmer = self.wrapper.warmer
+        warmer.policy = WarmPolicy(WARM_IDLE, 0.05, None)
+        threading.Thread(target=warmer.run, daemon=True).start()
+        time.sleep(0.3)
+        # Only one warm-up waits behind the pause
+        self.assertEqual(self.wrapper.commands.submitted, 2)
+        deadline = time.monotonic() + 5
+        while len(self.cc.calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.cc.calls[:3], [('pause',), ('start_app', APP_YOUTUBE), ('youtube.refresh_session',)])
+
+    def test_busy_devices_are_left_alone(self):
+        self.start(WARM_IDLE)
+        self.cc.push_status(app_id='CC1AD845', display_name='Default Media Receiver')
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'busy')
+        # A TV in standby or on another input could be switched over by launching an app
+        self.cc.push_status(is_stand_by=True)
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'busy')
+        self.cc.push_status(is_active_input=False)
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'busy')
+        self.assertEqual(self.wrapper.warmer.warm(hour=3), 'outside_hours')
+        self.assertEqual(self.cc.calls, [])
+
+    def test_session_policy_never_launches(self):
+        self.start(WARM_SESSION)
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'idle')
+        self.cc.push_status(app_id=APP_YOUTUBE, display_name='YouTube')
+        self.assertEqual(self.wrapper.warmer.warm(hour=12), 'refreshed')
+        self.assertEqual(self.cc.calls, [('youtube.refresh_session',)])
+
+    def test_warm_start_is_counted(self):
+        self.start(WARM_SESSION)
+        self.cc.push_status(app_id=APP_YOUTUBE, display_name='YouTube')
+        self.wrapper.warmer.warm(hour=12)
+        warm = youtube_starts_total.value(start='warm')
+        self.skill.run_command('play_trailer', {'title': 'The Matrix', 'youtube_id': 'abc'}, 'Living Room TV')
+        self.assertEqual(self.cc.calls[-1], ('youtube.play_video', 'abc'))
+        self.assertEqual(youtube_starts_total.value(start='warm') - warm, 1)
+
+    def test_off_by_default(self):
+        self.skill = self.start_skill()
+        self.assertIsNone(self.skill.get_chromecast('Living Room TV').warmer)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from mock import Mock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
+from casttube import YouTubeSession
+from local.ChromecastSkill import MyYouTubeController
+from local.youtube_queue import QueueModel, queue_navigation_total
+from tests.fake_chromecast import FakeSkillTestCase, wait_for_calls
+
+class TestQueueModel(unittest.TestCase):
+
+    def test_sync(self):
+        queue = QueueModel()
+        queue.reset(['a', 'b', 'c', 'b'])
+        self.assertTrue(queue.sync('b'))
+        self.assertEqual(queue.position, 1)
+        # The nearest copy after the current position
+        queue.position = 2
+        self.assertTrue(queue.sync('b'))
+        self.assertEqual(queue.position, 3)
+        # Nothing playing changes nothing
+        self.assertTrue(queue.sync(None))
+        self.assertFalse(queue.sync('x'))
+        self.assertFalse(queue.in_sync)
+
+    def test_target(self):
+        queue = QueueModel()
+        queue.reset(['a', 'b', 'c'], 1)
+        self.assertEqual((queue.target(-1), queue.target(1), queue.target(2)), (0, 2, None))
+        self.assertEqual((queue.target(index=2), queue.target(index=3)), (2, None))
+        queue.sync('x')
+        self.assertIsNone(queue.target(1))
+
+class TestQueueNavigation(unittest.TestCase):
+
+    def setUp(self):
+        self.yt = MyYouTubeController()
+        session = YouTubeSession('screen')
+        session._lounge_token, session._gsession_id, session._sid = 'token', 'gsession', 'sid'
+        session._bind = Mock()
+        session._do_post = Mock(side_effect=lambda *args, **kwargs: setattr(session, '_req_count', session._req_count + 1))
+        session.get_queue_playlist_id = Mock(return_value='TQlist')
+        session.get_queue_videos = Mock(return_value=[{'data-video-id': x} for x in ['a', 'b', 'c', 'd']])
+        self.yt._screen_id, self.yt._session = 'screen', session
+        self.session = session
+
+    def posted(self):
+        return [x[1]['data'] for x in self.session._do_post.call_args_list]
+
+    def test_previous_is_one_request(self):
+        self.yt.queue.reset(['a', 'b', 'c'], list_id='TQlist')
+        direct = queue_navigation_total.value(result='direct')
+        self.assertTrue(self.yt.play_from_queue('c', -1))
+        self.assertEqual(self.posted(), [{'count': 1, 'req0__sc': 'setPlaylist', 'req0_videoId': 'b',
+                                          'req0_listId': 'TQlist', 'req0_currentIndex': 1,
+                                          'req0_currentTime': 0, 'req0_audioOnly': 'false'}])
+        self.session.get_queue_videos.assert_not_called()
+        self.assertEqual(self.yt.queue.position, 1)
+        self.assertEqual(queue_navigation_total.value(result='direct') - direct, 1)
+
+    def test_list_id_looked_up_once(self):
+        self.yt.queue.reset(['a', 'b', 'c'])
+        self.assertTrue(self.yt.play_from_queue('a', 1))
+        self.assertTrue(self.yt.play_from_queue('b', index=2))
+        self.session.get_queue_playlist_id.assert_called_once_with()
+        self.assertEqual([x['req%i_videoId' % i] for i, x in enumerate(self.posted())], ['b', 'c'])
+
+    def test_out_of_sync_reads_queue(self):
+        self.yt.queue.reset(['x'], list_id='TQold')
+        resynced = queue_navigation_total.value(result='resynced')
+        self.assertTrue(self.yt.play_from_queue('c', -1))
+        self.session.get_queue_videos.assert_called_once_with()
+        self.assertEqual(self.yt.queue.video_ids, ['a', 'b', 'c', 'd'])
+        # No clearing and adding back, just the one move
+        self.assertEqual(len(self.posted()), 1)
+        self.assertEqual(self.posted()[0]['req0_videoId'], 'b')
+        self.assertEqual(queue_navigation_total.value(result='resynced') - resynced, 1)
+
+    def test_nothing_before_first(self):
+        self.yt.queue.reset(['a', 'b'], list_id='TQlist')
+        self.assertFalse(self.yt.play_from_queue('a', -1))
+        self.assertEqual(self.posted(), [])
+
+class TestSkillQueue(FakeSkillTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.skill = self.start_skill()
+        self.cc = self.cast()
+        self.wrapper = self.skill.get_chromecast('Living Room TV')
+
+    def test_position_follows_media_status(self):
+        self.wrapper.youtube_controller.queue.reset(['a', 'b', 'c'])
+        self.cc.media_controller.push_status('c')
+        self.assertEqual(self.skill.status()['Living Room TV']['queue_position'], 2)
+
+    def test_play_item(self):
+        self.cc.media_controller.push_status('a')
+        self.skill.handle_command('living room', 'play-item', {'position': 3})
+        self.assertEqual(wait_for_calls(self.cc), [('youtube.play_from_queue', 'a', 0, 2)])
+
+    def test_other_app_is_left_alone(self):
+        self.cc.push_status(app_id='CC1AD845', display_name='Default Media Receiver')
+        self.cc.media_controller.push_status('a')
+        self.skill.handle_command('living room', 'play-next', {})
+        self.assertEqual(wait_for_calls(self.cc), [('skip',)])
+
+if __name__ == '__main__':
+    unittest.main()